@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+N3 Local Brain 常駐クエリサーバー
+query_brain.py / inspect_brain.py を毎回起動する代わりに、温まった読み取り専用接続で応答する
+
+python3 brain_server.py                          # 127.0.0.1:8765
+python3 brain_server.py --db ./n3_local_brain.sqlite --port 8765 --pool 4
+
+クライアント:
+N3_BRAIN_URL=http://127.0.0.1:8765 python3 query_brain.py search 'burnLimit'
+curl -s localhost:8765/search -d '{"query": "burnLimit", "k": 5}'
+curl -s localhost:8765/sql -d '{"sql": "SELECT file_path FROM code_map WHERE file_type = ?", "params": ["py"], "limit": 20}'
+curl -s localhost:8765/similar -d '{"id": "<chunk id>", "k": 10}'
+curl -s localhost:8765/inspect                 # ?pages=1 で dbstat のページ使用量も
+curl -s localhost:8765/health
+
+- 接続プール: mode=ro + query_only、スレッドごとに1接続を貸し出し
+- 接続ごとにプリペアドステートメントのキャッシュ（同じSQL文字列は再コンパイルしない）
+- mmap_size・cache_size はDBファイルのサイズに合わせる
+- 類似検索のベクトル行列は読み込んだまま保持（code_map の変化は一定間隔で確認して再読み込み）
+- 127.0.0.1 のみで待ち受け（外部公開しない）
+"""
+
+import os
+import sys
+import json
+import time
+import queue
+import sqlite3
+import argparse
+import threading
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from query_brain import DB_PATH, COMMANDS, connect, dispatch, load_vectors, cache_key, _json_default
+from inspect_brain import describe
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+DEFAULT_POOL = 4
+DEFAULT_STATEMENT_CACHE = 512
+
+# 1接続あたりのページキャッシュ上限（DBがこれより小さければDBサイズ）
+MAX_CACHE_BYTES = 512 * 1024 * 1024
+# ベクトル行列の鮮度確認の間隔（秒）
+VECTOR_CHECK_INTERVAL = 5.0
+
+
+class ConnectionPool:
+    """読み取り専用接続のプール"""
+
+    def __init__(self, db_path: Path, size: int = DEFAULT_POOL, cached_statements: int = DEFAULT_STATEMENT_CACHE):
+        self.db_path = db_path
+        self.size = max(1, size)
+        db_bytes = os.path.getsize(db_path)
+        self._idle: queue.Queue = queue.Queue()
+        for _ in range(self.size):
+            conn = connect(db_path, read_only=True, cached_statements=cached_statements)
+            conn.execute('PRAGMA query_only = ON')
+            conn.execute('PRAGMA temp_store = MEMORY')
+            # DB全体をメモリマップ（OSのページキャッシュを接続間で共有）
+            conn.execute(f'PRAGMA mmap_size = {db_bytes + 64 * 1024 * 1024}')
+            conn.execute(f'PRAGMA cache_size = {-(min(db_bytes, MAX_CACHE_BYTES) // 1024 + 1)}')
+            self._idle.put(conn)
+
+    @contextmanager
+    def acquire(self):
+        conn = self._idle.get()
+        try:
+            yield conn
+        finally:
+            self._idle.put(conn)
+
+    def warm(self, chunk_size: int = 8 * 1024 * 1024) -> int:
+        """DBファイルを一度読み切ってOSのページキャッシュに載せる（mmap 経由で全接続が共有）"""
+        total = 0
+        with open(self.db_path, 'rb') as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                total += len(chunk)
+        with self.acquire() as conn:
+            conn.execute('SELECT COUNT(*) FROM sqlite_master').fetchone()
+        return total
+
+    def close(self):
+        while not self._idle.empty():
+            self._idle.get().close()
+
+
+class VectorCache:
+    """類似検索の行列を保持し、code_map が変わっていれば読み直す"""
+
+    def __init__(self, db_path: Path, check_interval: float = VECTOR_CHECK_INTERVAL):
+        self.db_path = db_path
+        self.check_interval = check_interval
+        self._loaded: Optional[Tuple] = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self, conn: sqlite3.Connection) -> Tuple:
+        with self._lock:
+            now = time.monotonic()
+            if self._loaded is None or now - self._checked_at >= self.check_interval:
+                if self._loaded is None or self._loaded[2]['key'] != cache_key(conn):
+                    self._loaded = load_vectors(conn, self.db_path)
+                self._checked_at = now
+            return self._loaded
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded is not None
+
+
+class BrainServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], db_path: Path, pool_size: int):
+        self.db_path = db_path
+        self.pool = ConnectionPool(db_path, pool_size)
+        self.vectors = VectorCache(db_path)
+        self.started_at = time.time()
+        self.stats = {'requests': 0, 'errors': 0}
+        self._stats_lock = threading.Lock()
+        super().__init__(address, BrainHandler)
+
+    def count(self, key: str):
+        with self._stats_lock:
+            self.stats[key] += 1
+
+
+class BrainHandler(BaseHTTPRequestHandler):
+    # keep-alive（同じ接続で連続して問い合わせるクライアント向け）
+    protocol_version = 'HTTP/1.1'
+    # ヘッダーと本文を別々に送るため、Nagle + 遅延ACKで1往復 ~40ms 待たされるのを防ぐ
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, payload: Dict):
+        body = json.dumps(payload, ensure_ascii=False, default=_json_default).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        server: BrainServer = self.server
+        server.count('requests')
+        path, _, query = self.path.partition('?')
+        path = path.strip('/')
+        if path == 'health':
+            self._send(200, {
+                'db': str(server.db_path),
+                'dbBytes': os.path.getsize(server.db_path),
+                'pool': server.pool.size,
+                'vectorsLoaded': server.vectors.loaded,
+                'uptimeSec': round(time.time() - server.started_at, 1),
+                **server.stats,
+            })
+        elif path == 'inspect':
+            with server.pool.acquire() as conn:
+                self._send(200, {'result': describe(conn, pages='pages=1' in query.split('&'))})
+        else:
+            server.count('errors')
+            self._send(404, {'error': f'not found: /{path}'})
+
+    def do_POST(self):
+        server: BrainServer = self.server
+        server.count('requests')
+        command = self.path.split('?', 1)[0].strip('/')
+        # keep-alive の次のリクエストと混ざらないよう、どの応答でも先に本文を読み切る
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+        except ValueError:
+            length = -1
+        if length < 0:
+            self.close_connection = True
+            server.count('errors')
+            self._send(400, {'error': 'invalid Content-Length'})
+            return
+        body = self.rfile.read(length)
+        if command not in COMMANDS:
+            server.count('errors')
+            self._send(404, {'error': f'not found: /{command}'})
+            return
+        try:
+            payload = json.loads(body or b'{}')
+            if not isinstance(payload, dict):
+                raise TypeError(f'payload must be a JSON object, got {type(payload).__name__}')
+            started = time.perf_counter()
+            with server.pool.acquire() as conn:
+                result = dispatch(conn, command, payload, lambda: server.vectors.get(conn))
+            elapsed_ms = (time.perf_counter() - started) * 1000
+        except (ValueError, KeyError, TypeError, RuntimeError, sqlite3.Error) as e:
+            server.count('errors')
+            self._send(400, {'error': f'{type(e).__name__}: {e}'})
+            return
+        self._send(200, {'result': result, 'elapsedMs': round(elapsed_ms, 3)})
+
+
+def main():
+    parser = argparse.ArgumentParser(description='N3 Local Brain 常駐クエリサーバー')
+    parser.add_argument('--db', default=str(DB_PATH), help=f'SQLite（デフォルト: {DB_PATH}）')
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--pool', type=int, default=DEFAULT_POOL, help='読み取り専用接続の数')
+    parser.add_argument('--no-warm', action='store_true', help='起動時にページを読み込まない')
+    args = parser.parse_args()
+
+    db_path = Path(args.db)
+    if not db_path.exists():
+        print(f"ERROR: {db_path} がありません", file=sys.stderr)
+        sys.exit(1)
+
+    server = BrainServer((args.host, args.port), db_path, args.pool)
+    if not args.no_warm:
+        started = time.perf_counter()
+        server.pool.warm()
+        print(f"ウォームアップ: {(time.perf_counter() - started) * 1000:.0f}ms", file=sys.stderr)
+    print(f"N3 Local Brain サーバー: http://{args.host}:{args.port}（{db_path}, 接続 {server.pool.size}）", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.pool.close()
+
+
+if __name__ == '__main__':
+    main()
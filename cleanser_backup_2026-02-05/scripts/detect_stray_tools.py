@@ -2,178 +2,269 @@
 """
 N3 Empire OS - 野良ツール自動掃討システム
 related_toolsが途切れている「孤立ファイル」を検出し、適切なカテゴリに再編
+
+- 分類は旧実装と同じ
+  孤立: related_tools が NULL・空文字・'[]'・'null'
+  弱接続: それ以外で、パースした値の len()（配列は要素数、オブジェクトはキー数、文字列は文字数）が
+          min_connections 未満（'{}' や '[ ]' は 0 件の弱接続）。数値・真偽値・不正なJSONはどちらにも含めない
+- 分類と要素数は生成列 code_map.related_count（インデックス付き）に持つ。
+  孤立は -2、数えられない値は NULL。オブジェクトは生成列では数えられないため -1 とし、該当行だけ json_each で数える
+- 推奨接続先は stray_tool_rules テーブル（初回に既定ルールを投入、以降はSQLで編集可）とのJOINで求める
+- レポートは件数2回 + 上位20件×2回のクエリ（code_map 全行をPythonで読まない）
+
+スキーマ変更（レポート専用ツールだが、初回実行時に共有DBへ書き込む）:
+- code_map に生成列 related_count（VIRTUAL）とインデックス idx_code_map_related_count を追加
+  （生成式が古い場合は作り直す）
+- stray_tool_rules テーブルを作成して既定ルールを投入
+→ DBへの書き込み権限が必要。変更した場合は実行時に表示する
 """
 
 import sqlite3
 import json
+import argparse
 from pathlib import Path
-from typing import List, Dict, Set
+from typing import List, Dict
 
 DB_PATH = Path(__file__).parent.parent / "lib" / "data" / "n3_local_brain.sqlite"
 
+RULES_TABLE = 'stray_tool_rules'
+
+# 推奨ルール: (category, tech_stack, パスに含まれる文字列, 大文字小文字を無視, 推奨接続先)
+# None の条件は「問わない」。上から順に並べて表示する
+DEFAULT_RULES = [
+    # カテゴリベースの推薦
+    ('api', None, None, 0, '14_API連携'),
+    ('api', None, None, 0, 'システム'),
+    ('tool', None, 'editing', 1, '04_商品編集'),
+    ('tool', None, 'listing', 1, '08_出品管理'),
+    ('tool', None, 'research', 1, '10_リサーチ'),
+    ('tool', None, 'dashboard', 1, '01_ダッシュボード'),
+    ('component', None, None, 0, 'UI/UX'),
+    ('lib', None, None, 0, '共通モジュール'),
+    ('service', None, None, 0, '共通モジュール'),
+    ('migration', None, None, 0, 'Database'),
+    # 技術スタックベースの推薦
+    (None, 'sql', None, 0, 'Database'),
+    (None, 'postgresql', None, 0, 'Database'),
+    (None, 'json', 'n8n', 0, 'n8n'),
+    (None, 'json', 'workflow', 0, '自動化'),
+    # パスベースの推薦
+    (None, None, 'n8n', 0, 'n8n'),
+    (None, None, 'n8n', 0, '自動化'),
+    (None, None, 'n8n', 0, '司令塔'),
+    (None, None, 'inventory', 0, '在庫'),
+    (None, None, 'pricing', 0, '05_利益計算'),
+    (None, None, 'profit', 0, '05_利益計算'),
+    (None, None, 'shipping', 0, '出荷'),
+    (None, None, 'ebay', 0, 'eBay'),
+    (None, None, 'amazon', 0, 'Amazon'),
+]
+
+# related_count の特別な値: 孤立（旧実装の孤立条件）/ JSON オブジェクト（キー数は CONNECTIONS_SQL で数える）
+RELATED_ISOLATED = -2
+RELATED_OBJECT = -1
+
+# 生成列 related_count の式（sqlite_master の定義と照合するため1行で持つ）
+RELATED_COUNT_EXPR = (
+    "CASE WHEN related_tools IS NULL OR related_tools IN ('', '[]', 'null') THEN "
+    f"{RELATED_ISOLATED}"
+    " WHEN NOT json_valid(related_tools) THEN NULL"
+    " WHEN json_type(related_tools) = 'array' THEN json_array_length(related_tools)"
+    f" WHEN json_type(related_tools) = 'object' THEN {RELATED_OBJECT}"
+    " WHEN json_type(related_tools) = 'text' THEN length(json_extract(related_tools, '$'))"
+    " ELSE NULL END"
+)
+
+# c（code_map）の接続数（オブジェクトの行だけ json_each でキーを数える）
+CONNECTIONS_SQL = f"""
+    (CASE c.related_count
+          WHEN {RELATED_OBJECT} THEN (SELECT COUNT(*) FROM json_each(c.related_tools))
+          WHEN {RELATED_ISOLATED} THEN 0
+          ELSE c.related_count END)
+"""
+
+# 孤立 / 弱接続（? は min_connections - 1 を2回）
+# インデックスの1回の範囲検索で related_count を絞り、オブジェクトの行だけキー数で判定する
+ISOLATED_WHERE = f"c.related_count = {RELATED_ISOLATED}"
+WEAK_WHERE = f"c.related_count BETWEEN {RELATED_OBJECT} AND ? AND {CONNECTIONS_SQL} <= ?"
+
+# c（code_map）に対して、まだ接続していない推奨先を JSON 配列で返す相関サブクエリ
+# 接続済みの判定は旧実装の `in` と同じ（配列は要素、オブジェクトはキー、文字列は部分一致）
+SUGGESTIONS_SQL = f"""
+    (SELECT json_group_array(suggestion) FROM (
+        SELECT r.suggestion
+        FROM {RULES_TABLE} r
+        WHERE (r.category IS NULL OR r.category = c.category)
+          AND (r.tech_stack IS NULL OR r.tech_stack = c.tech_stack)
+          AND (r.path_contains IS NULL
+               OR instr(CASE WHEN r.ignore_case THEN lower(c.path) ELSE c.path END, r.path_contains) > 0)
+          AND NOT CASE
+              WHEN c.related_count IN (0, {RELATED_ISOLATED}) THEN 0
+              WHEN c.related_count = {RELATED_OBJECT}
+                  THEN EXISTS (SELECT 1 FROM json_each(c.related_tools) j WHERE j.key = r.suggestion)
+              WHEN json_type(c.related_tools) = 'array'
+                  THEN EXISTS (SELECT 1 FROM json_each(c.related_tools) j WHERE j.value = r.suggestion)
+              ELSE instr(json_extract(c.related_tools, '$'), r.suggestion) > 0
+          END
+        GROUP BY r.suggestion
+        ORDER BY MIN(r.id)
+    ))
+"""
+
 class StrayToolDetector:
-    def __init__(self):
-        self.conn = sqlite3.connect(DB_PATH)
+    def __init__(self, db_path: Path = DB_PATH):
+        self.conn = sqlite3.connect(db_path)
         self.conn.row_factory = sqlite3.Row
-        
-    def find_isolated_files(self) -> List[Dict]:
-        """related_toolsが空または不正なファイルを検出"""
-        cursor = self.conn.cursor()
-        
-        # related_toolsが空、null、または"[]"のファイル
-        cursor.execute("""
-            SELECT 
-                id, path, file_name, tool_type, category, 
-                related_tools, tech_stack, file_size
-            FROM code_map
-            WHERE related_tools IS NULL 
-               OR related_tools = ''
-               OR related_tools = '[]'
-               OR related_tools = 'null'
-            ORDER BY category, tool_type
-        """)
-        
-        results = [dict(row) for row in cursor.fetchall()]
+        self.ensure_schema()
+
+    def ensure_schema(self):
+        """related_count 生成列・インデックスとルールテーブルを用意（初回、または生成式の変更時のみ）"""
+        columns = {row['name'] for row in self.conn.execute("SELECT name FROM pragma_table_xinfo('code_map')")}
+        table_sql = self.conn.execute(
+            "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'code_map'"
+        ).fetchone()[0]
+        with self.conn:
+            if 'related_count' in columns and RELATED_COUNT_EXPR not in table_sql:
+                # 旧版の生成式の生成列を作り直す
+                print("ℹ️  code_map.related_count の生成式を更新します")
+                self.conn.execute("DROP INDEX IF EXISTS idx_code_map_related_count")
+                self.conn.execute("ALTER TABLE code_map DROP COLUMN related_count")
+                columns.discard('related_count')
+            if 'related_count' not in columns:
+                print("ℹ️  code_map に生成列 related_count とインデックスを追加します（初回のみ）")
+                # ALTER TABLE で追加できる生成列は VIRTUAL のみ（値はインデックス側に保持される）
+                self.conn.execute(
+                    "ALTER TABLE code_map ADD COLUMN related_count INTEGER "
+                    f"GENERATED ALWAYS AS ({RELATED_COUNT_EXPR}) VIRTUAL"
+                )
+            # related_count の値・範囲で引く（孤立ファイルは category, tool_type 順にそのまま並ぶ）
+            self.conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_code_map_related_count
+                ON code_map(related_count, category, tool_type)
+            """)
+            self.conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS {RULES_TABLE} (
+                    id INTEGER PRIMARY KEY,
+                    category TEXT,
+                    tech_stack TEXT,
+                    path_contains TEXT,
+                    ignore_case INTEGER NOT NULL DEFAULT 0,
+                    suggestion TEXT NOT NULL
+                )
+            """)
+            if not self.conn.execute(f"SELECT 1 FROM {RULES_TABLE} LIMIT 1").fetchone():
+                self.conn.executemany(
+                    f"INSERT INTO {RULES_TABLE} (category, tech_stack, path_contains, ignore_case, suggestion) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    DEFAULT_RULES,
+                )
+
+    def _files(self, where: str, params: tuple = (), limit: int = -1) -> List[Dict]:
+        # 並べ替え・LIMIT を先に済ませ、推奨先の相関サブクエリは返す行だけで実行する
+        cursor = self.conn.execute(f"""
+            SELECT c.*, {SUGGESTIONS_SQL} AS suggestions
+            FROM (
+                SELECT
+                    c.id, c.path, c.file_name, c.tool_type, c.category,
+                    c.related_tools, c.tech_stack, c.file_size, c.related_count,
+                    {CONNECTIONS_SQL} AS connection_count
+                FROM code_map c
+                WHERE {where}
+                ORDER BY connection_count, c.category, c.tool_type
+                LIMIT ?
+            ) c
+        """, (*params, limit))
+        results = []
+        for row in cursor:
+            item = dict(row)
+            del item['related_count']
+            item['suggestions'] = json.loads(item['suggestions'])
+            results.append(item)
         return results
-    
-    def find_weak_connections(self, min_connections: int = 2) -> List[Dict]:
-        """接続数が少ない（孤立しがちな）ファイルを検出"""
-        cursor = self.conn.cursor()
-        
-        cursor.execute("""
-            SELECT 
-                id, path, file_name, tool_type, category,
-                related_tools, tech_stack, file_size
-            FROM code_map
-            WHERE related_tools IS NOT NULL
-              AND related_tools != ''
-              AND related_tools != '[]'
-        """)
-        
-        weak_files = []
-        for row in cursor.fetchall():
-            try:
-                related = json.loads(row['related_tools'])
-                if len(related) < min_connections:
-                    weak_files.append({
-                        **dict(row),
-                        'connection_count': len(related)
-                    })
-            except (json.JSONDecodeError, TypeError):
-                pass
-        
-        return weak_files
-    
+
+    def _count(self, where: str, params: tuple = ()) -> int:
+        return self.conn.execute(f"SELECT COUNT(*) FROM code_map c WHERE {where}", params).fetchone()[0]
+
+    def find_isolated_files(self, limit: int = -1) -> List[Dict]:
+        """related_toolsが空（NULL・空文字・'[]'・'null'）のファイルを検出（推奨接続先つき）"""
+        return self._files(ISOLATED_WHERE, limit=limit)
+
+    def find_weak_connections(self, min_connections: int = 2, limit: int = -1) -> List[Dict]:
+        """接続数が少ない（孤立しがちな）ファイルを検出（未接続の推奨先つき）"""
+        return self._files(WEAK_WHERE, (min_connections - 1,) * 2, limit)
+
+    def count_isolated_files(self) -> int:
+        return self._count(ISOLATED_WHERE)
+
+    def count_weak_connections(self, min_connections: int = 2) -> int:
+        return self._count(WEAK_WHERE, (min_connections - 1,) * 2)
+
     def suggest_connections(self, file_entry: Dict) -> List[str]:
-        """ファイルの特性から適切な接続先を提案"""
-        suggestions = []
-        
-        path = file_entry['path']
-        file_name = file_entry['file_name']
-        category = file_entry['category']
-        tool_type = file_entry.get('tool_type', '')
-        tech_stack = file_entry.get('tech_stack', '')
-        
-        # カテゴリベースの推薦
-        if category == 'api':
-            suggestions.extend(['14_API連携', 'システム'])
-        elif category == 'tool':
-            if 'editing' in path.lower():
-                suggestions.append('04_商品編集')
-            if 'listing' in path.lower():
-                suggestions.append('08_出品管理')
-            if 'research' in path.lower():
-                suggestions.append('10_リサーチ')
-            if 'dashboard' in path.lower():
-                suggestions.append('01_ダッシュボード')
-        elif category == 'component':
-            suggestions.append('UI/UX')
-        elif category == 'lib' or category == 'service':
-            suggestions.append('共通モジュール')
-        elif category == 'migration':
-            suggestions.append('Database')
-        
-        # 技術スタックベースの推薦
-        if tech_stack in ['sql', 'postgresql']:
-            suggestions.append('Database')
-        elif tech_stack in ['json']:
-            if 'n8n' in path:
-                suggestions.append('n8n')
-            elif 'workflow' in path:
-                suggestions.append('自動化')
-        
-        # パスベースの推薦
-        if 'n8n' in path:
-            suggestions.extend(['n8n', '自動化', '司令塔'])
-        if 'inventory' in path:
-            suggestions.append('在庫')
-        if 'pricing' in path or 'profit' in path:
-            suggestions.append('05_利益計算')
-        if 'shipping' in path:
-            suggestions.append('出荷')
-        if 'ebay' in path:
-            suggestions.append('eBay')
-        if 'amazon' in path:
-            suggestions.append('Amazon')
-        
-        return list(set(suggestions))  # 重複除去
-    
-    def generate_report(self):
+        """ファイルの特性から適切な接続先を提案（stray_tool_rules から）"""
+        row = self.conn.execute(
+            f"SELECT {SUGGESTIONS_SQL} FROM (SELECT ? AS path, ? AS category, ? AS tech_stack, "
+            "'[]' AS related_tools, 0 AS related_count) c",
+            (file_entry['path'], file_entry['category'], file_entry.get('tech_stack', '')),
+        ).fetchone()
+        return json.loads(row[0])
+
+    def generate_report(self, min_connections: int = 2, top: int = 20):
         """掃討レポートを生成"""
         print("="*70)
         print("🔍 N3 Empire OS - 野良ツール掃討レポート")
         print("="*70)
         print()
-        
+
         # 完全孤立ファイル
-        isolated = self.find_isolated_files()
-        print(f"【完全孤立ファイル】related_toolsが空: {len(isolated)}件")
+        isolated_count = self.count_isolated_files()
+        print(f"【完全孤立ファイル】related_toolsが空: {isolated_count}件")
         print()
-        
-        if isolated:
-            print("Top 20 孤立ファイル:")
-            for i, file in enumerate(isolated[:20], 1):
-                suggestions = self.suggest_connections(file)
+
+        if isolated_count:
+            print(f"Top {top} 孤立ファイル:")
+            for i, file in enumerate(self.find_isolated_files(limit=top), 1):
+                suggestions = file['suggestions']
                 print(f"{i:3d}. {file['path']}")
                 print(f"     カテゴリ: {file['category']}")
                 print(f"     推奨接続先: {', '.join(suggestions) if suggestions else '（提案なし）'}")
                 print()
-        
+
         print("-"*70)
         print()
-        
+
         # 弱接続ファイル
-        weak = self.find_weak_connections(min_connections=2)
-        print(f"【弱接続ファイル】接続数が2未満: {len(weak)}件")
+        weak_count = self.count_weak_connections(min_connections)
+        print(f"【弱接続ファイル】接続数が{min_connections}未満: {weak_count}件")
         print()
-        
-        if weak:
-            print("Top 20 弱接続ファイル:")
-            for i, file in enumerate(weak[:20], 1):
-                try:
-                    current_connections = json.loads(file['related_tools'])
-                except:
-                    current_connections = []
-                
-                suggestions = self.suggest_connections(file)
-                new_suggestions = [s for s in suggestions if s not in current_connections]
-                
+
+        if weak_count:
+            print(f"Top {top} 弱接続ファイル:")
+            for i, file in enumerate(self.find_weak_connections(min_connections, limit=top), 1):
+                current_connections = json.loads(file['related_tools'])
+                new_suggestions = file['suggestions']
+
                 print(f"{i:3d}. {file['path']}")
-                print(f"     現在の接続: {', '.join(current_connections)}")
+                print(f"     現在の接続: {', '.join(map(str, current_connections))}")
                 print(f"     追加推奨: {', '.join(new_suggestions) if new_suggestions else '（なし）'}")
                 print()
-        
+
         print("="*70)
         print("✅ レポート生成完了")
         print("="*70)
-    
+
     def close(self):
         self.conn.close()
 
 def main():
-    detector = StrayToolDetector()
+    parser = argparse.ArgumentParser(description='N3 Empire OS - 野良ツール掃討レポート')
+    parser.add_argument('--db', default=str(DB_PATH), help=f'SQLite（デフォルト: {DB_PATH}）')
+    parser.add_argument('--min-connections', type=int, default=2, help='これ未満の接続数を弱接続とする')
+    parser.add_argument('--top', type=int, default=20, help='表示件数')
+    args = parser.parse_args()
+
+    detector = StrayToolDetector(args.db)
     try:
-        detector.generate_report()
+        detector.generate_report(args.min_connections, args.top)
     finally:
         detector.close()
 
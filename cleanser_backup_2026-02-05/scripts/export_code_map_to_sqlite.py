@@ -2,13 +2,59 @@
 """
 Supabase code_map → SQLite エクスポートスクリプト
 知能引っ越し Step 1
+
+取得（PostgREST を直接呼ぶ）:
+- id だけを keyset（id=gt.<末尾id>）で走査してページ境界を決める（offset/件数カウントなし）
+- 各ページ本体（select=*）は境界 id=gte/lte で最大 --workers 件まで並列取得
+- 取得済みページはキュー経由で単一の書き込みスレッドへ（取得と書き込みが重なる）
+
+差分同期（--delta）:
+- sync_checkpoint テーブルに updated_at の最高水位を保存し、次回は水位 − --overlap 秒以降の行だけ取得
+- 取得行は id で upsert（インデックスは維持したまま）
+- 削除検出はリモート件数（count=exact）とローカル件数を比較し、食い違うときだけ id を keyset 走査
+  → リモートにない id を削除し code_map_tombstones に記録
+- チェックポイントが無い場合は全件エクスポートになる
+
+全文検索:
+- code_map_fts（FTS5, trigram）で file_path / file_name / content を索引（LIKE '%...%' の代替、日本語も部分一致）
+- 外部コンテンツ方式 + トリガーで code_map と同期（差分同期の upsert・削除もそのまま反映）
+- 全件エクスポート時はトリガーを外してロードし、最後に rebuild
+- 検索は query_brain.py search
+
+埋め込み:
+- embedding は float32（リトルエンディアン）のBLOBで保存（JSONテキストの数分の1、パース不要）
+- 旧形式（JSONテキスト）の既存行は起動時にBLOBへ変換
+- 類似検索は query_brain.py similar
+
+一括ロード:
+- ページ単位で executemany（1ページ = 1トランザクション、途中で落ちても完了ページまでは確定）
+- WAL + synchronous=NORMAL
+- インデックスはロード前に削除し、ロード後にまとめて作成
+- 行/秒を表示
+- 最後に ANALYZE（sqlite_stat1: クエリプランナーと inspect_brain.py の件数表示に使う）
+
+python3 export_code_map_to_sqlite.py
+python3 export_code_map_to_sqlite.py --page-size 2000 --workers 8 --sqlite-path ./n3_local_brain.sqlite
+python3 export_code_map_to_sqlite.py --delta   # 夜間の差分更新
+SUPABASE_SERVICE_ROLE_KEY=dummy python3 export_code_map_to_sqlite.py --url http://localhost:54321  # ローカルのPostgREST
 """
 
 import os
+import sys
+import time
+import queue
 import sqlite3
 import json
-from datetime import datetime
-from supabase import create_client, Client
+import argparse
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+from array import array
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
 
 # 環境変数から読み込み（.env.localから手動設定も可）
 SUPABASE_URL = os.getenv('SUPABASE_URL', 'https://zdzfpucdyxdlavkgrvil.supabase.co')
@@ -17,6 +63,60 @@ SUPABASE_KEY = os.getenv('SUPABASE_SERVICE_ROLE_KEY', '')
 # 出力先
 SQLITE_PATH = os.path.expanduser('~/n3-frontend_vps/data/n3_local_brain.sqlite')
 
+TABLE = 'code_map'
+
+DEFAULT_PAGE_SIZE = 1000
+DEFAULT_WORKERS = 4
+
+# 差分取得の重なり（取得中にコミットされた更新の取りこぼし防止）
+DEFAULT_OVERLAP_SEC = 300
+
+COLUMNS = [
+    'id', 'file_path', 'file_name', 'file_type', 'content', 'embedding', 'metadata',
+    'created_at', 'updated_at', 'project_id', 'chunk_index', 'total_chunks',
+]
+
+INSERT_SQL = f"""
+    INSERT INTO code_map ({', '.join(COLUMNS)})
+    VALUES ({', '.join('?' for _ in COLUMNS)})
+    ON CONFLICT(id) DO UPDATE SET {', '.join(f'{c} = excluded.{c}' for c in COLUMNS[1:])}
+"""
+
+# (インデックス名, 列)
+INDEXES = [
+    ('idx_file_path', 'file_path'),
+    ('idx_file_type', 'file_type'),
+    ('idx_project_id', 'project_id'),
+]
+
+FTS_TABLE = 'code_map_fts'
+FTS_COLUMNS = ['file_path', 'file_name', 'content']
+
+# 外部コンテンツFTS5の同期トリガー（名前, SQL）
+FTS_TRIGGERS = [
+    ('code_map_fts_ai', f"""
+        CREATE TRIGGER IF NOT EXISTS code_map_fts_ai AFTER INSERT ON code_map BEGIN
+            INSERT INTO {FTS_TABLE} (rowid, {', '.join(FTS_COLUMNS)})
+            VALUES (new.rowid, {', '.join(f'new.{c}' for c in FTS_COLUMNS)});
+        END
+    """),
+    ('code_map_fts_ad', f"""
+        CREATE TRIGGER IF NOT EXISTS code_map_fts_ad AFTER DELETE ON code_map BEGIN
+            INSERT INTO {FTS_TABLE} ({FTS_TABLE}, rowid, {', '.join(FTS_COLUMNS)})
+            VALUES ('delete', old.rowid, {', '.join(f'old.{c}' for c in FTS_COLUMNS)});
+        END
+    """),
+    # embedding 等だけの更新では索引し直さない
+    ('code_map_fts_au', f"""
+        CREATE TRIGGER IF NOT EXISTS code_map_fts_au AFTER UPDATE OF {', '.join(FTS_COLUMNS)} ON code_map BEGIN
+            INSERT INTO {FTS_TABLE} ({FTS_TABLE}, rowid, {', '.join(FTS_COLUMNS)})
+            VALUES ('delete', old.rowid, {', '.join(f'old.{c}' for c in FTS_COLUMNS)});
+            INSERT INTO {FTS_TABLE} (rowid, {', '.join(FTS_COLUMNS)})
+            VALUES (new.rowid, {', '.join(f'new.{c}' for c in FTS_COLUMNS)});
+        END
+    """),
+]
+
 def get_supabase_key():
     """環境変数またはファイルからキーを取得"""
     if SUPABASE_KEY:
@@ -32,44 +132,44 @@ def get_supabase_key():
     
     raise ValueError("SUPABASE_SERVICE_ROLE_KEY が見つかりません")
 
-def main():
-    print("=" * 60)
-    print("Supabase code_map → SQLite エクスポート")
-    print("=" * 60)
-    
-    # Supabase クライアント作成
-    key = get_supabase_key()
-    print(f"Supabase URL: {SUPABASE_URL}")
-    print(f"Key: {key[:20]}...")
-    
-    supabase: Client = create_client(SUPABASE_URL, key)
-    
-    # code_map テーブルの件数を確認
-    print("\n[1/4] code_map テーブルの件数を確認中...")
-    count_result = supabase.table('code_map').select('id', count='exact').execute()
-    total_count = count_result.count
-    print(f"  → 総件数: {total_count:,} 件")
-    
-    if total_count == 0:
-        print("  ⚠️ データがありません。終了します。")
-        return
-    
-    # SQLite DB 作成
-    print("\n[2/4] SQLite データベースを作成中...")
-    os.makedirs(os.path.dirname(SQLITE_PATH), exist_ok=True)
-    
-    conn = sqlite3.connect(SQLITE_PATH)
-    cursor = conn.cursor()
-    
-    # テーブル作成（code_map のスキーマに合わせる）
-    cursor.execute('''
+# ======================
+# SQLite 一括ロード
+# ======================
+
+def open_sqlite(path: str) -> sqlite3.Connection:
+    """一括ロード向けの設定で開く"""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    # トランザクションは明示的に管理する
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('PRAGMA temp_store=MEMORY')
+    conn.execute('PRAGMA cache_size=-65536')  # 64MB
+    return conn
+
+
+@contextmanager
+def transaction(conn: sqlite3.Connection):
+    """明示的なトランザクション（open_sqlite の接続は自動コミットモード）"""
+    conn.execute('BEGIN')
+    try:
+        yield conn
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+    conn.execute('COMMIT')
+
+
+def create_schema(conn: sqlite3.Connection):
+    """テーブル作成（code_map のスキーマに合わせる）"""
+    conn.execute('''
         CREATE TABLE IF NOT EXISTS code_map (
             id TEXT PRIMARY KEY,
             file_path TEXT,
             file_name TEXT,
             file_type TEXT,
             content TEXT,
-            embedding TEXT,
+            embedding BLOB,
             metadata TEXT,
             created_at TEXT,
             updated_at TEXT,
@@ -78,70 +178,459 @@ def main():
             total_chunks INTEGER
         )
     ''')
+    # 同期の最高水位（updated_at）
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS sync_checkpoint (
+            source TEXT PRIMARY KEY,
+            high_water_mark TEXT,
+            mode TEXT,
+            upserted INTEGER,
+            deleted INTEGER,
+            synced_at TEXT
+        )
+    ''')
+    # リモートから消えた行
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS code_map_tombstones (
+            id TEXT PRIMARY KEY,
+            deleted_at TEXT
+        )
+    ''')
+    # 全文検索
+    conn.execute(f'''
+        CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+            {', '.join(FTS_COLUMNS)},
+            content='code_map', content_rowid='rowid', tokenize='trigram'
+        )
+    ''')
+    sync_fts(conn)
+
+
+def sync_fts(conn: sqlite3.Connection):
+    """同期トリガーが無ければ（新規・既存DBへの追加・全件ロード中断後）全文索引を作り直してから付ける"""
+    names = [name for name, _ in FTS_TRIGGERS]
+    existing = conn.execute(
+        f"SELECT COUNT(*) FROM sqlite_master WHERE type = 'trigger' AND name IN ({', '.join('?' for _ in names)})",
+        names,
+    ).fetchone()[0]
+    if existing == len(names):
+        return
+    if conn.execute('SELECT 1 FROM code_map LIMIT 1').fetchone():
+        conn.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('rebuild')")
+    for _, sql in FTS_TRIGGERS:
+        conn.execute(sql)
+
+
+def drop_indexes(conn: sqlite3.Connection):
+    """ロード中の索引更新を避けるため削除（全文索引はトリガーを外して追随を止める）"""
+    for name, _ in INDEXES:
+        conn.execute(f'DROP INDEX IF EXISTS {name}')
+    for name, _ in FTS_TRIGGERS:
+        conn.execute(f'DROP TRIGGER IF EXISTS {name}')
+
+
+def create_indexes(conn: sqlite3.Connection):
+    for name, column in INDEXES:
+        conn.execute(f'CREATE INDEX IF NOT EXISTS {name} ON code_map({column})')
+    # トリガーを外していた間の変更をまとめて反映
+    sync_fts(conn)
+
+
+def encode_embedding(value) -> Optional[bytes]:
+    """pgvector のテキスト表現 "[0.1,...]" / 数値リスト → float32 リトルエンディアンのBLOB"""
+    if not value:
+        return None
+    if isinstance(value, str):
+        value = json.loads(value)
+        # 旧形式: pgvector のテキストをさらに json.dumps した文字列
+        if isinstance(value, str):
+            value = json.loads(value)
+    vector = array('f', value)
+    if sys.byteorder == 'big':
+        vector.byteswap()
+    return vector.tobytes()
+
+
+def migrate_text_embeddings(conn: sqlite3.Connection, batch_size: int = 1000) -> int:
+    """旧形式（JSONテキスト）の embedding をBLOBへ変換。変換件数を返す"""
+    converted = 0
+    while True:
+        rows = conn.execute(
+            "SELECT rowid, embedding FROM code_map WHERE typeof(embedding) = 'text' LIMIT ?",
+            (batch_size,),
+        ).fetchall()
+        if not rows:
+            return converted
+        with transaction(conn):
+            conn.executemany(
+                'UPDATE code_map SET embedding = ? WHERE rowid = ?',
+                [(encode_embedding(text), rowid) for rowid, text in rows],
+            )
+        converted += len(rows)
+
+
+def row_values(row: Dict) -> Tuple:
+    return (
+        row.get('id'),
+        row.get('file_path'),
+        row.get('file_name'),
+        row.get('file_type'),
+        row.get('content'),
+        encode_embedding(row.get('embedding')),
+        json.dumps(row.get('metadata')) if row.get('metadata') else None,
+        row.get('created_at'),
+        row.get('updated_at'),
+        row.get('project_id'),
+        row.get('chunk_index'),
+        row.get('total_chunks'),
+    )
+
+
+def bulk_load(conn: sqlite3.Connection, pages: Iterable[List[Dict]], total: int = 0,
+              rebuild_indexes: bool = True) -> Dict:
+    """ページごとに executemany + コミット
+
+    rebuild_indexes=True（全件）: インデックスをロード前に削除しロード後に作成
+    rebuild_indexes=False（差分）: 既存のインデックスを維持したまま upsert
+    """
+    create_schema(conn)
+    if rebuild_indexes:
+        drop_indexes(conn)
+
+    started = time.perf_counter()
+    write_seconds = 0.0
+    loaded = 0
+    for rows in pages:
+        write_started = time.perf_counter()
+        with transaction(conn):
+            conn.executemany(INSERT_SQL, [row_values(row) for row in rows])
+        write_seconds += time.perf_counter() - write_started
+        loaded += len(rows)
+
+        # 進捗表示
+        elapsed = time.perf_counter() - started
+        rate = loaded / elapsed if elapsed > 0 else 0
+        progress = f" ({min(100, int(loaded / total * 100))}%)" if total else ''
+        print(f"  → {loaded:,}{f' / {total:,}' if total else ''}{progress}  {rate:,.0f} 行/秒")
+
+    index_started = time.perf_counter()
+    with transaction(conn):
+        create_indexes(conn)
+    index_seconds = time.perf_counter() - index_started
+    elapsed = time.perf_counter() - started
+
+    # write_seconds: 書き込みスレッドが実際にSQLiteへ書いていた時間（ページ待ちは含まない）
+    return {
+        'rows': loaded,
+        'write_seconds': write_seconds,
+        'index_seconds': index_seconds,
+        'elapsed_seconds': elapsed,
+        'rows_per_sec': loaded / elapsed if loaded else 0.0,
+    }
+
+
+def run_writer(sqlite_path: str, pages: Iterable[List[Dict]], queue_size: int,
+               rebuild_indexes: bool = True) -> Dict:
+    """単一の書き込みスレッドへキュー経由でページを渡して一括ロード
+
+    SQLite接続は書き込みスレッド内で開く。取得側の例外時も受け取り済みページは確定させてから再送出
+    """
+    q: queue.Queue = queue.Queue(maxsize=max(1, queue_size))
+    result: Dict = {}
+
+    def writer():
+        conn = open_sqlite(sqlite_path)
+        try:
+            result.update(bulk_load(conn, iter(q.get, None), rebuild_indexes=rebuild_indexes))
+        except BaseException as e:
+            result['error'] = e
+            # 取得側がputで止まらないよう終端まで読み捨てる
+            while q.get() is not None:
+                pass
+        finally:
+            conn.close()
+
+    thread = threading.Thread(target=writer, name='sqlite-writer')
+    thread.start()
+    try:
+        for page in pages:
+            if 'error' in result:
+                break
+            q.put(page)
+    finally:
+        q.put(None)
+        thread.join()
+
+    if 'error' in result:
+        raise result['error']
+    return result
+
+
+# ======================
+# PostgREST 取得（keyset + 並列）
+# ======================
+
+class PostgrestClient:
+    """Supabase の REST（PostgREST）を直接呼ぶ最小クライアント（スレッド間で共有可）"""
+
+    def __init__(self, url: str, key: str, timeout: float = 60.0, retries: int = 3):
+        self.base = url.rstrip('/') + '/rest/v1'
+        self.headers = {
+            'apikey': key,
+            'Authorization': f'Bearer {key}',
+            'Accept': 'application/json',
+        }
+        self.timeout = timeout
+        self.retries = max(1, retries)
+
+    def get(self, table: str, params: Sequence[Tuple[str, str]]) -> List[Dict]:
+        """GET /rest/v1/<table>?<params>（同じ列への複数フィルタのためタプル列で渡す）"""
+        url = f'{self.base}/{table}?{urllib.parse.urlencode(list(params))}'
+        request = urllib.request.Request(url, headers=self.headers)
+        for attempt in range(self.retries):
+            try:
+                with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                    return json.loads(response.read())
+            except urllib.error.HTTPError as e:
+                # 4xx（クエリ・認証の誤り）は再試行しない
+                if e.code < 500 or attempt == self.retries - 1:
+                    raise
+            except (urllib.error.URLError, TimeoutError):
+                if attempt == self.retries - 1:
+                    raise
+            time.sleep(0.5 * 2 ** attempt)
+        return []
+
+    def count(self, table: str, params: Sequence[Tuple[str, str]] = ()) -> int:
+        """行数（Prefer: count=exact の Content-Range "0-0/N" から取得）"""
+        url = f'{self.base}/{table}?{urllib.parse.urlencode([("select", "id"), ("limit", "1"), *params])}'
+        headers = dict(self.headers, Prefer='count=exact')
+        request = urllib.request.Request(url, headers=headers, method='HEAD')
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            content_range = response.headers.get('Content-Range', '')
+        total = content_range.rsplit('/', 1)[-1]
+        if not total.isdigit():
+            raise ValueError(f"件数を取得できません（Content-Range: {content_range!r}）")
+        return int(total)
+
+
+def iter_ids(client: PostgrestClient, page_size: int,
+             filters: Sequence[Tuple[str, str]] = ()) -> Iterator[List[str]]:
+    """id だけを keyset で走査（1回分の id リストを返す）
+
+    サーバー側の max-rows で1回の件数が page_size 未満になっても、空になるまで続ける
+    """
+    last_id: Optional[str] = None
+    while True:
+        params = [('select', 'id'), ('order', 'id.asc'), ('limit', str(page_size)), *filters]
+        if last_id is not None:
+            params.append(('id', f'gt.{last_id}'))
+        ids = [row['id'] for row in client.get(TABLE, params)]
+        if not ids:
+            return
+        yield ids
+        last_id = ids[-1]
+
+
+def iter_id_ranges(client: PostgrestClient, page_size: int,
+                   filters: Sequence[Tuple[str, str]] = ()) -> Iterator[Tuple[str, str, int]]:
+    """ページ境界 (先頭id, 末尾id, 件数)"""
+    for ids in iter_ids(client, page_size, filters):
+        yield ids[0], ids[-1], len(ids)
+
+
+def fetch_page(client: PostgrestClient, first_id: str, last_id: str,
+               filters: Sequence[Tuple[str, str]] = ()) -> List[Dict]:
+    """境界 first_id〜last_id（両端含む）の行を取得"""
+    params = [
+        ('select', '*'),
+        ('id', f'gte.{first_id}'),
+        ('id', f'lte.{last_id}'),
+        ('order', 'id.asc'),
+        *filters,
+    ]
+    return client.get(TABLE, params)
+
+
+def iter_pages(client: PostgrestClient, page_size: int = DEFAULT_PAGE_SIZE, workers: int = DEFAULT_WORKERS,
+               filters: Sequence[Tuple[str, str]] = ()) -> Iterator[List[Dict]]:
+    """境界の走査と並行して、ページ本体を最大 workers 件同時に取得（完了順に返す）"""
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        in_flight = set()
+
+        def drain(limit: int) -> Iterator[List[Dict]]:
+            nonlocal in_flight
+            while len(in_flight) > limit:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+
+        for first_id, last_id, _ in iter_id_ranges(client, page_size, filters):
+            in_flight.add(pool.submit(fetch_page, client, first_id, last_id, filters))
+            yield from drain(max(1, workers) - 1)
+        yield from drain(0)
+
+
+# ======================
+# 差分同期（チェックポイント・削除検出）
+# ======================
+
+def load_checkpoint(conn: sqlite3.Connection) -> Optional[Dict]:
+    row = conn.execute(
+        'SELECT high_water_mark, mode, upserted, deleted, synced_at FROM sync_checkpoint WHERE source = ?',
+        (TABLE,),
+    ).fetchone()
+    if row is None:
+        return None
+    return dict(zip(('high_water_mark', 'mode', 'upserted', 'deleted', 'synced_at'), row))
+
+
+def save_checkpoint(conn: sqlite3.Connection, high_water_mark: Optional[str], mode: str,
+                    upserted: int, deleted: int):
+    with transaction(conn):
+        conn.execute(
+            '''INSERT INTO sync_checkpoint (source, high_water_mark, mode, upserted, deleted, synced_at)
+               VALUES (?, ?, ?, ?, ?, ?)
+               ON CONFLICT(source) DO UPDATE SET
+                   high_water_mark = excluded.high_water_mark, mode = excluded.mode,
+                   upserted = excluded.upserted, deleted = excluded.deleted, synced_at = excluded.synced_at''',
+            (TABLE, high_water_mark, mode, upserted, deleted, datetime.now().isoformat()),
+        )
+
+
+def parse_timestamp(value: str) -> datetime:
+    # PostgREST の timestamptz（"...Z" 表記にも対応）
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+
+def delta_since(high_water_mark: str, overlap_sec: float) -> str:
+    return (parse_timestamp(high_water_mark) - timedelta(seconds=overlap_sec)).isoformat()
+
+
+def track_high_water(pages: Iterable[List[Dict]], state: Dict) -> Iterator[List[Dict]]:
+    """取得ページを流しながら updated_at の最大値を state['high_water_mark'] に記録"""
+    best = parse_timestamp(state['high_water_mark']) if state.get('high_water_mark') else None
+    for rows in pages:
+        for row in rows:
+            value = row.get('updated_at')
+            if not value:
+                continue
+            ts = parse_timestamp(value)
+            if best is None or ts > best:
+                best = ts
+                state['high_water_mark'] = value
+        yield rows
+
+
+def apply_tombstones(conn: sqlite3.Connection, client: PostgrestClient, page_size: int) -> int:
+    """リモートから消えた行を削除し code_map_tombstones に記録（削除件数を返す）
+
+    件数が一致すれば走査しない（追加・更新は差分取得で反映済みのため、件数差 = 削除の有無）
+    """
+    # 再作成された id は墓標から外す
+    with transaction(conn):
+        conn.execute('DELETE FROM code_map_tombstones WHERE id IN (SELECT id FROM code_map)')
+
+    local_count = conn.execute('SELECT COUNT(*) FROM code_map').fetchone()[0]
+    if client.count(TABLE) == local_count:
+        return 0
+
+    conn.execute('CREATE TEMP TABLE IF NOT EXISTS remote_ids (id TEXT PRIMARY KEY)')
+    conn.execute('DELETE FROM remote_ids')
+    with transaction(conn):
+        for ids in iter_ids(client, page_size):
+            conn.executemany('INSERT OR IGNORE INTO remote_ids (id) VALUES (?)', [(i,) for i in ids])
+
+    now = datetime.now().isoformat()
+    with transaction(conn):
+        conn.execute(
+            '''INSERT OR REPLACE INTO code_map_tombstones (id, deleted_at)
+               SELECT id, ? FROM code_map WHERE id NOT IN (SELECT id FROM remote_ids)''',
+            (now,),
+        )
+        deleted = conn.execute(
+            'DELETE FROM code_map WHERE id NOT IN (SELECT id FROM remote_ids)'
+        ).rowcount
+    conn.execute('DROP TABLE remote_ids')
+    return deleted
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Supabase code_map → SQLite エクスポート')
+    parser.add_argument('--sqlite-path', default=SQLITE_PATH, help=f'出力先（デフォルト: {SQLITE_PATH}）')
+    parser.add_argument('--url', default=SUPABASE_URL, help='Supabase / PostgREST のURL')
+    parser.add_argument('--page-size', type=int, default=DEFAULT_PAGE_SIZE, help='1ページ（= 1トランザクション）の行数')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='ページ本体の同時取得数')
+    parser.add_argument('--delta', action='store_true', help='チェックポイント以降の変更分だけ同期（無ければ全件）')
+    parser.add_argument('--overlap', type=float, default=DEFAULT_OVERLAP_SEC,
+                        help=f'差分取得で水位から遡る秒数（デフォルト: {DEFAULT_OVERLAP_SEC}）')
+    args = parser.parse_args()
     
-    # インデックス作成
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_file_path ON code_map(file_path)')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_file_type ON code_map(file_type)')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_project_id ON code_map(project_id)')
+    print("=" * 60)
+    print("Supabase code_map → SQLite エクスポート")
+    print("=" * 60)
     
-    print(f"  → SQLite: {SQLITE_PATH}")
+    # PostgREST クライアント作成
+    key = get_supabase_key()
+    print(f"Supabase URL: {args.url}")
+    print(f"Key: {key[:20]}...")
     
-    # データをページング取得してエクスポート
-    print("\n[3/4] データをエクスポート中...")
-    page_size = 1000
-    offset = 0
-    exported = 0
+    client = PostgrestClient(args.url, key)
     
-    while offset < total_count:
-        # Supabase からデータ取得
-        result = supabase.table('code_map').select('*').range(offset, offset + page_size - 1).execute()
-        rows = result.data
-        
-        if not rows:
-            break
-        
-        # SQLite に挿入
-        for row in rows:
-            cursor.execute('''
-                INSERT OR REPLACE INTO code_map 
-                (id, file_path, file_name, file_type, content, embedding, metadata, 
-                 created_at, updated_at, project_id, chunk_index, total_chunks)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                row.get('id'),
-                row.get('file_path'),
-                row.get('file_name'),
-                row.get('file_type'),
-                row.get('content'),
-                json.dumps(row.get('embedding')) if row.get('embedding') else None,
-                json.dumps(row.get('metadata')) if row.get('metadata') else None,
-                row.get('created_at'),
-                row.get('updated_at'),
-                row.get('project_id'),
-                row.get('chunk_index'),
-                row.get('total_chunks'),
-            ))
-        
-        exported += len(rows)
-        offset += page_size
-        
-        # 進捗表示
-        progress = min(100, int(exported / total_count * 100))
-        print(f"  → {exported:,} / {total_count:,} ({progress}%)")
-        
-        # 定期的にコミット
-        if exported % 5000 == 0:
-            conn.commit()
+    # SQLite DB 作成・チェックポイント確認
+    print("\n[1/4] SQLite データベース・チェックポイントを確認中...")
+    conn = open_sqlite(args.sqlite_path)
+    create_schema(conn)
+    checkpoint = load_checkpoint(conn)
+    converted = migrate_text_embeddings(conn)
+    conn.close()
+    print(f"  → SQLite: {args.sqlite_path}（WAL, synchronous=NORMAL）")
+    if converted:
+        print(f"  → 旧形式の embedding をBLOBへ変換: {converted:,} 件")
+    
+    mode = 'delta' if args.delta and checkpoint and checkpoint['high_water_mark'] else 'full'
+    filters: List[Tuple[str, str]] = []
+    state: Dict = {}
+    if mode == 'delta':
+        since = delta_since(checkpoint['high_water_mark'], args.overlap)
+        filters = [('updated_at', f'gte.{since}')]
+        state['high_water_mark'] = checkpoint['high_water_mark']
+        print(f"  → 差分同期: updated_at >= {since}（前回 {checkpoint['synced_at']}）")
+    else:
+        if args.delta:
+            print("  → チェックポイントなし: 全件エクスポートします")
+        # code_map テーブルの確認（件数カウントは行わない）
+        if not client.get(TABLE, [('select', 'id'), ('limit', '1')]):
+            print("  ⚠️ データがありません。終了します。")
+            return
+    
+    # 取得（並列）と書き込み（単一スレッド）を重ねて実行
+    print(f"\n[2/4] データを{'差分' if mode == 'delta' else '全件'}取得中...")
+    print(f"  → keyset取得: {args.page_size:,} 行/ページ × 同時 {args.workers} ページ")
+    pages = track_high_water(iter_pages(client, args.page_size, args.workers, filters), state)
+    stats = run_writer(args.sqlite_path, pages, queue_size=args.workers * 2,
+                       rebuild_indexes=(mode == 'full'))
+    print(f"  → {stats['rows']:,} 行 / 所要 {stats['elapsed_seconds']:.2f}s"
+          f"（うち書き込み {stats['write_seconds']:.2f}s + インデックス作成 {stats['index_seconds']:.2f}s）"
+          f" = {stats['rows_per_sec']:,.0f} 行/秒")
     
-    conn.commit()
+    # 削除の反映とチェックポイント保存（全ページ確定後に水位を進める）
+    print("\n[3/4] 削除の反映・チェックポイントを保存中...")
+    conn = open_sqlite(args.sqlite_path)
+    deleted = apply_tombstones(conn, client, args.page_size)
+    save_checkpoint(conn, state.get('high_water_mark'), mode, stats['rows'], deleted)
+    # 統計を更新（インデックスを読むだけなので10万行でも数十ms）
+    conn.execute('ANALYZE')
+    print(f"  → 削除: {deleted:,} 件")
+    print(f"  → 水位: {state.get('high_water_mark')}")
     
     # 確認
     print("\n[4/4] エクスポート完了を確認中...")
-    cursor.execute('SELECT COUNT(*) FROM code_map')
-    sqlite_count = cursor.fetchone()[0]
+    sqlite_count = conn.execute('SELECT COUNT(*) FROM code_map').fetchone()[0]
     
-    # ファイルサイズ
-    file_size = os.path.getsize(SQLITE_PATH)
+    # WALをDB本体へ反映してからサイズを計測
+    conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    file_size = os.path.getsize(args.sqlite_path)
     file_size_mb = file_size / (1024 * 1024)
     
     print(f"  → SQLite 件数: {sqlite_count:,} 件")
@@ -151,7 +640,7 @@ def main():
     
     print("\n" + "=" * 60)
     print("✅ エクスポート完了!")
-    print(f"   出力先: {SQLITE_PATH}")
+    print(f"   出力先: {args.sqlite_path}")
     print("=" * 60)
 
 if __name__ == '__main__':
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+CSV → N3 Local Brain（SQLite）一括取り込み
+
+python3 import_csv_to_brain.py data.csv --table foo                     # ヘッダー行の列名をそのまま使う（TEXT列）
+python3 import_csv_to_brain.py categories.csv --table yahoo_category_master --encoding cp932 \
+    --columns category_id,category_name --key category_id
+python3 import_csv_to_brain.py data.tsv --table foo --delimiter '\\t' --no-header --columns a,b,c
+
+- 1MB単位のバッファで読みながらデコード（--encoding cp932 等。不正なバイトは --errors で置換/無視）
+- csv.reader の行をジェネレーターのまま executemany に渡す（全行をメモリに載せない）、1トランザクション
+- 既存テーブルは1トランザクションで DELETE → INSERT し直す（テーブル自体は作り直さない）
+  → 読み手（WAL）は COMMIT まで旧データを見る。空のテーブルは見えず、途中で失敗すれば旧データのまま
+  → テーブルを参照するビュー、利用者が追加したインデックス・トリガーはそのまま残る
+- テーブルが無い場合のみ作成する（既存テーブルの列定義・主キーは変更しない）
+- --columns: CSVの先頭から順に割り当てる列名（指定しない列は取り込まない）。省略時はヘッダー行
+- --key: 主キー。重複行は先勝ち（INSERT OR IGNORE）。新規作成時は WITHOUT ROWID で作る
+  （主キーの B-tree に行を直接格納。rowid + 自動インデックスの2本より書き込みが速く、ファイルも小さい）
+- 列数が足りない行は読み飛ばして件数を表示
+"""
+
+import os
+import csv
+import sys
+import time
+import sqlite3
+import argparse
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence
+
+from export_code_map_to_sqlite import open_sqlite, transaction
+
+DB_PATH = Path(__file__).parent.parent / "lib" / "data" / "n3_local_brain.sqlite"
+
+# デコード・読み込みのバッファ
+BUFFER_SIZE = 1024 * 1024
+# 取り込み時刻の列（CSVに同名の列があれば追加しない）
+TIMESTAMP_COLUMN = 'updated_at'
+
+
+def quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def iter_csv(path: str, encoding: str = 'utf-8-sig', errors: str = 'strict', delimiter: str = ',',
+             buffer_size: int = BUFFER_SIZE) -> Iterator[List[str]]:
+    with open(path, 'r', encoding=encoding, errors=errors, newline='', buffering=buffer_size) as f:
+        yield from csv.reader(f, delimiter=delimiter)
+
+
+def build_create_sql(columns: Sequence[str], key: Optional[str] = None) -> str:
+    """{table} を差し替えて使う CREATE TABLE（列はすべて TEXT、key があれば WITHOUT ROWID）"""
+    defs = [f"{quote(c)} TEXT{' PRIMARY KEY' if c == key else ''}" for c in columns]
+    if TIMESTAMP_COLUMN not in columns:
+        defs.append(f'{TIMESTAMP_COLUMN} DATETIME DEFAULT CURRENT_TIMESTAMP')
+    return 'CREATE TABLE {table} (\n    ' + ',\n    '.join(defs) + '\n)' + (' WITHOUT ROWID' if key else '')
+
+
+def import_csv(conn: sqlite3.Connection, rows: Iterator[List[str]], table: str,
+               columns: Optional[Sequence[str]] = None, key: Optional[str] = None,
+               create_sql: Optional[str] = None) -> Dict:
+    """table の全行を rows で置き換える（1トランザクションで DELETE → executemany）
+
+    columns 省略時は rows の1行目をヘッダーとして使う。
+    create_sql は {table} を含む CREATE TABLE 文（テーブルが無い場合のみ使う。省略時は build_create_sql）
+    """
+    if columns is None:
+        header = next(rows, None)
+        if header is None:
+            raise ValueError("CSVが空です")
+        columns = [c.strip() for c in header]
+    columns = list(columns)
+    if not columns or any(not c for c in columns) or len(set(columns)) != len(columns):
+        raise ValueError(f"列名が空または重複しています: {columns}")
+    if key is not None and key not in columns:
+        raise ValueError(f"--key {key} が列にありません: {columns}")
+
+    width = len(columns)
+    counts = {'read': 0, 'short': 0}
+
+    def values() -> Iterator[List[str]]:
+        for row in rows:
+            counts['read'] += 1
+            if len(row) < width:
+                counts['short'] += 1
+                continue
+            yield row[:width]
+
+    insert_sql = (
+        f"INSERT{' OR IGNORE' if key else ''} INTO {quote(table)} ({', '.join(map(quote, columns))}) "
+        f"VALUES ({', '.join('?' for _ in columns)})"
+    )
+
+    started = time.perf_counter()
+    with transaction(conn):
+        # COMMIT までは読み手から旧データが見える
+        if not conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone():
+            conn.execute((create_sql or build_create_sql(columns, key)).format(table=quote(table)))
+        conn.execute(f'DELETE FROM {quote(table)}')
+        inserted = conn.executemany(insert_sql, values()).rowcount
+    conn.execute(f'ANALYZE {quote(table)}')
+    elapsed = time.perf_counter() - started
+
+    return {
+        'table': table,
+        'columns': columns,
+        'read': counts['read'],
+        'inserted': inserted,
+        'duplicates': counts['read'] - counts['short'] - inserted,
+        'short': counts['short'],
+        'elapsed_seconds': elapsed,
+        'rows_per_sec': counts['read'] / elapsed if elapsed > 0 else 0.0,
+    }
+
+
+def print_stats(stats: Dict):
+    print(f"  → {stats['table']}: {stats['inserted']:,} 行を取り込み（読込 {stats['read']:,} 行）")
+    if stats['duplicates']:
+        print(f"  → 重複キーで除外: {stats['duplicates']:,} 行")
+    if stats['short']:
+        print(f"  → 列数不足で除外: {stats['short']:,} 行")
+    print(f"  → 所要 {stats['elapsed_seconds']:.2f}s = {stats['rows_per_sec']:,.0f} 行/秒")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='CSV を N3 Local Brain の SQLite に取り込む（1トランザクションで全行を置き換え）')
+    parser.add_argument('csv_path', help='CSVファイル')
+    parser.add_argument('--table', required=True, help='取り込み先テーブル（既存なら置き換え）')
+    parser.add_argument('--db', default=str(DB_PATH), help=f'SQLite（デフォルト: {DB_PATH}）')
+    parser.add_argument('--encoding', default='utf-8-sig', help='文字コード（Shift-JIS の場合は cp932）')
+    parser.add_argument('--errors', default='strict', choices=('strict', 'replace', 'ignore'),
+                        help='デコードできないバイトの扱い')
+    parser.add_argument('--delimiter', default=',', help="区切り文字（タブは '\\t'）")
+    parser.add_argument('--columns', type=lambda s: [c.strip() for c in s.split(',')],
+                        help='CSVの先頭から順に割り当てる列名（カンマ区切り）')
+    parser.add_argument('--no-header', action='store_true', help='1行目からデータとして読む（--columns 必須）')
+    parser.add_argument('--key', help='主キーにする列（重複は先勝ち）')
+    args = parser.parse_args()
+
+    if args.no_header and not args.columns:
+        parser.error('--no-header には --columns が必要です')
+    if not os.path.exists(args.csv_path):
+        print(f"ERROR: {args.csv_path} がありません", file=sys.stderr)
+        sys.exit(1)
+
+    delimiter = '\t' if args.delimiter in ('\\t', 'tab') else args.delimiter
+    rows = iter_csv(args.csv_path, args.encoding, args.errors, delimiter)
+    if args.columns and not args.no_header:
+        next(rows, None)  # ヘッダー行を読み飛ばす
+
+    print(f"🚀 取り込み開始: {args.csv_path} → {args.db}（{args.encoding}）")
+    conn = open_sqlite(args.db)
+    try:
+        stats = import_csv(conn, rows, args.table, args.columns, args.key)
+    except (ValueError, UnicodeDecodeError, sqlite3.Error) as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        sys.exit(1)
+    finally:
+        conn.close()
+    print_stats(stats)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,38 +1,61 @@
+#!/usr/bin/env python3
+"""
+Yahoo!オークション カテゴリーCSV → yahoo_category_master
+
+python3 import_yahoo.py
+python3 import_yahoo.py --csv ./yahoo_auction_カテゴリー.csv --db ./n3_local_brain.sqlite
+
+取り込みは import_csv_to_brain.py（1トランザクションで DELETE → executemany）
+"""
+import sys
 import sqlite3
-import csv
+import argparse
+from pathlib import Path
 
-db_path = '/Users/AKI-NANA/n3-frontend_new/lib/data/n3_local_brain.sqlite'
-csv_path = '/Users/AKI-NANA/n3-frontend_new/02_DEV_LAB/n8n-workflows/PRODUCTION/V8_SCHEMA/yahoo_auction_カテゴリー.csv'
+from export_code_map_to_sqlite import open_sqlite
+from import_csv_to_brain import DB_PATH, iter_csv, import_csv, print_stats
 
-conn = sqlite3.connect(db_path)
-cur = conn.cursor()
+# リポジトリ直下の n8n-workflows（このスクリプトは cleanser_backup_2026-02-05/scripts/ にある）
+CSV_PATH = Path(__file__).resolve().parents[2] / "n8n-workflows" / "V8_SCHEMA" / "yahoo_auction_カテゴリー.csv"
 
-# テーブルをリセット（確実に作り直す）
-cur.execute("DROP TABLE IF EXISTS yahoo_category_master")
-cur.execute("""
-    CREATE TABLE yahoo_category_master (
+TABLE = 'yahoo_category_master'
+CREATE_SQL = """
+    CREATE TABLE {table} (
         category_id TEXT PRIMARY KEY,
         category_name TEXT NOT NULL,
         updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
     )
-""")
-
-print("🚀 取り込み開始（Shift-JIS 対策済み）...")
-
-# Shift-JIS (cp932) で読み込み
-with open(csv_path, 'r', encoding='cp932', errors='replace') as f:
-    reader = csv.reader(f)
-    next(reader)  # ヘッダーをスキップ
-    
-    count = 0
-    for row in reader:
-        if len(row) >= 2:
-            cur.execute(
-                "INSERT OR IGNORE INTO yahoo_category_master (category_id, category_name) VALUES (?, ?)",
-                (row[0], row[1])
-            )
-            count += 1
-
-conn.commit()
-conn.close()
-print(f"✅ 完了！ {count} 件のカテゴリーを正常に脳へインストールしました。")
+"""
+
+def main():
+    parser = argparse.ArgumentParser(description='Yahoo!オークション カテゴリーCSVの取り込み')
+    parser.add_argument('--csv', default=str(CSV_PATH), help=f'カテゴリーCSV（デフォルト: {CSV_PATH}）')
+    parser.add_argument('--db', default=str(DB_PATH), help=f'SQLite（デフォルト: {DB_PATH}）')
+    parser.add_argument('--encoding', default='cp932', help='文字コード（デフォルト: cp932）')
+    args = parser.parse_args()
+
+    if not Path(args.csv).exists():
+        print(f"ERROR: {args.csv} がありません", file=sys.stderr)
+        sys.exit(1)
+
+    print("🚀 取り込み開始（Shift-JIS 対策済み）...")
+
+    # Shift-JIS (cp932) で読み込み、1行目（ヘッダー）は読み飛ばす
+    rows = iter_csv(args.csv, args.encoding, errors='replace')
+    next(rows, None)
+
+    conn = open_sqlite(args.db)
+    try:
+        stats = import_csv(conn, rows, TABLE, ['category_id', 'category_name'], key='category_id',
+                           create_sql=CREATE_SQL)
+    except (ValueError, sqlite3.Error) as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        sys.exit(1)
+    finally:
+        conn.close()
+
+    print_stats(stats)
+    print(f"✅ 完了！ {stats['inserted']} 件のカテゴリーを正常に脳へインストールしました。")
+
+if __name__ == "__main__":
+    main()
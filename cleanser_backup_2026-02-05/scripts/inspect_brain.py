@@ -1,41 +1,172 @@
 #!/usr/bin/env python3
 """
 N3 Local Brain - テーブル構造とサンプルデータ取得
+
+python3 inspect_brain.py                       # 構造・件数・ページ使用量・サンプル（各3件、1列200文字まで）
+python3 inspect_brain.py --samples 5 --chars 80
+python3 inspect_brain.py --no-pages            # dbstat を読まない
+python3 inspect_brain.py --json                # describe() の結果をそのまま出力
+
+DBが大きくても一瞬で返すため:
+- 列定義は sqlite_master × pragma_table_info の1クエリ
+- 件数は sqlite_stat1（ANALYZE の結果）から読む。統計のない小さなテーブルだけ COUNT(*)
+- サンプルは SQL 側で substr して切り詰め、BLOB はサイズだけ返す（content / embedding を丸ごと読まない）
+- テーブル・インデックスごとのページ数・バイト数は dbstat（aggregate=TRUE）
 """
 import sqlite3
 import json
+import argparse
 from pathlib import Path
+from typing import Dict, List, Optional
 
 DB_PATH = Path(__file__).parent.parent / "lib" / "data" / "n3_local_brain.sqlite"
 
-def main():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
+SAMPLE_ROWS = 3
+SAMPLE_CHARS = 200
+# sqlite_stat1 に統計がなくても COUNT(*) してよいページ数
+SMALL_TABLE_PAGES = 64
+
+def _json_default(value):
+    # BLOB（embedding 等）は中身を出さずサイズのみ
+    if isinstance(value, bytes):
+        return f"<blob {len(value)} bytes>"
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def _quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+def stat_rows(conn: sqlite3.Connection) -> Dict[str, int]:
+    """sqlite_stat1 からテーブルごとの行数（ANALYZE 未実行なら空）"""
+    if not conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone():
+        return {}
+    # stat の先頭の数値がテーブルの行数
+    rows = conn.execute(
+        "SELECT tbl, MAX(CAST(substr(stat, 1, instr(stat || ' ', ' ') - 1) AS INTEGER)) "
+        "FROM sqlite_stat1 GROUP BY tbl"
+    )
+    return {tbl: count for tbl, count in rows}
+
+def page_usage(conn: sqlite3.Connection) -> Optional[Dict[str, Dict]]:
+    """dbstat からテーブル・インデックスごとのページ数・バイト数（dbstat が無いビルドでは None）"""
+    try:
+        rows = conn.execute(
+            "SELECT name, pageno AS pages, pgsize AS bytes, payload, unused FROM dbstat WHERE aggregate = TRUE"
+        ).fetchall()
+    except sqlite3.OperationalError:
+        return None
+    return {row[0]: {'pages': row[1], 'bytes': row[2], 'payload': row[3], 'unused': row[4]} for row in rows}
+
+def sample_sql(table: str, columns: List[Dict], sample_rows: int, max_chars: int) -> str:
+    """長いテキストは substr、BLOB はサイズだけを返す SELECT"""
+    select = []
+    for column in columns:
+        c = _quote(column['name'])
+        select.append(
+            f"CASE typeof({c}) "
+            f"WHEN 'blob' THEN '<blob ' || length({c}) || ' bytes>' "
+            f"WHEN 'text' THEN CASE WHEN length({c}) > {int(max_chars)} "
+            f"THEN substr({c}, 1, {int(max_chars)}) || '…' ELSE {c} END "
+            f"ELSE {c} END AS {c}"
+        )
+    return f"SELECT {', '.join(select)} FROM {_quote(table)} LIMIT {int(sample_rows)}"
+
+def describe(conn: sqlite3.Connection, sample_rows: int = SAMPLE_ROWS, max_chars: int = SAMPLE_CHARS,
+             pages: bool = True) -> List[Dict]:
+    """テーブルごとの構造・件数・ページ使用量・サンプル（brain_server.py の /inspect と共通）
+
+    [{table, virtual, rows, rowsSource, columns, indexes, pages, samples}]
+    rowsSource: 'sqlite_stat1'（ANALYZE 時点）/ 'count' / None（不明）
+    """
     cursor = conn.cursor()
-    
+    cursor.row_factory = sqlite3.Row
+    tables: Dict[str, Dict] = {}
+    for row in cursor.execute(
+        "SELECT m.name AS tbl, m.sql LIKE 'CREATE VIRTUAL%' AS virtual, p.* "
+        "FROM sqlite_master m JOIN pragma_table_info(m.name) p "
+        "WHERE m.type = 'table' ORDER BY m.name, p.cid"
+    ):
+        item = dict(row)
+        table = tables.setdefault(item.pop('tbl'), {'virtual': bool(item.pop('virtual')), 'columns': []})
+        table['columns'].append(item)
+
+    indexes: Dict[str, List[str]] = {}
+    for tbl, name in conn.execute("SELECT tbl_name, name FROM sqlite_master WHERE type = 'index' ORDER BY name"):
+        indexes.setdefault(tbl, []).append(name)
+
+    counts = stat_rows(conn)
+    usage = page_usage(conn) if pages else None
+
+    result = []
+    for name, table in tables.items():
+        table_pages = usage.get(name) if usage else None
+        rows, source = counts.get(name), 'sqlite_stat1'
+        if rows is None:
+            source = None
+            if table_pages is not None and table_pages['pages'] <= SMALL_TABLE_PAGES:
+                rows, source = conn.execute(f"SELECT COUNT(*) FROM {_quote(name)}").fetchone()[0], 'count'
+        samples = [dict(row) for row in cursor.execute(sample_sql(name, table['columns'], sample_rows, max_chars))]
+        result.append({
+            'table': name,
+            'virtual': table['virtual'],
+            'rows': rows,
+            'rowsSource': source,
+            'columns': table['columns'],
+            'indexes': [
+                dict({'name': index}, **(usage.get(index, {}) if usage else {}))
+                for index in indexes.get(name, [])
+            ],
+            'pages': table_pages,
+            'samples': samples,
+        })
+    return result
+
+def _size(pages: Optional[Dict]) -> str:
+    if not pages:
+        return '-'
+    return f"{pages['pages']:,} ページ / {pages['bytes'] / (1024 * 1024):,.1f} MB"
+
+def main():
+    parser = argparse.ArgumentParser(description='N3 Local Brain テーブル構造とサンプルデータ')
+    parser.add_argument('--db', default=str(DB_PATH), help=f'SQLite（デフォルト: {DB_PATH}）')
+    parser.add_argument('--samples', type=int, default=SAMPLE_ROWS, help='テーブルごとのサンプル件数')
+    parser.add_argument('--chars', type=int, default=SAMPLE_CHARS, help='サンプルのテキストを切り詰める文字数')
+    parser.add_argument('--no-pages', action='store_true', help='dbstat によるページ使用量を省略')
+    parser.add_argument('--json', action='store_true', help='describe() の結果をJSONで出力')
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    tables = describe(conn, args.samples, args.chars, pages=not args.no_pages)
+    conn.close()
+
+    if args.json:
+        print(json.dumps(tables, indent=2, ensure_ascii=False, default=_json_default))
+        return
+
     # テーブル一覧
     print("=== テーブル一覧 ===")
-    cursor.execute("SELECT name FROM sqlite_master WHERE type='table' ORDER BY name")
-    tables = [row[0] for row in cursor.fetchall()]
-    print(json.dumps(tables, indent=2, ensure_ascii=False))
+    for t in tables:
+        if t['rows'] is not None:
+            rows = f"{t['rows']:,} 行"
+        else:
+            rows = '件数 -' if t['virtual'] else '件数不明（ANALYZE 未実行）'
+        if t['rowsSource'] == 'sqlite_stat1':
+            rows += '（sqlite_stat1）'
+        kind = '（仮想テーブル）' if t['virtual'] else ''
+        print(f"  {t['table']}{kind}: {rows} / {_size(t['pages'])}")
+        for index in t['indexes']:
+            print(f"    - {index['name']}: {_size(index if 'pages' in index else None)}")
     print()
-    
+
     # 各テーブルの構造
-    for table in tables:
-        print(f"=== {table} 構造 ===")
-        cursor.execute(f"PRAGMA table_info({table})")
-        columns = [dict(row) for row in cursor.fetchall()]
-        print(json.dumps(columns, indent=2, ensure_ascii=False))
+    for t in tables:
+        print(f"=== {t['table']} 構造 ===")
+        print(json.dumps(t['columns'], indent=2, ensure_ascii=False))
         print()
-        
-        # サンプルデータ（最大3件）
-        print(f"=== {table} サンプルデータ ===")
-        cursor.execute(f"SELECT * FROM {table} LIMIT 3")
-        samples = [dict(row) for row in cursor.fetchall()]
-        print(json.dumps(samples, indent=2, ensure_ascii=False))
+
+        # サンプルデータ（テキストは --chars 文字まで）
+        print(f"=== {t['table']} サンプルデータ ===")
+        print(json.dumps(t['samples'], indent=2, ensure_ascii=False, default=_json_default))
         print("\n" + "="*60 + "\n")
-    
-    conn.close()
 
 if __name__ == "__main__":
     main()
@@ -2,37 +2,558 @@
 """
 N3 Local Brain SQLite クエリツール
 総督命令に基づき、トークン節約のため必要最小限のデータのみ取得
+
+python3 query_brain.py 'SELECT ...' [limit]
+python3 query_brain.py search 'burnLimit 認証ゲート' [-k 10]       # 全文検索（BM25順、スニペット付き）
+python3 query_brain.py search --raw 'content:webhook NOT test'   # FTS5 のクエリ構文をそのまま使う
+python3 query_brain.py similar --id <chunk id> [-k 10]          # 指定チャンクに近いチャンク
+python3 query_brain.py similar --file src/app/page.tsx          # ファイル（全チャンクの平均）に近いチャンク
+python3 query_brain.py similar --vector query.json              # 埋め込みAPIで作ったベクトル（JSON配列、- で標準入力）
+
+常駐サーバー（brain_server.py）経由:
+N3_BRAIN_URL=http://127.0.0.1:8765 python3 query_brain.py search 'burnLimit'   # --server でも指定可
+（接続できなければローカルで実行）
+
+出力形式（各コマンド共通）:
+python3 query_brain.py sql 'SELECT * FROM code_map' --format ndjson > code_map.ndjson   # 1行1JSON、全件
+python3 query_brain.py sql 'SELECT * FROM code_map' 500 --format csv --columns id,file_path,chunk_index
+- json（デフォルト）: 全件をまとめて整形出力。sql の件数省略時は10件
+- ndjson / csv: カーソルから読んだ行を順に書き出す（メモリは件数によらず一定）。sql の件数省略時・0 は全件
+  sql の ndjson / csv は常駐サーバーを経由せず DB から直接読む
+- --columns: 指定列だけを SELECT し直す（content 等の大きい列を読み込まない）
+
+全文検索:
+- export_code_map_to_sqlite.py が作る code_map_fts（FTS5, trigram）を MATCH
+- 語ごとの部分一致の AND。trigram は3文字未満の語を索引で引けないため、短い語は LIKE で絞り込む
+- 順位は bm25（file_path・file_name の一致を content より重く）
+
+類似検索:
+- code_map.embedding（float32 BLOB）を正規化済みの行列キャッシュ（<DB名>.vectors.npy）に書き出し、
+  以降は np.load(mmap_mode='r') でメモリマップ
+- 上位k件は行列×ベクトル1回（コサイン類似度）+ argpartition
+- キャッシュは code_map の件数・最終更新・同期チェックポイントが変わると作り直す
 """
 
+import os
+import csv
 import sqlite3
 import json
 import sys
+import time
+import argparse
+import urllib.error
+import urllib.request
 from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+# numpy は similar でのみ読み込む（SQL・全文検索の起動を軽くする）
+np = None
 
 DB_PATH = Path(__file__).parent.parent / "lib" / "data" / "n3_local_brain.sqlite"
 
-def query_brain(sql: str, limit: int = 10):
-    """SQLiteからデータを取得"""
-    conn = sqlite3.connect(DB_PATH)
+COMMANDS = ('sql', 'search', 'similar')
+FORMATS = ('json', 'ndjson', 'csv')
+
+DEFAULT_LIMIT = 10
+FETCH_BATCH = 1000
+
+# 常駐サーバーのURL（--server 未指定時）
+SERVER_ENV = 'N3_BRAIN_URL'
+
+FTS_TABLE = 'code_map_fts'
+# bm25 の列の重み（file_path, file_name, content）
+FTS_WEIGHTS = (5.0, 3.0, 1.0)
+SNIPPET_TOKENS = 64  # trigram では1トークン ≒ 1文字（FTS5の上限は64）
+
+
+def require_numpy():
+    global np
+    if np is None:
+        try:
+            import numpy
+        except ImportError:
+            raise RuntimeError("similar には numpy が必要です（pip install numpy）")
+        np = numpy
+    return np
+
+
+def _json_default(value):
+    # BLOB（embedding 等）は中身を出さずサイズのみ
+    if isinstance(value, bytes):
+        return f"<blob {len(value)} bytes>"
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def print_json(result):
+    print(json.dumps(result, ensure_ascii=False, indent=2, default=_json_default))
+
+
+def _csv_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, bytes):
+        return _json_default(value)
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False)
+    return value
+
+
+def write_rows(rows: Iterable, fmt: str, out=None) -> int:
+    """行（dict / sqlite3.Row）を1行ずつ書き出す。json 以外は溜め込まない。書いた件数を返す"""
+    out = out or sys.stdout
+    if fmt == 'json':
+        result = [dict(row) for row in rows]
+        out.write(json.dumps(result, ensure_ascii=False, indent=2, default=_json_default) + '\n')
+        return len(result)
+
+    count = 0
+    writer = None
+    for row in rows:
+        item = dict(row)
+        if fmt == 'ndjson':
+            out.write(json.dumps(item, ensure_ascii=False, default=_json_default) + '\n')
+        else:
+            if writer is None:
+                writer = csv.writer(out)
+                writer.writerow(item.keys())
+            writer.writerow([_csv_value(v) for v in item.values()])
+        count += 1
+    return count
+
+
+def connect(db_path, read_only: bool = False, cached_statements: int = 128) -> sqlite3.Connection:
+    """read_only=True は mode=ro で開く（常駐サーバーのプール用、スレッド間で受け渡し可）"""
+    if read_only:
+        uri = f'{Path(db_path).resolve().as_uri()}?mode=ro'
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=False, cached_statements=cached_statements)
+    else:
+        conn = sqlite3.connect(db_path, cached_statements=cached_statements)
     conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    
+    return conn
+
+
+def project(sql: str, columns: Optional[Sequence[str]] = None) -> str:
+    """SELECT を指定列だけに絞る（サブクエリは平坦化されるため、外した列は読み込まれない）"""
+    if not columns:
+        return sql
+    # "列名" は存在しない列だと文字列リテラル扱いになるため `列名` で囲む（存在しなければエラー）
+    select = ', '.join('`' + c.replace('`', '``') + '`' for c in columns)
+    return f'SELECT {select} FROM ({sql.strip().rstrip(";")})'
+
+
+def iter_sql(conn: sqlite3.Connection, sql: str, limit: int = 0, params=(),
+             columns: Optional[Sequence[str]] = None, batch_size: int = FETCH_BATCH) -> Iterator[sqlite3.Row]:
+    """カーソルを batch_size 行ずつ読み進める（limit=0 は全件）"""
+    cursor = conn.execute(project(sql, columns), params)
+    remaining = limit if limit > 0 else None
     try:
-        cursor.execute(sql)
-        rows = cursor.fetchmany(limit)
-        result = [dict(row) for row in rows]
-        print(json.dumps(result, ensure_ascii=False, indent=2))
+        while remaining is None or remaining > 0:
+            rows = cursor.fetchmany(batch_size if remaining is None else min(batch_size, remaining))
+            if not rows:
+                break
+            yield from rows
+            if remaining is not None:
+                remaining -= len(rows)
+    finally:
+        cursor.close()
+
+
+def run_sql(conn: sqlite3.Connection, sql: str, limit: int = DEFAULT_LIMIT, params=(),
+            columns: Optional[Sequence[str]] = None) -> List[Dict]:
+    return [dict(row) for row in iter_sql(conn, sql, limit, params, columns)]
+
+
+def query_brain(sql: str, limit: int = 10, db_path: Path = DB_PATH):
+    """SQLiteからデータを取得"""
+    conn = connect(db_path)
+
+    try:
+        print_json(run_sql(conn, sql, limit))
     except Exception as e:
         print(f"ERROR: {e}", file=sys.stderr)
         sys.exit(1)
     finally:
         conn.close()
 
+
+# ======================
+# 全文検索（FTS5）
+# ======================
+
+def build_match(terms: List[str]) -> Tuple[Optional[str], List[str]]:
+    """語リスト → (MATCH式, LIKEで絞る短い語)"""
+    long_terms = [t for t in terms if len(t) >= 3]
+    short_terms = [t for t in terms if len(t) < 3]
+    match = ' AND '.join('"' + t.replace('"', '""') + '"' for t in long_terms) or None
+    return match, short_terms
+
+
+def run_search(conn: sqlite3.Connection, query: str, raw: bool = False, k: int = 10) -> List[Dict]:
+    if not conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (FTS_TABLE,)).fetchone():
+        raise ValueError(f"{FTS_TABLE} がありません（export_code_map_to_sqlite.py を実行してください）")
+
+    if raw:
+        match, short_terms = query, []
+    else:
+        match, short_terms = build_match(query.split())
+    if match is None and not short_terms:
+        raise ValueError("検索語を指定してください")
+
+    where, params = [], []
+    if match is not None:
+        where.append(f'{FTS_TABLE} MATCH ?')
+        params.append(match)
+    for term in short_terms:
+        pattern = '%' + term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        where.append("(c.file_path LIKE ? ESCAPE '\\' OR c.file_name LIKE ? ESCAPE '\\' OR c.content LIKE ? ESCAPE '\\')")
+        params.extend([pattern] * 3)
+
+    if match is not None:
+        # MATCH があるときは FTS 側から引いて bm25 順
+        sql = f'''
+            SELECT c.id, c.file_path, c.chunk_index, c.total_chunks,
+                   bm25({FTS_TABLE}, {', '.join(map(str, FTS_WEIGHTS))}) AS rank,
+                   snippet({FTS_TABLE}, 2, '【', '】', '…', {SNIPPET_TOKENS}) AS snippet
+            FROM {FTS_TABLE} JOIN code_map c ON c.rowid = {FTS_TABLE}.rowid
+            WHERE {' AND '.join(where)}
+            ORDER BY rank
+            LIMIT ?
+        '''
+    else:
+        # 短い語だけの場合は索引を使えないため LIKE 走査（順位なし）
+        sql = f'''
+            SELECT c.id, c.file_path, c.chunk_index, c.total_chunks, NULL AS rank,
+                   substr(c.content, 1, 120) AS snippet
+            FROM code_map c
+            WHERE {' AND '.join(where)}
+            ORDER BY c.file_path, c.chunk_index
+            LIMIT ?
+        '''
+    params.append(k)
+
+    result = []
+    for row in conn.execute(sql, params):
+        item = dict(row)
+        if item['rank'] is not None:
+            item['rank'] = round(item['rank'], 3)
+        result.append(item)
+    return result
+
+
+# ======================
+# 類似検索（ベクトル行列キャッシュ）
+# ======================
+
+def cache_paths(db_path: Path) -> Dict[str, Path]:
+    base = db_path.with_suffix('')
+    return {
+        'vectors': base.with_name(base.name + '.vectors.npy'),
+        'rowids': base.with_name(base.name + '.vectors.rowids.npy'),
+        'meta': base.with_name(base.name + '.vectors.json'),
+    }
+
+
+def cache_key(conn: sqlite3.Connection) -> List:
+    """code_map の変化を検出するキー"""
+    count, max_rowid, max_updated = conn.execute(
+        'SELECT COUNT(*), MAX(rowid), MAX(updated_at) FROM code_map'
+    ).fetchone()
+    synced_at = None
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sync_checkpoint'").fetchone():
+        row = conn.execute("SELECT synced_at FROM sync_checkpoint WHERE source = 'code_map'").fetchone()
+        synced_at = row[0] if row else None
+    return [count, max_rowid, max_updated, synced_at]
+
+
+def build_vector_cache(conn: sqlite3.Connection, paths: Dict[str, Path], key: List, batch_size: int = 5000) -> Dict:
+    """embedding BLOB を L2 正規化した float32 行列（N×次元）として書き出す"""
+    np = require_numpy()
+    row = conn.execute(
+        "SELECT length(embedding) FROM code_map WHERE typeof(embedding) = 'blob' "
+        "GROUP BY length(embedding) ORDER BY COUNT(*) DESC LIMIT 1"
+    ).fetchone()
+    if row is None:
+        raise ValueError("code_map に BLOB 形式の embedding がありません（export_code_map_to_sqlite.py を再実行してください）")
+    nbytes = row[0]
+    dim = nbytes // 4
+    count = conn.execute(
+        "SELECT COUNT(*) FROM code_map WHERE typeof(embedding) = 'blob' AND length(embedding) = ?", (nbytes,)
+    ).fetchone()[0]
+
+    tmp = {name: path.with_name(path.name + '.tmp') for name, path in paths.items()}
+    vectors = np.lib.format.open_memmap(tmp['vectors'], mode='w+', dtype='<f4', shape=(count, dim))
+    rowids = np.empty(count, dtype='<i8')
+
+    cursor = conn.execute(
+        "SELECT rowid, embedding FROM code_map WHERE typeof(embedding) = 'blob' AND length(embedding) = ? "
+        "ORDER BY rowid",
+        (nbytes,),
+    )
+    offset = 0
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        block = np.frombuffer(b''.join(blob for _, blob in rows), dtype='<f4').reshape(len(rows), dim)
+        norms = np.linalg.norm(block, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        vectors[offset:offset + len(rows)] = block / norms
+        rowids[offset:offset + len(rows)] = [rowid for rowid, _ in rows]
+        offset += len(rows)
+    vectors.flush()
+    del vectors
+
+    # np.save にパスを渡すと .npy が付くため、開いたファイルへ書く
+    with open(tmp['rowids'], 'wb') as f:
+        np.save(f, rowids[:offset])
+    meta = {'key': key, 'dim': dim, 'count': offset, 'built_at': time.strftime('%Y-%m-%dT%H:%M:%S')}
+    tmp['meta'].write_text(json.dumps(meta), encoding='utf-8')
+    # メタを最後に差し替える（途中で落ちても古いメタ＝キー不一致で再構築）
+    for name in ('vectors', 'rowids', 'meta'):
+        os.replace(tmp[name], paths[name])
+    return meta
+
+
+def load_vectors(conn: sqlite3.Connection, db_path: Path) -> Tuple:
+    """(正規化済み行列[mmap], rowid配列, メタ)。キャッシュが古ければ再構築"""
+    np = require_numpy()
+    paths = cache_paths(Path(db_path))
+    key = cache_key(conn)
+    meta = None
+    if paths['meta'].exists():
+        meta = json.loads(paths['meta'].read_text(encoding='utf-8'))
+    if meta is None or meta.get('key') != key or not paths['vectors'].exists():
+        print("ベクトルキャッシュを作成中...", file=sys.stderr)
+        meta = build_vector_cache(conn, paths, key)
+    vectors = np.load(paths['vectors'], mmap_mode='r')
+    rowids = np.load(paths['rowids'])
+    return vectors, rowids, meta
+
+
+def query_vector(conn: sqlite3.Connection, chunk_id: Optional[str] = None, file_path: Optional[str] = None,
+                 vector: Optional[List[float]] = None) -> Tuple['np.ndarray', List[int]]:
+    """検索ベクトルと、結果から除外する rowid"""
+    np = require_numpy()
+    if chunk_id:
+        row = conn.execute('SELECT rowid, embedding FROM code_map WHERE id = ?', (chunk_id,)).fetchone()
+        if row is None or not isinstance(row[1], bytes):
+            raise ValueError(f"embedding のあるチャンクが見つかりません: {chunk_id}")
+        return np.frombuffer(row[1], dtype='<f4'), [row[0]]
+    if file_path:
+        rows = conn.execute(
+            "SELECT rowid, embedding FROM code_map WHERE file_path = ? AND typeof(embedding) = 'blob'",
+            (file_path,),
+        ).fetchall()
+        if not rows:
+            raise ValueError(f"embedding のあるチャンクが見つかりません: {file_path}")
+        block = np.stack([np.frombuffer(blob, dtype='<f4') for _, blob in rows])
+        block /= np.maximum(np.linalg.norm(block, axis=1, keepdims=True), 1e-12)
+        return block.mean(axis=0), [rowid for rowid, _ in rows]
+    if vector is None:
+        raise ValueError("id / file / vector のいずれかを指定してください")
+    return np.asarray(vector, dtype='<f4'), []
+
+
+def top_k(vectors: 'np.ndarray', query: 'np.ndarray', k: int,
+          exclude: Optional['np.ndarray'] = None) -> Tuple['np.ndarray', 'np.ndarray']:
+    """コサイン類似度の上位k件（行番号, スコア）。行列×ベクトル1回"""
+    np = require_numpy()
+    norm = np.linalg.norm(query)
+    scores = vectors @ (query / norm if norm else query)
+    if exclude is not None and len(exclude):
+        scores[exclude] = -np.inf
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+    part = np.argpartition(-scores, k - 1)[:k]
+    order = part[np.argsort(-scores[part])]
+    return order, scores[order]
+
+
+def run_similar(conn: sqlite3.Connection, get_vectors: Callable[[], Tuple], chunk_id: Optional[str] = None,
+                file_path: Optional[str] = None, vector: Optional[List[float]] = None, k: int = 10) -> List[Dict]:
+    """get_vectors: (行列, rowid配列, メタ) を返す関数（常駐サーバーでは読み込み済みのものを返す）"""
+    np = require_numpy()
+    vectors, rowids, meta = get_vectors()
+    query, exclude_rowids = query_vector(conn, chunk_id, file_path, vector)
+    if query.shape != (meta['dim'],):
+        raise ValueError(f"次元が一致しません: クエリ {query.shape[0]} / インデックス {meta['dim']}")
+
+    exclude = np.flatnonzero(np.isin(rowids, exclude_rowids)) if exclude_rowids else None
+    order, scores = top_k(vectors, query, k, exclude)
+
+    hits = [(int(rowids[i]), float(score)) for i, score in zip(order, scores)]
+    details = {}
+    if hits:
+        placeholders = ', '.join('?' for _ in hits)
+        for row in conn.execute(
+            f'SELECT rowid, id, file_path, file_name, chunk_index, total_chunks FROM code_map WHERE rowid IN ({placeholders})',
+            [rowid for rowid, _ in hits],
+        ):
+            details[row['rowid']] = {k: row[k] for k in ('id', 'file_path', 'file_name', 'chunk_index', 'total_chunks')}
+    return [dict(details.get(rowid, {'rowid': rowid}), score=round(score, 4)) for rowid, score in hits]
+
+
+# ======================
+# 実行（ローカル / 常駐サーバー）
+# ======================
+
+def dispatch(conn: sqlite3.Connection, command: str, payload: Dict,
+             get_vectors: Optional[Callable[[], Tuple]] = None) -> List[Dict]:
+    """コマンド名 + JSONペイロードを実行（CLIと brain_server.py で共通）"""
+    columns = payload.get('columns') or None
+    if command == 'sql':
+        return run_sql(conn, payload['sql'], int(payload.get('limit', DEFAULT_LIMIT)),
+                       payload.get('params') or (), columns)
+    if command == 'search':
+        result = run_search(conn, payload['query'], bool(payload.get('raw')), int(payload.get('k', 10)))
+    elif command == 'similar':
+        if get_vectors is None:
+            raise ValueError("similar にはベクトルの読み込み関数が必要です")
+        result = run_similar(conn, get_vectors, payload.get('id'), payload.get('file'),
+                             payload.get('vector'), int(payload.get('k', 10)))
+    else:
+        raise ValueError(f"不明なコマンド: {command}")
+    if columns:
+        result = [{c: item.get(c) for c in columns} for item in result]
+    return result
+
+
+def forward(server: str, command: str, payload: Dict, timeout: float = 60.0) -> List[Dict]:
+    """常駐サーバーへ転送。サーバー側のエラーは ValueError、接続できなければ URLError"""
+    request = urllib.request.Request(
+        f"{server.rstrip('/')}/{command}",
+        data=json.dumps(payload, ensure_ascii=False).encode('utf-8'),
+        headers={'Content-Type': 'application/json'},
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return json.loads(response.read())['result']
+    except urllib.error.HTTPError as e:
+        try:
+            message = json.loads(e.read()).get('error', str(e))
+        except ValueError:
+            message = str(e)
+        raise ValueError(message)
+
+
+def build_payload(args) -> Dict:
+    if args.command == 'sql':
+        payload = {'sql': args.sql, 'limit': args.limit}
+    elif args.command == 'search':
+        payload = {'query': args.query, 'raw': args.raw, 'k': args.k}
+    else:
+        vector = None
+        if args.vector:
+            text = sys.stdin.read() if args.vector == '-' else Path(args.vector).read_text(encoding='utf-8')
+            vector = json.loads(text)
+        payload = {'id': args.id, 'file': args.file, 'vector': vector, 'k': args.k}
+    if args.columns:
+        payload['columns'] = args.columns
+    return payload
+
+
+def stream_sql(db_path: str, payload: Dict, fmt: str) -> int:
+    """sql の結果をカーソルから直接書き出す（ndjson / csv）"""
+    conn = connect(db_path)
+    try:
+        rows = iter_sql(conn, payload['sql'], payload['limit'], (), payload.get('columns'))
+        try:
+            return write_rows(rows, fmt)
+        finally:
+            rows.close()
+    finally:
+        conn.close()
+
+
+def run_local(db_path: str, command: str, payload: Dict) -> List[Dict]:
+    conn = connect(db_path)
+    try:
+        return dispatch(conn, command, payload, lambda: load_vectors(conn, Path(db_path)))
+    finally:
+        conn.close()
+
+
+def main(argv: List[str]):
+    # 旧形式: query_brain.py [--db PATH] 'SELECT ...' [limit]
+    i = 0
+    while i < len(argv) and argv[i].startswith('-'):
+        i += 2 if argv[i] in ('--db', '--server') else 1
+    if i < len(argv) and argv[i] not in COMMANDS:
+        argv = argv[:i] + ['sql'] + argv[i:]
+
+    parser = argparse.ArgumentParser(description='N3 Local Brain クエリツール')
+    parser.add_argument('--db', default=str(DB_PATH), help=f'SQLite（デフォルト: {DB_PATH}）')
+    parser.add_argument('--server', default=os.getenv(SERVER_ENV),
+                        help=f'常駐サーバーのURL（デフォルト: 環境変数 {SERVER_ENV}）')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    output = argparse.ArgumentParser(add_help=False)
+    output.add_argument('--format', choices=FORMATS, default='json',
+                        help='出力形式（ndjson / csv は1行ずつ書き出す）')
+    output.add_argument('--columns', type=lambda s: [c.strip() for c in s.split(',') if c.strip()],
+                        help='出力する列（カンマ区切り）')
+
+    p = sub.add_parser('sql', help='SQLを実行', parents=[output])
+    p.add_argument('sql')
+    p.add_argument('limit', nargs='?', type=int, default=None,
+                   help=f'件数（json は省略時 {DEFAULT_LIMIT}、ndjson / csv は省略時・0 で全件）')
+
+    p = sub.add_parser('search', help='全文検索（BM25順、スニペット付き）', parents=[output])
+    p.add_argument('query', help='検索語（空白区切りでAND、部分一致）')
+    p.add_argument('--raw', action='store_true', help='FTS5 のクエリ構文（OR / NOT / NEAR / 列名:）をそのまま使う')
+    p.add_argument('-k', type=int, default=10, help='件数')
+
+    p = sub.add_parser('similar', help='embedding の類似チャンク（コサイン類似度）', parents=[output])
+    source = p.add_mutually_exclusive_group(required=True)
+    source.add_argument('--id', help='code_map.id のチャンクに近いもの')
+    source.add_argument('--file', help='file_path の全チャンク平均に近いもの')
+    source.add_argument('--vector', help='クエリベクトル（JSON配列のファイル、- で標準入力）')
+    p.add_argument('-k', type=int, default=10, help='件数')
+
+    args = parser.parse_args(argv)
+    streaming = args.command == 'sql' and args.format != 'json'
+    if args.command == 'sql' and args.limit is None:
+        args.limit = 0 if streaming else DEFAULT_LIMIT
+
+    try:
+        payload = build_payload(args)
+        started = time.perf_counter()
+        if streaming:
+            count = stream_sql(args.db, payload, args.format)
+            sys.stdout.flush()
+            print(f"{count} 行 / {(time.perf_counter() - started) * 1000:.0f}ms", file=sys.stderr)
+            return
+        result = None
+        if args.server:
+            try:
+                result = forward(args.server, args.command, payload)
+            except urllib.error.URLError as e:
+                print(f"サーバーに接続できません（{args.server}: {e.reason}）。ローカルで実行します", file=sys.stderr)
+        if result is None:
+            result = run_local(args.db, args.command, payload)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+    except BrokenPipeError:
+        raise
+    except Exception as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    write_rows(result, args.format)
+    if args.command != 'sql':
+        print(f"{len(result)} 件 / 検索 {elapsed_ms:.1f}ms", file=sys.stderr)
+
+
 if __name__ == "__main__":
     if len(sys.argv) < 2:
-        print("Usage: python3 query_brain.py 'SELECT ...'")
+        print("Usage: python3 query_brain.py 'SELECT ...' [limit]")
+        print("       python3 query_brain.py search 'keyword ...' [-k 10]")
+        print("       python3 query_brain.py similar --id <chunk id> [-k 10]")
+        sys.exit(1)
+
+    try:
+        main(sys.argv[1:])
+    except BrokenPipeError:
+        # | head 等で出力先が先に閉じた場合
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
         sys.exit(1)
-    
-    sql = sys.argv[1]
-    limit = int(sys.argv[2]) if len(sys.argv) > 2 else 10
-    query_brain(sql, limit)
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+N3 Empire OS - アトミックJSON出力ライター
+=========================================
+Version: 1.0.0
+Purpose: 変換スクリプトの出力を安全かつ高速に書き込む
+
+仕組み:
+1. orjsonでメモリ上にエンコード（未インストール時は標準json、出力バイトは同一）
+2. 既存ファイルと内容が同一なら書き込まない（mtimeを維持して下流の同期を抑止）
+3. 同一ディレクトリの一時ファイルへ書き込み
+4. 一定件数ごとにまとめてfsync → os.replaceでアトミックに置換
+   → 途中でクラッシュしても、出力先は「旧ファイル」か「完全な新ファイル」のどちらか
+
+使用例:
+  with AtomicJsonWriter() as writer:
+      for path, workflow in outputs:
+          writer.write_json(path, workflow)
+"""
+
+import os
+import json
+import math
+from pathlib import Path
+from typing import Any, Dict, Optional, Union
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - 標準jsonにフォールバック
+    orjson = None
+
+
+PathLike = Union[str, Path]
+
+DEFAULT_FSYNC_BATCH = 32
+
+
+def _has_non_finite(obj: Any) -> bool:
+    """NaN/Infinity を含むか"""
+    stack = [obj]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, float):
+            if not math.isfinite(value):
+                return True
+        elif isinstance(value, dict):
+            stack.extend(value.values())
+        elif isinstance(value, (list, tuple)):
+            stack.extend(value)
+    return False
+
+
+def encode_json(obj: Any) -> bytes:
+    """json.dump(obj, ensure_ascii=False, indent=2) と同じバイト列を生成
+
+    NaN/Infinity は不正なJSONになるため、orjson・標準jsonのどちらでも ValueError
+    （orjsonは黙ってnullにするので、出力にnullがある場合だけ元データを確認する）
+    """
+    if orjson is not None:
+        try:
+            data = orjson.dumps(obj, option=orjson.OPT_INDENT_2)
+        except TypeError:
+            # 非文字列キーや64bit超の整数などはorjsonが扱えないため標準jsonへ
+            pass
+        else:
+            if b'null' in data and _has_non_finite(obj):
+                raise ValueError('Out of range float values are not JSON compliant')
+            return data
+    return json.dumps(obj, ensure_ascii=False, indent=2, allow_nan=False).encode('utf-8')
+
+
+def _same_content(path: str, data: bytes) -> bool:
+    """既存ファイルと内容が同一か（サイズ比較で大半を即判定）"""
+    try:
+        if os.path.getsize(path) != len(data):
+            return False
+        with open(path, 'rb') as f:
+            return f.read() == data
+    except OSError:
+        return False
+
+
+class AtomicJsonWriter:
+    """一時ファイル + バッチfsync + アトミックrenameによる出力ライター"""
+
+    def __init__(self, fsync_batch: int = DEFAULT_FSYNC_BATCH, skip_unchanged: bool = True):
+        self.fsync_batch = max(1, fsync_batch)
+        self.skip_unchanged = skip_unchanged
+        # 出力先パス → (一時ファイルパス, fd)
+        self._pending: Dict[str, tuple] = {}
+        self.stats = {'written': 0, 'unchanged': 0}
+
+    def __enter__(self) -> 'AtomicJsonWriter':
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # 書き込み済みの一時ファイルはそれぞれ完全なので、例外時もコミットする
+        self.flush()
+
+    def write_json(self, path: PathLike, obj: Any) -> bool:
+        """JSONを書き込む。内容が同一でスキップした場合はFalse"""
+        return self.write_bytes(path, encode_json(obj))
+
+    def write_bytes(self, path: PathLike, data: bytes) -> bool:
+        path = os.fspath(path)
+
+        if self.skip_unchanged and path not in self._pending and _same_content(path, data):
+            self.stats['unchanged'] += 1
+            return False
+
+        directory = os.path.dirname(path) or '.'
+        os.makedirs(directory, exist_ok=True)
+
+        # 同じ出力先への再書き込みは前の一時ファイルを破棄
+        self._discard(path)
+
+        tmp_path = os.path.join(directory, f'.{os.path.basename(path)}.{os.getpid()}.tmp')
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            view = memoryview(data)
+            while view:
+                written = os.write(fd, view)
+                view = view[written:]
+        except BaseException:
+            os.close(fd)
+            os.unlink(tmp_path)
+            raise
+
+        self._pending[path] = (tmp_path, fd)
+        self.stats['written'] += 1
+
+        if len(self._pending) >= self.fsync_batch:
+            self.flush()
+        return True
+
+    def _discard(self, path: str):
+        entry = self._pending.pop(path, None)
+        if entry:
+            tmp_path, fd = entry
+            os.close(fd)
+            os.unlink(tmp_path)
+
+    def flush(self):
+        """保留中の一時ファイルをfsyncしてアトミックに置換"""
+        if not self._pending:
+            return
+
+        pending, self._pending = self._pending, {}
+        directories = set()
+
+        for path, (tmp_path, fd) in pending.items():
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+            os.replace(tmp_path, path)
+            directories.add(os.path.dirname(path) or '.')
+
+        # rename自体を永続化するためディレクトリもfsync
+        for directory in directories:
+            try:
+                dir_fd = os.open(directory, os.O_RDONLY)
+            except OSError:
+                continue
+            try:
+                os.fsync(dir_fd)
+            except OSError:
+                pass
+            finally:
+                os.close(dir_fd)
+
+
+def write_json_atomic(path: PathLike, obj: Any, writer: Optional[AtomicJsonWriter] = None) -> bool:
+    """単一ファイルをアトミックに書き込む（writer指定時はそのバッチに載せる）"""
+    if writer is not None:
+        return writer.write_json(path, obj)
+    with AtomicJsonWriter(fsync_batch=1) as single:
+        return single.write_json(path, obj)
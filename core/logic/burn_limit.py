@@ -0,0 +1,232 @@
+"""
+N3 Empire OS - 燃焼上限（APIコスト）計測エンジン
+=====================================
+Version: 1.0.0
+Purpose: AIプロバイダー呼び出しのコスト見積もりと、テナント×プロバイダー別の予算管理
+Features:
+  - バージョン付きのプロバイダー別コスト表（JSONファイルで上書き・再読み込み可能）
+  - テナント×プロバイダーごとのトークンバケット（予算を期間で按分して補充）
+  - 消費額・拒否回数の集計
+
+n8nの注入ノードは価格計算APIの /burn-limit/check を1回呼ぶだけで、
+単価はワークフローに埋め込まない（単価変更でワークフローを再パッチする必要がない）
+"""
+
+import json
+import time
+import threading
+from dataclasses import dataclass, field, asdict
+from typing import Callable, Dict, Optional, Tuple
+
+
+# ======================
+# コスト表
+# ======================
+
+COST_TABLE_VERSION = '2026.10.1'
+
+# 未登録プロバイダーの1単位あたりの概算（USD）
+DEFAULT_UNIT_COST_USD = 0.01
+
+
+@dataclass(frozen=True)
+class ProviderCost:
+    """プロバイダー1単位あたりのコスト"""
+    usd_per_unit: float
+    unit: str = 'request'
+
+
+# プロバイダー別の概算単価
+DEFAULT_PROVIDER_COSTS = {
+    'openai': ProviderCost(0.03, '1k_tokens'),      # GPT-4 1Kトークン概算
+    'gemini': ProviderCost(0.01, '1k_tokens'),
+    'claude': ProviderCost(0.025, '1k_tokens'),
+    'elevenlabs': ProviderCost(0.05, '1k_chars'),   # 1000文字概算
+    'midjourney': ProviderCost(0.10, 'image'),      # 1画像概算
+    'suno': ProviderCost(0.10, 'track'),
+    'deepseek': ProviderCost(0.005, '1k_tokens'),
+    'zenrows': ProviderCost(0.01, 'request'),
+}
+
+
+@dataclass
+class CostTable:
+    """バージョン付きコスト表"""
+    version: str = COST_TABLE_VERSION
+    providers: Dict[str, ProviderCost] = field(default_factory=lambda: dict(DEFAULT_PROVIDER_COSTS))
+    default_usd: float = DEFAULT_UNIT_COST_USD
+
+    def estimate(self, provider: str, units: float = 1.0) -> float:
+        """呼び出しコストの見積もり（USD）"""
+        cost = self.providers.get(provider)
+        unit_usd = cost.usd_per_unit if cost else self.default_usd
+        return round(unit_usd * max(0.0, units), 6)
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'CostTable':
+        """{"version": ..., "default_usd": ..., "providers": {"openai": {"usd_per_unit": 0.03, "unit": "1k_tokens"}}}
+
+        形式が不正な場合は ValueError（必須キーの欠落は KeyError）
+        """
+        try:
+            providers = dict(DEFAULT_PROVIDER_COSTS)
+            for name, value in (data.get('providers') or {}).items():
+                if isinstance(value, dict):
+                    providers[name] = ProviderCost(float(value['usd_per_unit']), value.get('unit', 'request'))
+                else:
+                    providers[name] = ProviderCost(float(value))
+            return cls(
+                version=str(data.get('version', COST_TABLE_VERSION)),
+                providers=providers,
+                default_usd=float(data.get('default_usd', DEFAULT_UNIT_COST_USD)),
+            )
+        except (AttributeError, TypeError) as e:
+            raise ValueError(f'コスト表の形式が不正です: {e}') from e
+
+    @classmethod
+    def from_file(cls, path: str) -> 'CostTable':
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls.from_dict(json.load(f))
+
+    def to_dict(self) -> Dict:
+        return {
+            'version': self.version,
+            'default_usd': self.default_usd,
+            'providers': {name: asdict(cost) for name, cost in sorted(self.providers.items())},
+        }
+
+
+# ======================
+# 予算（トークンバケット）
+# ======================
+
+DEFAULT_DAILY_BUDGET_USD = 10.0
+DEFAULT_PERIOD_SEC = 86400
+
+
+@dataclass
+class TokenBucket:
+    """USD建てのトークンバケット（capacityを period で按分して連続補充）"""
+    capacity: float
+    refill_per_sec: float
+    tokens: float
+    updated_at: float
+
+    def refill(self, now: float):
+        elapsed = max(0.0, now - self.updated_at)
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.refill_per_sec)
+        self.updated_at = now
+
+    def try_consume(self, amount: float, now: float) -> bool:
+        self.refill(now)
+        if amount <= self.tokens:
+            self.tokens -= amount
+            return True
+        return False
+
+    def retry_after(self, amount: float) -> Optional[float]:
+        """amount分が貯まるまでの秒数（予算上限を超える場合はNone）"""
+        if amount > self.capacity:
+            return None
+        if self.refill_per_sec <= 0:
+            return None
+        return max(0.0, (amount - self.tokens) / self.refill_per_sec)
+
+
+@dataclass
+class SpendTotals:
+    """テナント×プロバイダー別の集計"""
+    spent_usd: float = 0.0
+    requests: int = 0
+    denied: int = 0
+
+
+class BurnLimiter:
+    """コスト見積もり + 予算判定 + 消費集計"""
+
+    def __init__(self, cost_table: Optional[CostTable] = None,
+                 daily_budget_usd: float = DEFAULT_DAILY_BUDGET_USD,
+                 budgets: Optional[Dict[str, float]] = None,
+                 period_sec: float = DEFAULT_PERIOD_SEC,
+                 clock: Callable[[], float] = time.monotonic):
+        self.cost_table = cost_table or CostTable()
+        self.daily_budget_usd = daily_budget_usd
+        # 予算の上書き: "tenant:provider" > "tenant" > "provider" の順に参照
+        self.budgets = dict(budgets or {})
+        self.period_sec = period_sec
+        self.clock = clock
+        self._buckets: Dict[Tuple[str, str], TokenBucket] = {}
+        self._totals: Dict[Tuple[str, str], SpendTotals] = {}
+        self._lock = threading.Lock()
+
+    def budget_for(self, tenant_id: str, provider: str) -> float:
+        for key in (f'{tenant_id}:{provider}', tenant_id, provider):
+            if key in self.budgets:
+                return float(self.budgets[key])
+        return self.daily_budget_usd
+
+    def _bucket(self, key: Tuple[str, str], now: float) -> TokenBucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            budget = self.budget_for(*key)
+            bucket = TokenBucket(budget, budget / self.period_sec, budget, now)
+            self._buckets[key] = bucket
+        return bucket
+
+    def check(self, tenant_id: str, provider: str, units: float = 1.0) -> Dict:
+        """見積もりコストを予算から差し引き、許可/拒否を返す"""
+        key = (tenant_id or 'default', provider or 'unknown')
+        cost = self.cost_table.estimate(key[1], units)
+        now = self.clock()
+
+        with self._lock:
+            bucket = self._bucket(key, now)
+            allowed = bucket.try_consume(cost, now)
+            totals = self._totals.setdefault(key, SpendTotals())
+            totals.requests += 1
+            if allowed:
+                totals.spent_usd = round(totals.spent_usd + cost, 6)
+            else:
+                totals.denied += 1
+            retry_after = None if allowed else bucket.retry_after(cost)
+            remaining = bucket.tokens
+
+        return {
+            'allowed': allowed,
+            'tenantId': key[0],
+            'apiProvider': key[1],
+            'units': units,
+            'estimatedCostUsd': cost,
+            'remainingUsd': round(remaining, 6),
+            'budgetUsd': bucket.capacity,
+            'retryAfterSec': round(retry_after, 1) if retry_after is not None else None,
+            'costTableVersion': self.cost_table.version,
+        }
+
+    def set_cost_table(self, cost_table: CostTable):
+        """コスト表を差し替え（予算・集計は維持）"""
+        with self._lock:
+            self.cost_table = cost_table
+
+    def snapshot(self) -> Dict:
+        """テナント×プロバイダー別の消費集計"""
+        now = self.clock()
+        with self._lock:
+            rows = []
+            for key, totals in sorted(self._totals.items()):
+                bucket = self._buckets[key]
+                bucket.refill(now)
+                rows.append({
+                    'tenantId': key[0],
+                    'apiProvider': key[1],
+                    'spentUsd': totals.spent_usd,
+                    'requests': totals.requests,
+                    'denied': totals.denied,
+                    'remainingUsd': round(bucket.tokens, 6),
+                    'budgetUsd': bucket.capacity,
+                })
+        return {
+            'costTableVersion': self.cost_table.version,
+            'totalSpentUsd': round(sum(r['spentUsd'] for r in rows), 6),
+            'spend': rows,
+        }
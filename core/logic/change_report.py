@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""
+N3 Empire OS - ストリーミング変更レポート（CSV / JSONL）
+=========================================
+Version: 1.0.0
+Purpose: 変換スクリプトのノード単位の変更記録を、処理しながら逐次書き出す
+
+仕組み:
+- 変更1件 = 1レコード（ファイル, ノードID, ノード名, フィールド, 種別, 旧値, 新値, 位置）
+- ファイル1件の処理完了ごとに完了マーカー（record=file_done）を書き込む
+- 一定件数・一定時間ごとにまとめてflush（flush前に出力ライター等のコールバックを実行し、
+  「完了マーカーはあるのに出力ファイルが無い」状態を防ぐ）
+- 再開時は最後の完了マーカーより後ろ（途中で落ちたファイルの記録）を切り捨て、
+  完了済みファイルの一覧を返す → 呼び出し側はそれらをスキップして追記を続ける
+- 形式は拡張子で判定（.jsonl / .ndjson → JSONL、それ以外 → CSV）
+
+使用例:
+  with ChangeReportSink('report.jsonl', resume=True, before_flush=writer.flush) as sink:
+      for path in files:
+          if path in sink.completed:
+              continue
+          sink.write(file=path, node_id=..., field='query', change='sql', old='orders', new='n3_orders')
+          sink.complete_file(path, changed=True)
+"""
+
+import os
+import csv
+import io
+import json
+import time
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+
+RECORD_CHANGE = 'change'
+RECORD_FILE_DONE = 'file_done'
+
+FIELDS = ['record', 'file', 'node_id', 'node', 'field', 'change', 'old', 'new', 'location']
+
+DEFAULT_FLUSH_EVERY = 500
+DEFAULT_FLUSH_INTERVAL = 2.0
+
+
+def detect_format(path: str) -> str:
+    return 'jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv'
+
+
+# ======================
+# 既存レポートの読み込み（再開用）
+# ======================
+
+def _iter_lines_with_offset(data: bytes) -> Iterator[Tuple[str, int]]:
+    """(行, その行末までのバイトオフセット) を返す
+
+    改行で終わらない末尾の行・デコードできない行（マルチバイト文字の途中で切れた行）は
+    書き込み途中で落ちた行とみなし、そこで打ち切る（以降は再開時に切り捨てられる）
+    """
+    offset = 0
+    while offset < len(data):
+        end = data.find(b'\n', offset)
+        if end < 0:
+            return
+        try:
+            line = data[offset:end + 1].decode('utf-8')
+        except UnicodeDecodeError:
+            return
+        offset = end + 1
+        yield line, offset
+
+
+def _scan_jsonl(data: bytes) -> Tuple[Dict[str, Dict], int]:
+    completed: Dict[str, Dict] = {}
+    valid_end = 0
+    for line, end in _iter_lines_with_offset(data):
+        if not line.endswith('\n'):
+            break  # 書き込み途中で落ちた行
+        try:
+            record = json.loads(line)
+        except ValueError:
+            break
+        if record.get('record') == RECORD_FILE_DONE:
+            completed[record['file']] = record
+            valid_end = end
+    return completed, valid_end
+
+
+def _scan_csv(data: bytes) -> Tuple[Dict[str, Dict], int]:
+    completed: Dict[str, Dict] = {}
+    valid_end = 0
+    consumed = [0]
+
+    def lines():
+        for line, end in _iter_lines_with_offset(data):
+            consumed[0] = end
+            yield line
+
+    reader = csv.DictReader(lines())
+    try:
+        for row in reader:
+            # 複数行にまたがるフィールドも、行の終端 = 直前に読み込んだ行末
+            if row.get('record') == RECORD_FILE_DONE:
+                completed[row['file']] = row
+                valid_end = consumed[0]
+    except csv.Error:
+        pass
+    return completed, valid_end
+
+
+def load_completed(path: str) -> Tuple[Dict[str, Dict], int]:
+    """既存レポートの完了済みファイルと、最後の完了マーカーの終端オフセットを返す"""
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        return {}, 0
+    if detect_format(path) == 'jsonl':
+        return _scan_jsonl(data)
+    return _scan_csv(data)
+
+
+# ======================
+# シンク
+# ======================
+
+class ChangeReportSink:
+    """変更レコードを逐次書き出すレポート"""
+
+    def __init__(self, path: str, resume: bool = False,
+                 flush_every: int = DEFAULT_FLUSH_EVERY,
+                 flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+                 before_flush: Optional[Callable[[], None]] = None):
+        self.path = path
+        self.format = detect_format(path)
+        self.flush_every = max(1, flush_every)
+        self.flush_interval = flush_interval
+        self.before_flush = before_flush
+        self.completed: Dict[str, Dict] = {}
+        self.stats = {'records': 0, 'files': 0, 'resumed': 0}
+
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+        write_header = True
+        if resume and os.path.exists(path):
+            self.completed, valid_end = load_completed(path)
+            self.stats['resumed'] = len(self.completed)
+            # 最後の完了マーカーより後ろは、処理途中で落ちたファイルの記録なので破棄
+            with open(path, 'r+b') as f:
+                f.truncate(valid_end)
+            write_header = valid_end == 0
+            self._f = open(path, 'a', encoding='utf-8', newline='')
+        else:
+            self._f = open(path, 'w', encoding='utf-8', newline='')
+
+        self._buffer: List[str] = []
+        self._last_flush = time.monotonic()
+        if self.format == 'csv' and write_header:
+            self._buffer.append(self._encode_csv(dict(zip(FIELDS, FIELDS))))
+
+    def __enter__(self) -> 'ChangeReportSink':
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _encode_csv(self, record: Dict) -> str:
+        out = io.StringIO()
+        csv.writer(out).writerow([record.get(k, '') for k in FIELDS])
+        return out.getvalue()
+
+    def _encode(self, record: Dict) -> str:
+        if self.format == 'jsonl':
+            return json.dumps(record, ensure_ascii=False) + '\n'
+        return self._encode_csv(record)
+
+    def write(self, **record):
+        """変更レコードを1件追加"""
+        record = {'record': RECORD_CHANGE, **record}
+        self._buffer.append(self._encode(record))
+        self.stats['records'] += 1
+        self._maybe_flush()
+
+    def complete_file(self, file: str, **summary):
+        """ファイル1件の処理完了を記録（再開時はここまでが有効）"""
+        record = {'record': RECORD_FILE_DONE, 'file': file}
+        if self.format == 'jsonl':
+            record.update(summary)
+        else:
+            # CSVでは要約を旧値/新値列に載せずchange列にまとめる
+            record['change'] = json.dumps(summary, ensure_ascii=False) if summary else ''
+        self._buffer.append(self._encode(record))
+        self.completed[file] = record
+        self.stats['files'] += 1
+        self._maybe_flush()
+
+    def _maybe_flush(self):
+        if (len(self._buffer) >= self.flush_every
+                or time.monotonic() - self._last_flush >= self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        if self.before_flush is not None:
+            self.before_flush()
+        if self._buffer:
+            self._f.write(''.join(self._buffer))
+            self._buffer = []
+        self._f.flush()
+        self._last_flush = time.monotonic()
+
+    def close(self):
+        if self._f.closed:
+            return
+        self.flush()
+        os.fsync(self._f.fileno())
+        self._f.close()
@@ -0,0 +1,611 @@
+#!/usr/bin/env python3
+"""
+N3 Empire OS - 要塞化変換エンジン（ステージプラグイン方式）
+=========================================
+Version: 1.0.0
+Purpose: json_fortress_converter / run_batch_conversion 共通の変換エンジン
+
+仕組み:
+- 各変換はステージとしてレジストリに登録し、scope / reads / writes を宣言する
+- エンジンはステージをパスにまとめ、ワークフローのコピーは1回だけ作成する
+  - document: シリアライズ済みJSON文字列に対する置換（dumps/loads 1回でコピーを兼ねる）
+  - workflow: ワークフロー全体に対する構造変更（1ステージ1走査）
+  - node: 連続するnodeステージを1回のノード走査にまとめて実行
+- reads / writes は実行計画の組み立てに使う
+  - nodeステージは読み書きがノード内（node.*）で閉じている場合のみ融合する
+  - documentステージは先頭に前倒しするため、order が前のステージと読み書きが重なる場合はエラー
+- env_vars（document）は insert_hmac より前に実行する（旧 json_fortress_converter は
+  HMAC挿入 → 環境変数化の順）。HMACテンプレートには置換対象のパターンが無いため出力は同じ
+
+使用方法:
+  # 実行計画の表示
+  python fortress_engine.py plan
+
+  # 既存出力（ENHANCED等）とのパリティ確認とベンチマーク
+  python fortress_engine.py parity /path/to/PRODUCTION /path/to/ENHANCED --profile batch
+  # 挿入ノード配置の変更（workflow_layout）以前の出力と比べる場合は座標を除外
+  python fortress_engine.py parity /path/to/PRODUCTION /path/to/ENHANCED --profile batch --ignore-positions
+"""
+
+import sys
+import json
+import re
+import copy
+import time
+import uuid
+import argparse
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Callable, Tuple, FrozenSet
+
+from keyword_matcher import KeywordMatcher
+from workflow_layout import relayout_inserted
+
+
+# ======================
+# 変換設定
+# ======================
+
+# 環境変数化対象のパターン
+ENV_VAR_PATTERNS = [
+    # URLパターン
+    (r'http://160\.16\.120\.186:(\d+)', r'{{ $env.VPS_URL }}:\1'),
+    (r'https://zdzfpucdyxdlavkgrvil\.supabase\.co', r'{{ $env.SUPABASE_URL }}'),
+    (r'https://api\.chatwork\.com', r'{{ $env.CHATWORK_API_URL }}'),
+
+    # ハードコードされた認証情報（パターンマッチ）
+    (r'"X-ChatWorkToken"[:\s]*"[^"]+"', '"X-ChatWorkToken": "{{ $env.CHATWORK_API_KEY }}"'),
+    (r'"apikey"[:\s]*"eyJ[^"]+"', '"apikey": "{{ $env.SUPABASE_ANON_KEY }}"'),
+
+    # n8n内部参照
+    (r'\{\{.*?\$env\.N3_API_URL.*?\}\}', '{{ $env.N3_API_URL }}'),
+    (r'\{\{.*?\$env\.GATEWAY_URL.*?\}\}', '{{ $env.N3_API_URL }}'),
+]
+
+# URLパターンのみ（run_batch_conversion互換）
+URL_ENV_VAR_PATTERNS = ENV_VAR_PATTERNS[:3]
+
+# Python API置換対象のノート
+PYTHON_MIGRATION_MARKER = '[PYTHON_MIGRATION_CANDIDATE]'
+
+# 計算ロジックを含むCodeノードの判定キーワード
+CALC_INDICATORS = [
+    'profit',
+    'margin',
+    'tariff',
+    'shipping',
+    'ddp',
+    'DDP',
+    'exchangeRate',
+    'exchange_rate',
+]
+
+CALC_MATCHER = KeywordMatcher({'calc': CALC_INDICATORS})
+
+FORTRESS_VERSION = '1.0.0'
+
+# HMAC検証ノードのテンプレート
+HMAC_VERIFY_NODE_TEMPLATE = {
+    "parameters": {
+        "jsCode": """// N3 HMAC署名検証（要塞化自動挿入）
+const headers = $input.first().json.headers || {};
+const body = $input.first().json.body || $input.first().json;
+
+const signature = headers['x-n3-signature'] || headers['X-N3-Signature'] || '';
+const timestamp = headers['x-n3-timestamp'] || headers['X-N3-Timestamp'] || '';
+
+// 署名が存在する場合は検証
+if (signature && timestamp) {
+  const secret = $env.N3_HMAC_SECRET;
+  if (!secret) {
+    return [{ json: { error: true, message: 'N3_HMAC_SECRET 環境変数が未設定', code: 'CONFIG_ERROR' } }];
+  }
+
+  // タイムスタンプ検証（5分以内）
+  const ts = parseInt(timestamp, 10);
+  const now = Math.floor(Date.now() / 1000);
+  if (Math.abs(now - ts) > 300) {
+    return [{ json: { error: true, message: 'タイムスタンプ期限切れ', code: 'TIMESTAMP_EXPIRED' } }];
+  }
+
+  // 署名検証（外部APIへ委譲）
+  try {
+    const verifyUrl = $env.PRICING_ENGINE_URL || 'http://localhost:8000';
+    const payload = JSON.stringify(body);
+    const response = await fetch(`${verifyUrl}/verify-signature`, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ payload, signature, timestamp })
+    });
+    const result = await response.json();
+    if (!result.valid) {
+      return [{ json: { error: true, message: '署名検証失敗: ' + (result.error || ''), code: 'INVALID_SIGNATURE' } }];
+    }
+  } catch (e) {
+    // 署名検証APIが利用不可の場合はスキップ（開発環境）
+    console.log('署名検証スキップ: ' + e.message);
+  }
+}
+
+// パススルー
+return $input.all();"""
+    },
+    "type": "n8n-nodes-base.code",
+    "typeVersion": 2,
+    "notes": "[FORTRESS_AUTO_INSERTED] HMAC署名検証"
+}
+
+
+# ======================
+# プロファイル
+# ======================
+
+@dataclass
+class EngineProfile:
+    """エントリーポイントごとの差分設定"""
+    name: str
+    env_patterns: List[Tuple[str, str]]
+    timestamp: Callable[[], str]
+    compiled_env_patterns: List[Tuple['re.Pattern', str]] = field(default_factory=list)
+
+    def __post_init__(self):
+        # 正規表現は1回だけコンパイル
+        self.compiled_env_patterns = [(re.compile(p), r) for p, r in self.env_patterns]
+
+
+PROFILES = {
+    # json_fortress_converter.py
+    'converter': EngineProfile(
+        name='converter',
+        env_patterns=ENV_VAR_PATTERNS,
+        timestamp=lambda: datetime.utcnow().isoformat(),
+    ),
+    # run_batch_conversion.py
+    'batch': EngineProfile(
+        name='batch',
+        env_patterns=URL_ENV_VAR_PATTERNS,
+        timestamp=lambda: datetime.now(timezone.utc).isoformat(),
+    ),
+}
+
+
+# ======================
+# ステージレジストリ
+# ======================
+
+SCOPE_DOCUMENT = 'document'
+SCOPE_WORKFLOW = 'workflow'
+SCOPE_NODE = 'node'
+
+
+@dataclass
+class Stage:
+    """変換ステージ定義"""
+    name: str
+    scope: str
+    reads: FrozenSet[str]
+    writes: FrozenSet[str]
+    order: int
+    func: Callable
+    option: Optional[str] = None
+    description: str = ''
+
+
+STAGE_REGISTRY: Dict[str, Stage] = {}
+
+
+def register_stage(name: str, scope: str, reads, writes, order: int,
+                   option: Optional[str] = None, description: str = ''):
+    """ステージをレジストリに登録するデコレーター"""
+    if scope not in (SCOPE_DOCUMENT, SCOPE_WORKFLOW, SCOPE_NODE):
+        raise ValueError(f'未知のscope: {scope}')
+
+    def decorator(func: Callable) -> Callable:
+        STAGE_REGISTRY[name] = Stage(
+            name=name,
+            scope=scope,
+            reads=frozenset(reads),
+            writes=frozenset(writes),
+            order=order,
+            func=func,
+            option=option,
+            description=description or (func.__doc__ or '').strip(),
+        )
+        return func
+
+    return decorator
+
+
+@dataclass
+class StageContext:
+    """ステージ実行時のコンテキスト"""
+    profile: EngineProfile
+    options: Dict[str, Any]
+
+
+# ======================
+# ヘルパー
+# ======================
+
+def generate_node_id(prefix: str = 'fortress') -> str:
+    """ユニークなノードIDを生成"""
+    return f'{prefix}_{uuid.uuid4().hex[:8]}'
+
+
+def find_webhook_nodes(workflow: Dict) -> List[Dict]:
+    """Webhookノードを検索"""
+    nodes = workflow.get('nodes', [])
+    return [n for n in nodes if n.get('type', '').endswith('.webhook')]
+
+
+def hmac_verify_node_name(webhook_name: str) -> str:
+    return f'🔐 署名検証 ({webhook_name})'
+
+
+# ======================
+# ステージ定義
+# ======================
+
+@register_stage('env_vars', SCOPE_DOCUMENT, reads={'*'}, writes={'*'}, order=10, option='env_vars')
+def stage_env_vars(text: str, ctx: StageContext) -> str:
+    """ハードコード値を環境変数に置換"""
+    for pattern, replacement in ctx.profile.compiled_env_patterns:
+        text = pattern.sub(replacement, text)
+    return text
+
+
+@register_stage('insert_hmac', SCOPE_WORKFLOW, reads={'nodes', 'connections'},
+                writes={'nodes', 'connections'}, order=20, option='insert_hmac')
+def stage_insert_hmac(workflow: Dict, ctx: StageContext):
+    """Webhook直後にHMAC検証ノードを挿入"""
+    nodes = workflow.setdefault('nodes', [])
+    connections = workflow.setdefault('connections', {})
+    names = {n.get('name') for n in nodes}
+    inserted = []
+
+    for webhook in find_webhook_nodes(workflow):
+        webhook_name = webhook.get('name', '')
+        verify_node_name = hmac_verify_node_name(webhook_name)
+
+        # 既に検証ノードが挿入済みならスキップ（再実行時の二重挿入防止）
+        if verify_node_name in names:
+            continue
+
+        # 元の接続先を取得
+        original_targets = connections.get(webhook_name, {}).get('main', [[]])[0]
+
+        if not original_targets:
+            continue
+
+        # HMAC検証ノードを作成
+        verify_node = copy.deepcopy(HMAC_VERIFY_NODE_TEMPLATE)
+        verify_node['id'] = generate_node_id('hmac_verify')
+        verify_node['name'] = verify_node_name
+
+        # Webhookのposition情報があれば、右隣に仮配置（最終位置は下でまとめて決定）
+        if 'position' in webhook:
+            pos = webhook['position']
+            verify_node['position'] = [pos[0] + 200, pos[1]]
+
+        nodes.append(verify_node)
+        names.add(verify_node_name)
+        inserted.append(verify_node_name)
+
+        # Webhook → 検証ノード → 元のターゲット
+        connections[webhook_name] = {
+            'main': [[{'node': verify_node_name, 'type': 'main', 'index': 0}]]
+        }
+        connections[verify_node_name] = {
+            'main': [original_targets]
+        }
+
+    # 挿入ノードの位置を決め、重なる下流ノードだけを右へずらす（手動配置は保持）
+    if inserted:
+        relayout_inserted(workflow, inserted)
+
+
+@register_stage('mark_python', SCOPE_NODE, reads={'node.type', 'node.parameters.jsCode', 'node.notes'},
+                writes={'node.notes'}, order=30, option='mark_python')
+def stage_mark_python(node: Dict, ctx: StageContext):
+    """Python移行候補ノードをマーク"""
+    if node.get('type') != 'n8n-nodes-base.code':
+        return
+
+    js_code = node.get('parameters', {}).get('jsCode', '')
+
+    if CALC_MATCHER.search(js_code):
+        notes = node.get('notes', '') or ''
+        if PYTHON_MIGRATION_MARKER not in notes:
+            node['notes'] = f'{notes}\n{PYTHON_MIGRATION_MARKER}'.strip()
+
+
+@register_stage('security', SCOPE_WORKFLOW, reads={'settings'}, writes={'settings'},
+                order=40, option='security')
+def stage_security(workflow: Dict, ctx: StageContext):
+    """セキュリティ設定を適用"""
+    settings = workflow.get('settings', {})
+
+    # 成功時の実行データを保存しない（メモリ節約）
+    settings['saveDataSuccessExecution'] = 'none'
+
+    # エラー時は保存（デバッグ用）
+    settings['saveDataErrorExecution'] = 'all'
+
+    # タイムアウト設定
+    if 'executionTimeout' not in settings:
+        settings['executionTimeout'] = 600
+
+    workflow['settings'] = settings
+
+
+@register_stage('tags', SCOPE_WORKFLOW, reads={'tags'}, writes={'tags'}, order=50, option='tags')
+def stage_tags(workflow: Dict, ctx: StageContext):
+    """要塞化タグを追加"""
+    tags = workflow.get('tags', [])
+    # n8nのタグは {name, ...} 形式だが、文字列のみの旧形式も許容する
+    tag_names = [t.get('name', '') if isinstance(t, dict) else t for t in tags]
+
+    if 'FORTRESS' not in tag_names:
+        tags.append({'name': 'FORTRESS', 'color': '#dc143c'})
+
+    if 'V6-ENHANCED' not in tag_names:
+        tags.append({'name': 'V6-ENHANCED', 'color': '#00bfff'})
+
+    workflow['tags'] = tags
+
+
+# ======================
+# スケジューラー
+# ======================
+
+def _normalize_field(name: str) -> str:
+    # nodeステージの 'node.x' は workflow の 'nodes' 配下
+    return 'nodes' + name[4:] if name == 'node' or name.startswith('node.') else name
+
+
+def _fields_overlap(a: FrozenSet[str], b: FrozenSet[str]) -> bool:
+    """フィールド集合が重なるか（'*' は全体、'a' は 'a.b' を含む）"""
+    if '*' in a or '*' in b:
+        return bool(a and b)
+    for x in map(_normalize_field, a):
+        for y in map(_normalize_field, b):
+            if x == y or x.startswith(y + '.') or y.startswith(x + '.'):
+                return True
+    return False
+
+
+def stages_conflict(first: Stage, second: Stage) -> bool:
+    """first → second の順序を入れ替えると結果が変わり得るか"""
+    return (_fields_overlap(first.writes, second.reads | second.writes)
+            or _fields_overlap(first.reads, second.writes))
+
+
+def is_node_local(stage: Stage) -> bool:
+    """読み書きが処理中のノード内で閉じているか"""
+    return all(f.startswith('node.') for f in stage.reads | stage.writes)
+
+
+@dataclass
+class Pass:
+    """1回の走査で実行されるステージ群"""
+    scope: str
+    stages: List[Stage]
+
+
+def build_plan(options: Optional[Dict] = None) -> List[Pass]:
+    """有効なステージをorder順に並べ、reads / writes が許す範囲でパスにまとめる
+
+    - documentステージは先頭の1パスにまとめる（コピー作成を兼ねる）。
+      order が前のステージと読み書きが重なる場合は前倒しできないため ValueError
+    - 連続するnodeステージは、いずれも読み書きがノード内で閉じていれば1パスに融合する
+      （ノードごとに順次適用しても、ステージごとに全ノードを走査した結果と同じになる）
+    """
+    options = options or {}
+    stages = sorted(
+        (s for s in STAGE_REGISTRY.values() if options.get(s.option or s.name, True)),
+        key=lambda s: s.order,
+    )
+
+    documents = [s for s in stages if s.scope == SCOPE_DOCUMENT]
+    for doc in documents:
+        for earlier in stages:
+            if earlier.order >= doc.order:
+                break
+            if earlier.scope != SCOPE_DOCUMENT and stages_conflict(earlier, doc):
+                raise ValueError(
+                    f'documentステージ {doc.name} は {earlier.name} と読み書きが重なるため先頭で実行できません'
+                )
+
+    plan: List[Pass] = [Pass(scope=SCOPE_DOCUMENT, stages=documents)] if documents else []
+    for stage in stages:
+        if stage.scope == SCOPE_DOCUMENT:
+            continue
+        if (plan and plan[-1].scope == SCOPE_NODE and stage.scope == SCOPE_NODE
+                and is_node_local(stage) and all(is_node_local(s) for s in plan[-1].stages)):
+            plan[-1].stages.append(stage)
+        else:
+            plan.append(Pass(scope=stage.scope, stages=[stage]))
+
+    return plan
+
+
+def run_plan(workflow: Dict, plan: List[Pass], ctx: StageContext) -> Dict:
+    """実行計画に沿ってワークフローを変換（コピーは1回のみ）"""
+    if plan and plan[0].scope == SCOPE_DOCUMENT:
+        text = json.dumps(workflow, ensure_ascii=False)
+        for stage in plan[0].stages:
+            text = stage.func(text, ctx)
+        workflow = json.loads(text)
+        passes = plan[1:]
+    else:
+        workflow = copy.deepcopy(workflow)
+        passes = plan
+
+    for p in passes:
+        if p.scope == SCOPE_WORKFLOW:
+            p.stages[0].func(workflow, ctx)
+        else:
+            funcs = [s.func for s in p.stages]
+            for node in workflow.get('nodes', []):
+                for func in funcs:
+                    func(node, ctx)
+
+    return workflow
+
+
+def run_stages(workflow: Dict, names: List[str], profile: str = 'converter') -> Dict:
+    """指定ステージのみを実行（単体呼び出し用）"""
+    options = {s.option or s.name: s.name in names for s in STAGE_REGISTRY.values()}
+    ctx = StageContext(profile=PROFILES[profile], options=options)
+    return run_plan(workflow, build_plan(options), ctx)
+
+
+def convert_workflow(workflow: Dict, options: Dict = None, profile: str = 'converter') -> Dict:
+    """ワークフローを要塞化変換"""
+    options = options or {}
+    ctx = StageContext(profile=PROFILES[profile], options=options)
+
+    workflow = run_plan(workflow, build_plan(options), ctx)
+
+    # メタデータ更新
+    workflow['_fortress_converted'] = True
+    workflow['_fortress_version'] = FORTRESS_VERSION
+    workflow['_fortress_timestamp'] = ctx.profile.timestamp()
+
+    return workflow
+
+
+# ======================
+# 単体ステージ（後方互換API）
+# ======================
+
+def insert_hmac_verify_node(workflow: Dict) -> Dict:
+    """Webhook直後にHMAC検証ノードを挿入"""
+    return run_stages(workflow, ['insert_hmac'])
+
+
+def apply_env_vars(workflow: Dict, profile: str = 'converter') -> Dict:
+    """ハードコード値を環境変数に置換"""
+    return run_stages(workflow, ['env_vars'], profile)
+
+
+def mark_python_migration_nodes(workflow: Dict) -> Dict:
+    """Python移行候補ノードをマーク"""
+    return run_stages(workflow, ['mark_python'])
+
+
+def apply_security_settings(workflow: Dict) -> Dict:
+    """セキュリティ設定を適用"""
+    return run_stages(workflow, ['security'])
+
+
+def add_fortress_tags(workflow: Dict) -> Dict:
+    """要塞化タグを追加"""
+    return run_stages(workflow, ['tags'])
+
+
+# ======================
+# パリティ確認
+# ======================
+
+_GENERATED_ID_RE = re.compile(r'^hmac_verify_[0-9a-f]{8}$')
+
+
+def _strip_js_comment_lines(code: str) -> str:
+    """行コメントのみの行を除き、行末の空白を落とす"""
+    return '\n'.join(line.rstrip() for line in code.splitlines() if not line.lstrip().startswith('//'))
+
+
+def normalize_for_parity(workflow: Dict, ignore_positions: bool = False) -> Dict:
+    """生成IDとタイムスタンプ（ignore_positions=True なら座標も）を除去して比較可能にする"""
+    workflow = copy.deepcopy(workflow)
+    workflow.pop('_fortress_timestamp', None)
+    for node in workflow.get('nodes', []):
+        if ignore_positions:
+            node.pop('position', None)
+        if _GENERATED_ID_RE.match(str(node.get('id', ''))):
+            node['id'] = 'hmac_verify_<generated>'
+        # HMACテンプレートは単一化の際にコメント行だけが揃えられたため、コードは比較対象に残す
+        parameters = node.get('parameters', {})
+        if (node.get('notes') or '').startswith('[FORTRESS_AUTO_INSERTED]') and 'jsCode' in parameters:
+            parameters['jsCode'] = _strip_js_comment_lines(parameters['jsCode'])
+    return workflow
+
+
+def check_parity(input_dir: str, golden_dir: str, profile: str = 'converter',
+                 ignore_positions: bool = False) -> Dict:
+    """既存出力とエンジン出力を比較し、処理時間を計測"""
+    input_path = Path(input_dir)
+    golden_path = Path(golden_dir)
+
+    results = {'compared': 0, 'identical': 0, 'different': [], 'missing': 0, 'elapsed_ms': 0.0}
+    elapsed = 0.0
+
+    for golden_file in sorted(golden_path.rglob('*.json')):
+        relative_path = golden_file.relative_to(golden_path)
+        source_file = input_path / relative_path
+        if not source_file.exists():
+            results['missing'] += 1
+            continue
+
+        with open(source_file, 'r', encoding='utf-8') as f:
+            workflow = json.load(f)
+        with open(golden_file, 'r', encoding='utf-8') as f:
+            golden = json.load(f)
+
+        started = time.perf_counter()
+        converted = convert_workflow(workflow, profile=profile)
+        elapsed += time.perf_counter() - started
+
+        results['compared'] += 1
+        if normalize_for_parity(converted, ignore_positions) == normalize_for_parity(golden, ignore_positions):
+            results['identical'] += 1
+        else:
+            results['different'].append(str(relative_path))
+
+    results['elapsed_ms'] = round(elapsed * 1000, 1)
+    return results
+
+
+# ======================
+# CLI
+# ======================
+
+def main():
+    parser = argparse.ArgumentParser(description='N3 要塞化変換エンジン')
+    subparsers = parser.add_subparsers(dest='command', help='コマンド')
+
+    subparsers.add_parser('plan', help='実行計画を表示')
+
+    parity_parser = subparsers.add_parser('parity', help='既存出力とのパリティ確認')
+    parity_parser.add_argument('input_dir', help='入力ディレクトリ')
+    parity_parser.add_argument('golden_dir', help='比較対象の既存出力ディレクトリ')
+    parity_parser.add_argument('--profile', choices=sorted(PROFILES), default='converter')
+    parity_parser.add_argument('--ignore-positions', action='store_true', help='ノード座標を比較しない')
+
+    args = parser.parse_args()
+
+    if args.command == 'plan':
+        for i, p in enumerate(build_plan(), 1):
+            print(f'パス{i} [{p.scope}]')
+            for s in p.stages:
+                print(f'  - {s.name}: reads={sorted(s.reads)} writes={sorted(s.writes)}')
+
+    elif args.command == 'parity':
+        results = check_parity(args.input_dir, args.golden_dir, args.profile, args.ignore_positions)
+        print(f'比較: {results["compared"]} ファイル')
+        print(f'一致: {results["identical"]} ファイル')
+        print(f'不一致: {len(results["different"])} ファイル')
+        print(f'処理時間: {results["elapsed_ms"]} ms')
+        for rel in results['different']:
+            print(f'  - {rel}')
+        sys.exit(0 if not results['different'] else 1)
+
+    else:
+        parser.print_help()
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -18,94 +18,49 @@ Purpose: n8nワークフローJSONを一括要塞化
   
   # ディレクトリ一括変換
   python json_fortress_converter.py --batch /path/to/PRODUCTION /path/to/ENHANCED
+  
+  # ドライラン（出力せずRFC 6902 JSON Patchレポートのみ生成）
+  python json_fortress_converter.py batch /path/to/PRODUCTION /path/to/ENHANCED --dry-run --patch-report patches.json
+  
+  # JSON構文・n8n構造検証（機械可読レポート出力）
+  python json_fortress_converter.py validate /path/to/n8n-workflows --report report.json
 """
 
 import os
 import sys
 import json
-import re
 import argparse
-import hashlib
 from pathlib import Path
-from typing import Dict, Any, List, Optional
-from datetime import datetime
-import copy
+from typing import Dict
+
+import fortress_engine
+from atomic_writer import AtomicJsonWriter, write_json_atomic
+from workflow_patch import PatchReport
+from fortress_engine import (
+    ENV_VAR_PATTERNS,
+    PYTHON_MIGRATION_MARKER,
+    HMAC_VERIFY_NODE_TEMPLATE,
+    generate_node_id,
+    find_webhook_nodes,
+    insert_hmac_verify_node,
+    apply_env_vars,
+    mark_python_migration_nodes,
+    apply_security_settings,
+    add_fortress_tags,
+)
+from workflow_validator import (
+    DEFAULT_WORKERS,
+    validate_tree,
+    write_report,
+    print_summary,
+    exit_code,
+)
 
 
 # ======================
 # 変換設定
 # ======================
 
-# 環境変数化対象のパターン
-ENV_VAR_PATTERNS = [
-    # URLパターン
-    (r'http://160\.16\.120\.186:(\d+)', r'{{ $env.VPS_URL }}:\1'),
-    (r'https://zdzfpucdyxdlavkgrvil\.supabase\.co', r'{{ $env.SUPABASE_URL }}'),
-    (r'https://api\.chatwork\.com', r'{{ $env.CHATWORK_API_URL }}'),
-    
-    # ハードコードされた認証情報（パターンマッチ）
-    (r'"X-ChatWorkToken"[:\s]*"[^"]+"', '"X-ChatWorkToken": "{{ $env.CHATWORK_API_KEY }}"'),
-    (r'"apikey"[:\s]*"eyJ[^"]+"', '"apikey": "{{ $env.SUPABASE_ANON_KEY }}"'),
-    
-    # n8n内部参照
-    (r'\{\{.*?\$env\.N3_API_URL.*?\}\}', '{{ $env.N3_API_URL }}'),
-    (r'\{\{.*?\$env\.GATEWAY_URL.*?\}\}', '{{ $env.N3_API_URL }}'),
-]
-
-# Python API置換対象のノート
-PYTHON_MIGRATION_MARKER = '[PYTHON_MIGRATION_CANDIDATE]'
-
-# HMAC検証ノードのテンプレート
-HMAC_VERIFY_NODE_TEMPLATE = {
-    "parameters": {
-        "jsCode": """// N3 HMAC署名検証（要塞化自動挿入）
-const headers = $input.first().json.headers || {};
-const body = $input.first().json.body || $input.first().json;
-
-const signature = headers['x-n3-signature'] || headers['X-N3-Signature'] || '';
-const timestamp = headers['x-n3-timestamp'] || headers['X-N3-Timestamp'] || '';
-
-// 署名が存在する場合は検証
-if (signature && timestamp) {
-  const secret = $env.N3_HMAC_SECRET;
-  if (!secret) {
-    return [{ json: { error: true, message: 'N3_HMAC_SECRET 環境変数が未設定', code: 'CONFIG_ERROR' } }];
-  }
-  
-  // タイムスタンプ検証（5分以内）
-  const ts = parseInt(timestamp, 10);
-  const now = Math.floor(Date.now() / 1000);
-  if (Math.abs(now - ts) > 300) {
-    return [{ json: { error: true, message: 'タイムスタンプ期限切れ', code: 'TIMESTAMP_EXPIRED' } }];
-  }
-  
-  // 署名検証（外部APIへ委譲）
-  try {
-    const verifyUrl = $env.PRICING_ENGINE_URL || 'http://localhost:8000';
-    const payload = JSON.stringify(body);
-    const response = await fetch(`${verifyUrl}/verify-signature`, {
-      method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
-      body: JSON.stringify({ payload, signature, timestamp })
-    });
-    const result = await response.json();
-    if (!result.valid) {
-      return [{ json: { error: true, message: '署名検証失敗: ' + (result.error || ''), code: 'INVALID_SIGNATURE' } }];
-    }
-  } catch (e) {
-    // 署名検証APIが利用不可の場合はスキップ（開発環境）
-    console.log('署名検証スキップ: ' + e.message);
-  }
-}
-
-// パススルー
-return $input.all();"""
-    },
-    "type": "n8n-nodes-base.code",
-    "typeVersion": 2,
-    "notes": "[FORTRESS_AUTO_INSERTED] HMAC署名検証"
-}
-
 # 計算ロジック置換テンプレート
 PYTHON_API_CALL_TEMPLATE = {
     "parameters": {
@@ -135,194 +90,14 @@ PYTHON_API_CALL_TEMPLATE = {
 # 変換関数
 # ======================
 
-def generate_node_id(prefix: str = 'fortress') -> str:
-    """ユニークなノードIDを生成"""
-    import uuid
-    return f'{prefix}_{uuid.uuid4().hex[:8]}'
-
-
-def find_webhook_nodes(workflow: Dict) -> List[Dict]:
-    """Webhookノードを検索"""
-    nodes = workflow.get('nodes', [])
-    return [n for n in nodes if n.get('type', '').endswith('.webhook')]
-
-
-def find_connections_from_node(workflow: Dict, node_name: str) -> List[Dict]:
-    """指定ノードからの接続を検索"""
-    connections = workflow.get('connections', {})
-    return connections.get(node_name, {}).get('main', [[]])[0]
-
-
-def insert_hmac_verify_node(workflow: Dict) -> Dict:
-    """Webhook直後にHMAC検証ノードを挿入"""
-    workflow = copy.deepcopy(workflow)
-    nodes = workflow.get('nodes', [])
-    connections = workflow.get('connections', {})
-    
-    webhook_nodes = find_webhook_nodes(workflow)
-    
-    for webhook in webhook_nodes:
-        webhook_name = webhook.get('name', '')
-        
-        # 既に検証ノードが挿入済みかチェック
-        existing = [n for n in nodes if '[FORTRESS_AUTO_INSERTED]' in (n.get('notes', '') or '')]
-        if any(webhook_name in str(c) for c in connections.get(n.get('name', ''), {}) for n in existing):
-            continue
-        
-        # 元の接続先を取得
-        original_targets = connections.get(webhook_name, {}).get('main', [[]])[0]
-        
-        if not original_targets:
-            continue
-        
-        # HMAC検証ノードを作成
-        verify_node = copy.deepcopy(HMAC_VERIFY_NODE_TEMPLATE)
-        verify_node_id = generate_node_id('hmac_verify')
-        verify_node_name = f'🔐 署名検証 ({webhook_name})'
-        verify_node['id'] = verify_node_id
-        verify_node['name'] = verify_node_name
-        
-        # Webhookのposition情報があれば、少し下に配置
-        if 'position' in webhook:
-            pos = webhook['position']
-            verify_node['position'] = [pos[0] + 200, pos[1]]
-        
-        nodes.append(verify_node)
-        
-        # 接続を更新
-        # Webhook → 検証ノード → 元のターゲット
-        connections[webhook_name] = {
-            'main': [[{'node': verify_node_name, 'type': 'main', 'index': 0}]]
-        }
-        connections[verify_node_name] = {
-            'main': [original_targets]
-        }
-    
-    workflow['nodes'] = nodes
-    workflow['connections'] = connections
-    
-    return workflow
-
-
-def apply_env_vars(workflow: Dict) -> Dict:
-    """ハードコード値を環境変数に置換"""
-    workflow_str = json.dumps(workflow, ensure_ascii=False)
-    
-    for pattern, replacement in ENV_VAR_PATTERNS:
-        workflow_str = re.sub(pattern, replacement, workflow_str)
-    
-    return json.loads(workflow_str)
-
-
-def mark_python_migration_nodes(workflow: Dict) -> Dict:
-    """Python移行候補ノードをマーク"""
-    workflow = copy.deepcopy(workflow)
-    nodes = workflow.get('nodes', [])
-    
-    for node in nodes:
-        # Codeノードの内容をチェック
-        if node.get('type') == 'n8n-nodes-base.code':
-            js_code = node.get('parameters', {}).get('jsCode', '')
-            
-            # 計算ロジックを含むか判定
-            calc_indicators = [
-                'profit',
-                'margin',
-                'tariff',
-                'shipping',
-                'ddp',
-                'DDP',
-                'exchangeRate',
-                'exchange_rate',
-            ]
-            
-            if any(ind in js_code for ind in calc_indicators):
-                notes = node.get('notes', '') or ''
-                if PYTHON_MIGRATION_MARKER not in notes:
-                    node['notes'] = f'{notes}\n{PYTHON_MIGRATION_MARKER}'.strip()
-    
-    workflow['nodes'] = nodes
-    return workflow
-
-
-def apply_security_settings(workflow: Dict) -> Dict:
-    """セキュリティ設定を適用"""
-    workflow = copy.deepcopy(workflow)
-    
-    settings = workflow.get('settings', {})
-    
-    # 成功時の実行データを保存しない（メモリ節約）
-    settings['saveDataSuccessExecution'] = 'none'
-    
-    # エラー時は保存（デバッグ用）
-    settings['saveDataErrorExecution'] = 'all'
-    
-    # タイムアウト設定
-    if 'executionTimeout' not in settings:
-        settings['executionTimeout'] = 600
-    
-    workflow['settings'] = settings
-    
-    return workflow
-
-
-def add_fortress_tags(workflow: Dict) -> Dict:
-    """要塞化タグを追加"""
-    workflow = copy.deepcopy(workflow)
-    
-    tags = workflow.get('tags', [])
-    tag_names = [t.get('name', '') for t in tags]
-    
-    if 'FORTRESS' not in tag_names:
-        tags.append({
-            'name': 'FORTRESS',
-            'color': '#dc143c'
-        })
-    
-    if 'V6-ENHANCED' not in tag_names:
-        tags.append({
-            'name': 'V6-ENHANCED',
-            'color': '#00bfff'
-        })
-    
-    workflow['tags'] = tags
-    
-    return workflow
-
-
 def convert_workflow(workflow: Dict, options: Dict = None) -> Dict:
     """ワークフローを要塞化変換"""
-    options = options or {}
-    
-    # 1. HMAC検証ノード挿入
-    if options.get('insert_hmac', True):
-        workflow = insert_hmac_verify_node(workflow)
-    
-    # 2. 環境変数化
-    if options.get('env_vars', True):
-        workflow = apply_env_vars(workflow)
-    
-    # 3. Python移行候補マーク
-    if options.get('mark_python', True):
-        workflow = mark_python_migration_nodes(workflow)
-    
-    # 4. セキュリティ設定
-    if options.get('security', True):
-        workflow = apply_security_settings(workflow)
-    
-    # 5. タグ追加
-    if options.get('tags', True):
-        workflow = add_fortress_tags(workflow)
-    
-    # メタデータ更新
-    workflow['_fortress_converted'] = True
-    workflow['_fortress_version'] = '1.0.0'
-    workflow['_fortress_timestamp'] = datetime.utcnow().isoformat()
-    
-    return workflow
+    return fortress_engine.convert_workflow(workflow, options, profile='converter')
 
 
-def convert_file(input_path: str, output_path: str, options: Dict = None) -> bool:
+def convert_file(input_path: str, output_path: str, options: Dict = None,
+                 writer: AtomicJsonWriter = None, patch_report: PatchReport = None,
+                 dry_run: bool = False) -> bool:
     """ファイル単位の変換"""
     try:
         with open(input_path, 'r', encoding='utf-8') as f:
@@ -330,11 +105,13 @@ def convert_file(input_path: str, output_path: str, options: Dict = None) -> boo
         
         converted = convert_workflow(workflow, options)
         
-        # 出力ディレクトリ作成
-        os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+        # 差分をJSON Patchとして記録
+        if patch_report is not None:
+            patch_report.add(input_path, workflow, converted, output_path)
         
-        with open(output_path, 'w', encoding='utf-8') as f:
-            json.dump(converted, f, ensure_ascii=False, indent=2)
+        # 一時ファイル経由でアトミックに書き込み（出力ディレクトリも作成）
+        if not dry_run:
+            write_json_atomic(output_path, converted, writer)
         
         return True
     except Exception as e:
@@ -342,8 +119,9 @@ def convert_file(input_path: str, output_path: str, options: Dict = None) -> boo
         return False
 
 
-def convert_directory(input_dir: str, output_dir: str, options: Dict = None) -> Dict:
-    """ディレクトリ一括変換"""
+def convert_directory(input_dir: str, output_dir: str, options: Dict = None,
+                      dry_run: bool = False, patch_report_path: str = None) -> Dict:
+    """ディレクトリ一括変換（dry_run時は出力せず、patch_report_pathにパッチを集約）"""
     input_path = Path(input_dir)
     output_path = Path(output_dir)
     
@@ -361,59 +139,49 @@ def convert_directory(input_dir: str, output_dir: str, options: Dict = None) ->
     
     print(f'\n📂 変換対象: {results["total"]} ファイル')
     print(f'入力: {input_dir}')
-    print(f'出力: {output_dir}')
+    print(f'出力: {output_dir}' + ('（ドライラン）' if dry_run else ''))
     print('=' * 50)
     
-    for json_file in json_files:
-        relative_path = json_file.relative_to(input_path)
-        output_file = output_path / relative_path
-        
-        # マスターファイルやembedded_logicはスキップ
-        if json_file.name in ['UI_CONFIG_MASTER.json', 'embedded_logic.json']:
-            results['skipped'] += 1
-            print(f'⏭️  スキップ: {relative_path}')
-            continue
-        
-        print(f'🔄 変換中: {relative_path}', end='... ')
-        
-        if convert_file(str(json_file), str(output_file), options):
-            results['success'] += 1
-            print('✅')
-        else:
-            results['failed'] += 1
-            results['errors'].append(str(relative_path))
-            print('❌')
+    patch_report = (
+        PatchReport(patch_report_path, 'json_fortress_converter', root=input_dir)
+        if patch_report_path else None
+    )
     
-    return results
-
-
-def validate_json_files(directory: str) -> Dict:
-    """JSONファイルの構文検証"""
-    path = Path(directory)
-    json_files = list(path.rglob('*.json'))
+    with AtomicJsonWriter() as writer:
+        for json_file in json_files:
+            relative_path = json_file.relative_to(input_path)
+            output_file = output_path / relative_path
+            
+            # マスターファイルやembedded_logicはスキップ
+            if json_file.name in ['UI_CONFIG_MASTER.json', 'embedded_logic.json']:
+                results['skipped'] += 1
+                print(f'⏭️  スキップ: {relative_path}')
+                continue
+            
+            print(f'🔄 変換中: {relative_path}', end='... ')
+            
+            if convert_file(str(json_file), str(output_file), options, writer, patch_report, dry_run):
+                results['success'] += 1
+                print('✅')
+            else:
+                results['failed'] += 1
+                results['errors'].append(str(relative_path))
+                print('❌')
     
-    results = {
-        'total': len(json_files),
-        'valid': 0,
-        'invalid': 0,
-        'errors': [],
-    }
+    results['unchanged'] = writer.stats['unchanged']
     
-    for json_file in json_files:
-        try:
-            with open(json_file, 'r', encoding='utf-8') as f:
-                json.load(f)
-            results['valid'] += 1
-        except json.JSONDecodeError as e:
-            results['invalid'] += 1
-            results['errors'].append({
-                'file': str(json_file),
-                'error': str(e),
-            })
+    if patch_report is not None:
+        patch_report.close()
+        results['patch_summary'] = patch_report.summary
     
     return results
 
 
+def validate_json_files(directory: str, workers: int = DEFAULT_WORKERS) -> Dict:
+    """JSONファイルの構文・n8n構造検証（workflow_validatorへ委譲）"""
+    return validate_tree(directory, workers=workers)
+
+
 # ======================
 # CLI
 # ======================
@@ -434,10 +202,15 @@ def main():
     batch_parser = subparsers.add_parser('batch', help='ディレクトリ一括変換')
     batch_parser.add_argument('input_dir', help='入力ディレクトリ')
     batch_parser.add_argument('output_dir', help='出力ディレクトリ')
+    batch_parser.add_argument('--dry-run', action='store_true', help='出力せずに差分のみ確認')
+    batch_parser.add_argument('--patch-report', help='JSON Patchレポート出力先（RFC 6902）')
     
     # 検証
-    validate_parser = subparsers.add_parser('validate', help='JSON構文検証')
+    validate_parser = subparsers.add_parser('validate', help='JSON構文・構造検証')
     validate_parser.add_argument('directory', help='検証対象ディレクトリ')
+    validate_parser.add_argument('--report', help='JSONレポート出力先')
+    validate_parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='並列スレッド数')
+    validate_parser.add_argument('--strict', action='store_true', help='警告も失敗扱いにする')
     
     args = parser.parse_args()
     
@@ -446,7 +219,10 @@ def main():
         sys.exit(0 if success else 1)
     
     elif args.command == 'batch':
-        results = convert_directory(args.input_dir, args.output_dir)
+        results = convert_directory(
+            args.input_dir, args.output_dir,
+            dry_run=args.dry_run, patch_report_path=args.patch_report,
+        )
         
         print('\n' + '=' * 50)
         print('📊 変換結果サマリー')
@@ -455,6 +231,11 @@ def main():
         print(f'  成功: {results["success"]} ファイル')
         print(f'  失敗: {results["failed"]} ファイル')
         print(f'  スキップ: {results["skipped"]} ファイル')
+        print(f'  内容同一（書き込み省略）: {results["unchanged"]} ファイル')
+        
+        if args.patch_report:
+            summary = results['patch_summary']
+            print(f'\n📝 パッチレポート: {args.patch_report}（変更 {summary["changed"]} ファイル / {summary["operations"]} 操作）')
         
         if results['errors']:
             print('\n❌ 失敗ファイル:')
@@ -464,22 +245,17 @@ def main():
         sys.exit(0 if results['failed'] == 0 else 1)
     
     elif args.command == 'validate':
-        results = validate_json_files(args.directory)
+        results = validate_json_files(args.directory, workers=args.workers)
         
-        print('\n' + '=' * 50)
-        print('📊 検証結果')
-        print('=' * 50)
-        print(f'  合計: {results["total"]} ファイル')
-        print(f'  有効: {results["valid"]} ファイル')
-        print(f'  無効: {results["invalid"]} ファイル')
+        if args.report:
+            write_report(results, args.report)
         
-        if results['errors']:
-            print('\n❌ 無効なファイル:')
-            for err in results['errors']:
-                print(f'  - {err["file"]}')
-                print(f'    エラー: {err["error"]}')
+        print_summary(results)
+        
+        if args.report:
+            print(f'\n📝 レポート: {args.report}')
         
-        sys.exit(0 if results['invalid'] == 0 else 1)
+        sys.exit(exit_code(results, args.strict))
     
     else:
         # 引数なしで呼び出された場合
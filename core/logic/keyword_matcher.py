@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+N3 Empire OS - 複数キーワード一括マッチャー
+=========================================
+Version: 1.0.0
+Purpose: 移行候補判定・AIプロバイダー検出などのキーワード検出を共通化
+
+仕組み:
+- 全キーワードからトライ木を構築し、1本の正規表現にコンパイル（構築は1回のみ）
+- 一致位置の次の文字から再検索し、重なり合う一致も含めて検出
+  （Aho–Corasickと同じ結果を、一致候補のスキップはreのC実装で行う）
+- 一致した位置の最長キーワードから、その接頭辞となるキーワードも一致として補完
+- 走査コストはテキスト長×キーワード最大長に比例し、キーワード数には依存しない
+
+使用例:
+  matcher = KeywordMatcher({'openai': ['openai', 'gpt'], 'claude': ['claude']}, ignore_case=True)
+  matcher.find_all('Call GPT then Claude')
+  # → [KeywordMatch('openai', 'gpt', 5, 8), KeywordMatch('claude', 'claude', 14, 20)]
+"""
+
+import re
+from dataclasses import dataclass
+from typing import Dict, Iterable, Iterator, List, Optional, Set
+
+
+@dataclass(frozen=True)
+class KeywordMatch:
+    """キーワード一致結果"""
+    category: str
+    keyword: str
+    start: int
+    end: int
+
+
+_END = ''  # トライ木の終端マーカー
+
+
+def _build_trie(keywords: Iterable[str]) -> Dict:
+    trie: Dict = {}
+    for keyword in keywords:
+        node = trie
+        for ch in keyword:
+            node = node.setdefault(ch, {})
+        node[_END] = True
+    return trie
+
+
+def _trie_to_regex(node: Dict) -> str:
+    """トライ木を正規表現に変換（共通接頭辞を括り出して分岐を文字単位にする）"""
+    branches = [
+        re.escape(ch) + _trie_to_regex(child)
+        for ch, child in sorted((k, v) for k, v in node.items() if k != _END)
+    ]
+    if not branches:
+        return ''
+
+    body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+    if _END in node:
+        # ここで終わるキーワードもある → 続きは省略可能（貪欲に最長一致）
+        if len(branches) == 1 and len(body) > 1:
+            body = '(?:' + body + ')'
+        body += '?'
+    return body
+
+
+class KeywordMatcher:
+    """カテゴリ別キーワードを1回の走査で検出するマッチャー"""
+
+    def __init__(self, categories: Dict[str, Iterable[str]], ignore_case: bool = False):
+        self.ignore_case = ignore_case
+        # 登録順をカテゴリの優先順位とする
+        self._ordered_categories = list(categories)
+        self.priority = {category: i for i, category in enumerate(self._ordered_categories)}
+
+        self._keyword_categories: Dict[str, List[str]] = {}
+        for category, keywords in categories.items():
+            for keyword in keywords:
+                if not keyword:
+                    continue
+                key = keyword.lower() if ignore_case else keyword
+                cats = self._keyword_categories.setdefault(key, [])
+                if category not in cats:
+                    cats.append(category)
+
+        trie = _build_trie(self._keyword_categories)
+        self._prefixes = {k: self._collect_prefixes(trie, k) for k in self._keyword_categories}
+
+        body = _trie_to_regex(trie)
+        self._any_re = re.compile(body) if body else None
+        # 大文字小文字無視は、基本的に小文字化したテキストを大文字小文字区別で走査する
+        # （re.IGNORECASEは先頭文字によるスキップ最適化が効かず数倍遅い）
+        self._any_re_ci = re.compile(body, re.IGNORECASE) if body and ignore_case else None
+
+    def _prepare(self, text: str):
+        """走査対象テキストと正規表現を選択"""
+        if not self.ignore_case:
+            return text, self._any_re
+        lowered = text.lower()
+        # 小文字化で文字数が変わる場合（'İ'等）はオフセットがずれるためIGNORECASEで走査
+        if len(lowered) != len(text):
+            return text, self._any_re_ci
+        return lowered, self._any_re
+
+    @staticmethod
+    def _collect_prefixes(trie: Dict, keyword: str) -> List[str]:
+        """keyword自身と、その接頭辞になっている登録キーワードを短い順に返す"""
+        prefixes = []
+        node = trie
+        for i, ch in enumerate(keyword):
+            node = node[ch]
+            if _END in node:
+                prefixes.append(keyword[:i + 1])
+        return prefixes
+
+    def finditer(self, text: str) -> Iterator[KeywordMatch]:
+        """全一致（重なりを含む）を出現位置順に返す"""
+        if not text or self._any_re is None:
+            return
+        scanned, pattern = self._prepare(text)
+        search = pattern.search
+        m = search(scanned)
+        while m:
+            start = m.start()
+            longest = m.group()
+            key = longest.lower() if self.ignore_case else longest
+            for keyword in self._prefixes[key]:
+                for category in self._keyword_categories[keyword]:
+                    yield KeywordMatch(category, keyword, start, start + len(keyword))
+            # 一致の途中から始まる別キーワードも拾うため、1文字だけ進めて再検索
+            m = search(scanned, start + 1)
+
+    def find_all(self, text: str) -> List[KeywordMatch]:
+        return list(self.finditer(text))
+
+    def search(self, text: str) -> bool:
+        """いずれかのキーワードを含むか（最初の一致で打ち切り）"""
+        if not text or self._any_re is None:
+            return False
+        scanned, pattern = self._prepare(text)
+        return pattern.search(scanned) is not None
+
+    def categories(self, *texts: str) -> Set[str]:
+        """一致した全カテゴリを返す"""
+        found: Set[str] = set()
+        for text in texts:
+            for match in self.finditer(text):
+                found.add(match.category)
+        return found
+
+    def first_category(self, *texts: str) -> Optional[str]:
+        """一致したカテゴリのうち、登録順で最優先のものを返す"""
+        best = None
+        for text in texts:
+            for match in self.finditer(text):
+                rank = self.priority[match.category]
+                if best is None or rank < best:
+                    best = rank
+                    if rank == 0:
+                        # 最優先カテゴリが見つかった時点で打ち切り
+                        return match.category
+        if best is None:
+            return None
+        return self._ordered_categories[best]
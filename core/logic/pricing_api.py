@@ -7,6 +7,12 @@ Endpoints:
   - POST /calculate - 単一商品価格計算
   - POST /calculate-batch - バッチ価格計算
   - POST /verify-signature - HMAC署名検証
+  - POST /traces - 監査ログ・AIトレースのバッチ書き込み（件数・時間窓でまとめて複数行INSERT）
+  - GET /traces/stats - トレースバッチの統計
+  - POST /burn-limit/check - AI呼び出しのコスト見積もり・予算判定
+  - GET /burn-limit/costs - プロバイダー別コスト表（バージョン付き）
+  - GET /burn-limit/spend - テナント×プロバイダー別の消費集計
+  - POST /burn-limit/reload - コスト表の再読み込み
   - GET /health - ヘルスチェック
 """
 
@@ -29,6 +35,8 @@ from pricing_engine import (
     verify_hmac_signature,
     generate_hmac_signature,
 )
+from trace_batcher import TraceBatcher
+from burn_limit import BurnLimiter, CostTable, DEFAULT_DAILY_BUDGET_USD
 
 
 # ======================
@@ -40,6 +48,21 @@ SUPABASE_SERVICE_KEY = os.getenv('SUPABASE_SERVICE_KEY', '')
 N3_HMAC_SECRET = os.getenv('N3_HMAC_SECRET', 'your-hmac-secret-key-change-this')
 PORT = int(os.getenv('PRICING_ENGINE_PORT', 8000))
 
+# トレースバッチ（件数・時間窓のどちらかに達したらまとめて書き込む）
+TRACE_BATCH_SIZE = int(os.getenv('TRACE_BATCH_SIZE', 200))
+TRACE_BATCH_WINDOW_MS = int(os.getenv('TRACE_BATCH_WINDOW_MS', 1000))
+TRACE_MAX_PENDING = int(os.getenv('TRACE_MAX_PENDING', 10000))
+# 書き込みを許可するテーブル（V8.3変換後のn3_プレフィックス付きも含む）
+TRACE_TABLES = set(os.getenv(
+    'TRACE_TABLES',
+    'audit_logs,ai_decision_traces,n3_audit_logs,n3_ai_decision_traces',
+).split(','))
+
+# 燃焼上限（コスト表JSONのパス、1日あたりの予算、予算の上書き {"tenant:provider": USD, ...}）
+BURN_COST_TABLE = os.getenv('BURN_COST_TABLE', '')
+BURN_DAILY_BUDGET_USD = float(os.getenv('BURN_DAILY_BUDGET_USD', DEFAULT_DAILY_BUDGET_USD))
+BURN_BUDGETS = json.loads(os.getenv('BURN_BUDGETS', '{}'))
+
 # 設定キャッシュ
 _config_cache: Dict[str, PricingConfig] = {}
 _config_cache_ts: Dict[str, float] = {}
@@ -71,6 +94,18 @@ class VerifySignatureRequest(BaseModel):
     timestamp: str
 
 
+class TraceBatchRequest(BaseModel):
+    table: str = Field(..., description='書き込み先テーブル')
+    rows: List[Dict[str, Any]] = Field(..., description='行（列名 → 値）')
+
+
+class BurnLimitCheckRequest(BaseModel):
+    provider: str = Field(..., description='AIプロバイダー')
+    tenant_id: str = Field('default', description='テナントID')
+    units: float = Field(1.0, description='呼び出し単位数（1Kトークン・画像枚数など）')
+    workflow_name: Optional[str] = Field(None, description='呼び出し元ワークフロー')
+
+
 class CalculateResponse(BaseModel):
     success: bool
     data: Optional[Dict[str, Any]] = None
@@ -133,14 +168,67 @@ async def fetch_config_from_db(user_id: str) -> PricingConfig:
     return PricingConfig()
 
 
+def load_cost_table() -> CostTable:
+    """コスト表を読み込み（未指定時は組み込みの既定値）"""
+    if BURN_COST_TABLE:
+        return CostTable.from_file(BURN_COST_TABLE)
+    return CostTable()
+
+
+def initial_cost_table() -> CostTable:
+    """起動時のコスト表（読み込めなければ組み込みの既定値。/burn-limit 以外のエンドポイントを巻き込まない）"""
+    try:
+        return load_cost_table()
+    except (OSError, ValueError, KeyError) as e:
+        print(f'⚠️ コスト表の読み込みに失敗したため既定値を使用: {BURN_COST_TABLE}: {e}')
+        return CostTable()
+
+
+burn_limiter = BurnLimiter(initial_cost_table(), daily_budget_usd=BURN_DAILY_BUDGET_USD, budgets=BURN_BUDGETS)
+
+_trace_client: Optional[httpx.AsyncClient] = None
+_trace_batcher: Optional[TraceBatcher] = None
+
+
+async def insert_rows_to_db(table: str, rows: List[Dict]) -> None:
+    """Supabaseへ複数行を1リクエストでINSERT（PostgRESTの一括挿入）"""
+    if not SUPABASE_SERVICE_KEY:
+        print(f'⚠️ SUPABASE_SERVICE_KEY未設定のためトレースを破棄: {table} {len(rows)}件')
+        return
+    
+    response = await _trace_client.post(
+        f'{SUPABASE_URL}/rest/v1/{table}',
+        json=rows,
+        headers={
+            'apikey': SUPABASE_SERVICE_KEY,
+            'Authorization': f'Bearer {SUPABASE_SERVICE_KEY}',
+            'Prefer': 'return=minimal',
+        },
+        timeout=10.0,
+    )
+    response.raise_for_status()
+
+
 # ======================
 # FastAPIアプリ
 # ======================
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    global _trace_client, _trace_batcher
     print(f'🚀 N3 Pricing Engine 起動中... ポート: {PORT}')
+    _trace_client = httpx.AsyncClient()
+    _trace_batcher = TraceBatcher(
+        insert_rows_to_db,
+        max_batch=TRACE_BATCH_SIZE,
+        window=TRACE_BATCH_WINDOW_MS / 1000,
+        max_pending=TRACE_MAX_PENDING,
+    )
+    await _trace_batcher.start()
     yield
+    # 停止前に未書き込みのトレースを書き切る
+    await _trace_batcher.stop()
+    await _trace_client.aclose()
     print('🛑 N3 Pricing Engine 停止')
 
 
@@ -309,6 +397,60 @@ async def generate_signature_endpoint(
     }
 
 
+@app.post('/traces', status_code=202)
+async def enqueue_traces(req: TraceBatchRequest):
+    """監査ログ・AIトレースをバッファに積む（書き込みは件数・時間窓でまとめて実行）"""
+    if req.table not in TRACE_TABLES:
+        raise HTTPException(status_code=400, detail=f'書き込みが許可されていないテーブル: {req.table}')
+    
+    accepted = _trace_batcher.add(req.table, req.rows)
+    return {
+        'success': accepted == len(req.rows),
+        'accepted': accepted,
+        'pending': _trace_batcher.pending,
+    }
+
+
+@app.get('/traces/stats')
+async def trace_stats():
+    """トレースバッチの統計"""
+    return {
+        **_trace_batcher.stats,
+        'pending': _trace_batcher.pending,
+        'max_batch': _trace_batcher.max_batch,
+        'window_ms': TRACE_BATCH_WINDOW_MS,
+    }
+
+
+@app.post('/burn-limit/check')
+async def burn_limit_check(req: BurnLimitCheckRequest):
+    """見積もりコストを予算から差し引き、許可/拒否を返す（拒否時も200でallowed=false）"""
+    result = burn_limiter.check(req.tenant_id, req.provider, req.units)
+    return {'success': True, **result}
+
+
+@app.get('/burn-limit/costs')
+async def burn_limit_costs():
+    """プロバイダー別コスト表"""
+    return burn_limiter.cost_table.to_dict()
+
+
+@app.get('/burn-limit/spend')
+async def burn_limit_spend():
+    """テナント×プロバイダー別の消費集計"""
+    return burn_limiter.snapshot()
+
+
+@app.post('/burn-limit/reload')
+async def burn_limit_reload():
+    """コスト表を再読み込み（予算・集計は維持）"""
+    try:
+        burn_limiter.set_cost_table(load_cost_table())
+    except (OSError, ValueError, KeyError) as e:
+        raise HTTPException(status_code=400, detail=f'コスト表の読み込みに失敗: {e}')
+    return {'success': True, 'version': burn_limiter.cost_table.version}
+
+
 @app.post('/clear-cache')
 async def clear_cache():
     """設定キャッシュをクリア"""
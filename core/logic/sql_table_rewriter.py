@@ -0,0 +1,435 @@
+#!/usr/bin/env python3
+"""
+N3 Empire OS - SQLテーブル名リライター（1パス字句解析）
+=========================================
+Version: 1.0.0
+Purpose: n8nノード内SQLのテーブル参照を検出し、辞書引きで一括置換
+
+仕組み:
+- SQLを先頭から1回だけ字句解析（テーブル数・キーワード数に依存しない線形時間）
+- 文字列リテラル（'...' / E'...'）、コメント（-- / /* */）、ドル引用（$tag$...$tag$）、
+  n8n式（{{ ... }}）は読み飛ばし、中身は書き換えない
+- FROM / JOIN / INTO / UPDATE / TABLE の直後の識別子をテーブル参照とみなす
+  （FROM a x, b y のカンマ区切りの2つ目以降も。別名は読み飛ばし、次の句・閉じ括弧で終わる）
+  （IF [NOT] EXISTS / ONLY / LATERAL は読み飛ばす、サブクエリ・式は対象外）
+- スキーマ修飾（public.orders）はテーブル部分のみ、引用識別子（"orders"）は引用符を保って置換
+- 非引用識別子は大文字小文字を区別せず照合（PostgreSQLの識別子畳み込みに合わせる）
+- 置換箇所ごとに 元の名前・新しい名前・オフセット・行/列 を返す
+- jsCode・URL等の自由テキストは rewrite_text で文脈判定付きで置換
+  （REST パス / 値全体 / 文字列リテラル / 埋め込みSQL のみ。列名・JS識別子は対象外）
+
+使用例:
+  rewriter = TableRewriter({'orders': 'n3_orders'})
+  sql, rewrites = rewriter.rewrite("SELECT * FROM orders o JOIN order_items i ON ...")
+"""
+
+import re
+import sys
+import json
+import argparse
+from collections import Counter
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+
+# テーブル参照を導くキーワード
+TABLE_KEYWORDS = ('FROM', 'JOIN', 'INTO', 'UPDATE', 'TABLE')
+
+# キーワードとテーブル名の間に現れうる修飾語
+_SKIP_WORDS = frozenset({'IF', 'NOT', 'EXISTS', 'ONLY', 'LATERAL'})
+
+# キーワード直後に来てもテーブル名ではない予約語（ON CONFLICT ... DO UPDATE SET 等）
+_NON_TABLE_WORDS = frozenset({'SET', 'SELECT', 'VALUES', 'DEFAULT', 'WITH', 'WHERE'})
+
+# FROM のカンマ区切りリストを終わらせる句
+_FROM_LIST_END_WORDS = frozenset({
+    'WHERE', 'GROUP', 'HAVING', 'WINDOW', 'ORDER', 'LIMIT', 'OFFSET', 'FETCH', 'FOR',
+    'UNION', 'INTERSECT', 'EXCEPT', 'RETURNING', 'SET', 'VALUES', 'SELECT', 'DO',
+})
+
+
+@dataclass(frozen=True)
+class TableReference:
+    """SQL内のテーブル参照"""
+    keyword: str
+    name: str
+    schema: Optional[str]
+    start: int
+    end: int
+    quoted: bool
+
+
+@dataclass(frozen=True)
+class TableRewrite:
+    """テーブル名の置換箇所"""
+    keyword: str
+    old: str
+    new: str
+    start: int
+    end: int
+    line: int
+    column: int
+
+
+# ======================
+# 字句解析
+# ======================
+
+_TOKEN_RE = re.compile(r"""
+    (?P<ws>\s+)
+  | (?P<estring>[Ee]')
+  | (?P<word>[A-Za-z_][A-Za-z0-9_$]*)
+  | (?P<qident>"(?:[^"]|"")*")
+  | (?P<string>')
+  | (?P<line_comment>--)
+  | (?P<block_comment>/\*)
+  | (?P<dollar>\$(?:[A-Za-z_][A-Za-z0-9_]*)?\$)
+  | (?P<expr>\{\{)
+  | (?P<other>.)
+""", re.VERBOSE | re.DOTALL)
+
+_ESTRING_BODY_RE = re.compile(r"(?:[^'\\]|\\.|'')*'", re.DOTALL)
+_STRING_BODY_RE = re.compile(r"(?:[^']|'')*'")
+_BLOCK_COMMENT_RE = re.compile(r'/\*|\*/')
+
+
+def _skip_block_comment(sql: str, pos: int) -> int:
+    """/* の直後から、入れ子を考慮して対応する */ の直後までを読み飛ばす"""
+    depth = 1
+    while depth:
+        m = _BLOCK_COMMENT_RE.search(sql, pos)
+        if m is None:
+            return len(sql)
+        depth += 1 if m.group() == '/*' else -1
+        pos = m.end()
+    return pos
+
+
+def _tokens(sql: str) -> Iterator[Tuple[str, int, int]]:
+    """(種別, 開始, 終了) を出現順に返す。リテラル・コメント等は1トークンにまとめる"""
+    pos = 0
+    length = len(sql)
+    match = _TOKEN_RE.match
+    while pos < length:
+        m = match(sql, pos)
+        kind = m.lastgroup
+        end = m.end()
+
+        if kind == 'estring':
+            body = _ESTRING_BODY_RE.match(sql, end)
+            end = body.end() if body else length
+            kind = 'string'
+        elif kind == 'string':
+            body = _STRING_BODY_RE.match(sql, end)
+            end = body.end() if body else length
+        elif kind == 'line_comment':
+            newline = sql.find('\n', end)
+            end = length if newline < 0 else newline
+        elif kind == 'block_comment':
+            end = _skip_block_comment(sql, end)
+        elif kind == 'dollar':
+            close = sql.find(m.group(), end)
+            end = length if close < 0 else close + len(m.group())
+        elif kind == 'expr':
+            close = sql.find('}}', end)
+            end = length if close < 0 else close + 2
+
+        yield kind, pos, end
+        pos = end
+
+
+# ======================
+# テーブル参照検出
+# ======================
+
+def iter_table_references(sql: str, keywords: Iterable[str] = TABLE_KEYWORDS) -> Iterator[TableReference]:
+    """SQL内のテーブル参照を出現順に返す"""
+    keywords = frozenset(k.upper() for k in keywords)
+    pending: Optional[str] = None  # 直前のテーブル参照キーワード
+    # 修飾名（schema.table）の組み立て中の状態
+    parts: List[Tuple[str, int, int, bool]] = []
+    expect_dot = False
+    # 括弧の深さと、FROM のカンマ区切りリストが続いている深さ
+    depth = 0
+    from_lists = set()
+
+    def flush():
+        name, start, end, quoted = parts[-1]
+        schema = '.'.join(p[0] for p in parts[:-1]) or None
+        return TableReference(pending, name, schema, start, end, quoted)
+
+    for kind, start, end in _tokens(sql):
+        if parts:
+            if expect_dot and kind == 'other' and sql[start] == '.':
+                expect_dot = False
+                continue
+            if not expect_dot and kind in ('word', 'qident'):
+                parts.append(_identifier(sql, kind, start, end))
+                expect_dot = True
+                continue
+            yield flush()
+            parts = []
+            pending = None
+
+        if kind in ('ws', 'line_comment', 'block_comment'):
+            continue
+
+        if kind == 'word':
+            upper = sql[start:end].upper()
+            if upper in _FROM_LIST_END_WORDS:
+                from_lists.discard(depth)
+            elif upper == 'FROM' and 'FROM' in keywords:
+                from_lists.add(depth)
+            if pending is not None:
+                if upper in _SKIP_WORDS:
+                    continue
+                if upper in _NON_TABLE_WORDS:
+                    pending = upper if upper in keywords else None
+                    continue
+                parts = [_identifier(sql, kind, start, end)]
+                expect_dot = True
+                continue
+            if upper in keywords:
+                pending = upper
+            continue
+
+        if kind == 'qident' and pending is not None:
+            parts = [_identifier(sql, kind, start, end)]
+            expect_dot = True
+            continue
+
+        # 括弧（サブクエリ）・式・リテラル等はテーブル参照ではない
+        pending = None
+        if kind == 'other':
+            char = sql[start]
+            if char == '(':
+                depth += 1
+            elif char == ')':
+                from_lists.discard(depth)
+                depth = max(0, depth - 1)
+            elif char == ',' and depth in from_lists:
+                # FROM a x, b y の次の項目
+                pending = 'FROM'
+            elif char == ';':
+                from_lists.clear()
+                depth = 0
+
+    if parts:
+        yield flush()
+
+
+def _identifier(sql: str, kind: str, start: int, end: int) -> Tuple[str, int, int, bool]:
+    if kind == 'qident':
+        return sql[start + 1:end - 1].replace('""', '"'), start, end, True
+    return sql[start:end], start, end, False
+
+
+# ======================
+# 置換
+# ======================
+
+# 自由テキスト（jsCode・URL等）でのテーブル言及の文脈
+CONTEXT_VALUE = 'VALUE'      # 値全体がテーブル名
+CONTEXT_LITERAL = 'LITERAL'  # 'orders' のような文字列リテラル全体
+CONTEXT_REST = 'REST'        # /rest/v1/[schema.]orders のパスセグメント
+
+_REST_PREFIX = '/rest/v1/'
+_QUOTES = '\'"`'
+_KEYWORD_BEFORE_RE = re.compile(r'([A-Za-z]+)\s+$')
+_FROM_WORD_RE = re.compile(r'\bFROM\b', re.IGNORECASE)
+_FROM_LIST_LOOKBEHIND = 512  # カンマ区切りの FROM リストを遡る最大文字数
+
+
+def _splice(text: str, edits: List[Tuple[str, str, str, int, int, str]]) -> Tuple[str, List[TableRewrite]]:
+    """(文脈, 旧名, 新名, 開始, 終了, 置換文字列) を出現順に適用し、置換箇所を返す"""
+    if not edits:
+        return text, []
+
+    pieces: List[str] = []
+    rewrites: List[TableRewrite] = []
+    last = 0
+    line, line_start, scanned = 1, 0, 0
+
+    for keyword, old, new, start, end, replacement in edits:
+        # 行・列は直前の置換位置から差分だけ数える（全体で線形）
+        newlines = text.count('\n', scanned, start)
+        if newlines:
+            line += newlines
+            line_start = text.rfind('\n', scanned, start) + 1
+        scanned = start
+
+        pieces.append(text[last:start])
+        pieces.append(replacement)
+        last = end
+        rewrites.append(TableRewrite(keyword, old, new, start, end, line, start - line_start + 1))
+
+    pieces.append(text[last:])
+    return ''.join(pieces), rewrites
+
+
+class TableRewriter:
+    """テーブル名マッピングを保持し、SQLを1パスで書き換えるリライター"""
+
+    def __init__(self, table_map: Dict[str, str], keywords: Iterable[str] = TABLE_KEYWORDS):
+        self.table_map = dict(table_map)
+        self.keywords = tuple(k.upper() for k in keywords)
+        # 非引用識別子は小文字に畳み込んで照合
+        self._folded = {old.lower(): new for old, new in self.table_map.items()}
+        # 自由テキスト用: 全テーブル名を1本の正規表現に（JS識別子の一部は除外するため$も境界に含める）
+        # 前方の境界は後読みにすると全位置で評価され遅いため、一致後に1文字だけ確認する
+        names = sorted((old for old, new in self.table_map.items() if old != new), key=len, reverse=True)
+        self._mention_re = (
+            re.compile(r'(?:' + '|'.join(map(re.escape, names)) + r')(?![\w$])')
+            if names else None
+        )
+
+    def lookup(self, ref: TableReference) -> Optional[str]:
+        if ref.quoted:
+            return self.table_map.get(ref.name)
+        return self._folded.get(ref.name.lower())
+
+    def rewrite(self, sql: str) -> Tuple[str, List[TableRewrite]]:
+        """置換後のSQLと置換箇所のリストを返す"""
+        if not isinstance(sql, str) or not sql:
+            return sql, []
+
+        edits = []
+        for ref in iter_table_references(sql, self.keywords):
+            new = self.lookup(ref)
+            if new is None or new == ref.name:
+                continue
+            replacement = '"' + new.replace('"', '""') + '"' if ref.quoted else new
+            edits.append((ref.keyword, ref.name, new, ref.start, ref.end, replacement))
+
+        return _splice(sql, edits)
+
+    def mention_context(self, text: str, start: int, end: int) -> Optional[str]:
+        """テキスト内の一致がテーブル参照である文脈を返す（列名・JS識別子ならNone）"""
+        if start == 0 and end == len(text):
+            return CONTEXT_VALUE
+
+        before = text[start - 1] if start else ''
+        after = text[end] if end < len(text) else ''
+
+        # /rest/v1/orders, /rest/v1/core.orders
+        if before == '/' and text.endswith(_REST_PREFIX, 0, start):
+            return CONTEXT_REST
+        if before == '.':
+            schema_start = start - 1
+            while schema_start > 0 and (text[schema_start - 1].isalnum() or text[schema_start - 1] == '_'):
+                schema_start -= 1
+            if schema_start < start - 1 and text.endswith(_REST_PREFIX, 0, schema_start):
+                return CONTEXT_REST
+            # それ以外の a.orders はプロパティアクセス
+            return None
+
+        # 'orders' / "orders" / `orders`（直後が : ならオブジェクトのキー）
+        if before and before in _QUOTES and after == before:
+            rest = text[end + 1:end + 40].lstrip()
+            if rest.startswith(':'):
+                return None
+            return CONTEXT_LITERAL
+
+        # 埋め込みSQL（テンプレート文字列等）の FROM orders
+        m = _KEYWORD_BEFORE_RE.search(text, max(0, start - 16), start)
+        if m and m.group(1).upper() in self.keywords:
+            return m.group(1).upper()
+
+        # 埋め込みSQLの FROM a x, orders y（直前の FROM からSQL本体と同じ判定をかける）
+        if 'FROM' in self.keywords and text[max(0, start - 16):start].rstrip().endswith(','):
+            return self._from_list_context(text, start, end)
+
+        return None
+
+    def _from_list_context(self, text: str, start: int, end: int) -> Optional[str]:
+        window_start = max(0, start - _FROM_LIST_LOOKBEHIND)
+        last = None
+        for last in _FROM_WORD_RE.finditer(text, window_start, start):
+            pass
+        if last is None:
+            return None
+        offset = last.start()
+        for ref in iter_table_references(text[offset:end], ('FROM',)):
+            if ref.start + offset == start and ref.end + offset == end and ref.schema is None:
+                return 'FROM'
+        return None
+
+    def rewrite_text(self, text: str) -> Tuple[str, List[TableRewrite]]:
+        """jsCode・URL等の文字列内のテーブル参照のみを置換（1回の走査）
+
+        テーブル名に一致しても、列名（total_orders）・JS識別子（ordersCount）・
+        プロパティ（stats.orders）・オブジェクトのキー・置換済みの名前（n3_orders）は対象外
+        """
+        if not isinstance(text, str) or not text or self._mention_re is None:
+            return text, []
+
+        edits = []
+        for m in self._mention_re.finditer(text):
+            start = m.start()
+            if start:
+                prev = text[start - 1]
+                if prev.isalnum() or prev in '_$':
+                    continue
+            context = self.mention_context(text, start, m.end())
+            if context is None:
+                continue
+            old = m.group()
+            new = self.table_map[old]
+            edits.append((context, old, new, m.start(), m.end(), new))
+
+        return _splice(text, edits)
+
+
+def rewrite_tables(sql: str, table_map: Dict[str, str],
+                   keywords: Iterable[str] = TABLE_KEYWORDS) -> Tuple[str, List[TableRewrite]]:
+    """単発利用向け（繰り返し使う場合はTableRewriterを1回だけ構築する）"""
+    return TableRewriter(table_map, keywords).rewrite(sql)
+
+
+# ======================
+# CLI
+# ======================
+
+def _iter_workflow_queries(directory: str) -> Iterator[Tuple[str, str, str]]:
+    """(ファイル, ノード名, SQL) を返す"""
+    for path in sorted(Path(directory).rglob('*.json')):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                workflow = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if not isinstance(workflow, dict):
+            continue
+        for node in workflow.get('nodes', []) or []:
+            query = (node.get('parameters') or {}).get('query')
+            if isinstance(query, str):
+                yield str(path), node.get('name', ''), query
+
+
+def main():
+    parser = argparse.ArgumentParser(description='N3 SQLテーブル参照スキャナー')
+    parser.add_argument('directory', help='ワークフローJSONのディレクトリ')
+    parser.add_argument('--top', type=int, default=30, help='表示するテーブル数')
+    parser.add_argument('--table', help='指定テーブルを参照するノードを一覧表示')
+    args = parser.parse_args()
+
+    counts: Counter = Counter()
+    queries = 0
+    for path, node_name, query in _iter_workflow_queries(args.directory):
+        queries += 1
+        for ref in iter_table_references(query):
+            counts[ref.name.lower()] += 1
+            if args.table and ref.name.lower() == args.table.lower():
+                print(f'{path} :: {node_name} ({ref.keyword} @ {ref.start})')
+
+    if args.table:
+        sys.exit(0 if counts[args.table.lower()] else 1)
+
+    print(f'📊 SQL: {queries} クエリ / テーブル: {len(counts)} 種類')
+    for name, count in counts.most_common(args.top):
+        print(f'  {count:5d}  {name}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+N3 Empire OS - 監査ログ・AIトレースのバッチ書き込み
+=========================================
+Version: 1.0.0
+Purpose: n8nの注入ノードから届くトレース行をまとめ、テーブルごとに複数行INSERTで書き込む
+
+仕組み:
+- add() は行をメモリ上のバッファに積むだけ（HTTPリクエストを待たせない）
+- テーブルごとに「件数（max_batch）」または「時間窓（window秒、最初の行から）」で flush
+- flush は1テーブル1回の書き込み関数呼び出し（= 複数行INSERT 1回）
+- 書き込み失敗時はバッファの先頭に戻して次回再送（max_pending を超えた分は破棄して件数を記録）
+- 停止時は残りをすべて flush
+
+書き込み先は呼び出し側が渡す非同期関数（例: PostgRESTへの一括POST）:
+  async def sink(table: str, rows: List[Dict]) -> None
+
+使用例:
+  batcher = TraceBatcher(sink, max_batch=200, window=1.0)
+  await batcher.start()
+  batcher.add('ai_decision_traces', rows)
+  await batcher.stop()
+"""
+
+import time
+import asyncio
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, List, Optional
+
+
+Sink = Callable[[str, List[Dict]], Awaitable[None]]
+
+DEFAULT_MAX_BATCH = 200
+DEFAULT_WINDOW = 1.0
+DEFAULT_MAX_PENDING = 10000
+
+
+class TraceBatcher:
+    """件数・時間窓でまとめて書き込むバッチャー"""
+
+    def __init__(self, sink: Sink, max_batch: int = DEFAULT_MAX_BATCH,
+                 window: float = DEFAULT_WINDOW, max_pending: int = DEFAULT_MAX_PENDING):
+        self.sink = sink
+        self.max_batch = max(1, max_batch)
+        self.window = window
+        self.max_pending = max(self.max_batch, max_pending)
+        # テーブル名 → 未書き込みの行
+        self._buffers: Dict[str, Deque[Dict]] = {}
+        # テーブル名 → バッファ内で最も古い行の到着時刻
+        self._first_at: Dict[str, float] = {}
+        self._wakeup = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {'received': 0, 'written': 0, 'flushes': 0, 'failures': 0, 'dropped': 0}
+
+    @property
+    def pending(self) -> int:
+        return sum(len(rows) for rows in self._buffers.values())
+
+    def add(self, table: str, rows: List[Dict]) -> int:
+        """行をバッファに追加（上限超過分は破棄）。受け付けた件数を返す"""
+        accepted = min(len(rows), max(0, self.max_pending - self.pending))
+        self.stats['received'] += accepted
+        self.stats['dropped'] += len(rows) - accepted
+        if not accepted:
+            return 0
+
+        buffer = self._buffers.setdefault(table, deque())
+        opened = not buffer
+        if opened:
+            self._first_at[table] = time.monotonic()
+        buffer.extend(rows[:accepted])
+        # 新しい時間窓の開始、または件数到達でバックグラウンド処理を起こす
+        if opened or len(buffer) >= self.max_batch:
+            self._wakeup.set()
+        return accepted
+
+    def _due(self, now: float) -> List[str]:
+        return [
+            table for table, buffer in self._buffers.items()
+            if buffer and (len(buffer) >= self.max_batch or now - self._first_at[table] >= self.window)
+        ]
+
+    async def flush(self, tables: Optional[List[str]] = None):
+        """指定テーブル（未指定なら全テーブル）のバッファを書き込む"""
+        async with self._lock:
+            for table in tables if tables is not None else list(self._buffers):
+                buffer = self._buffers.get(table)
+                while buffer:
+                    batch = [buffer.popleft() for _ in range(min(self.max_batch, len(buffer)))]
+                    try:
+                        await self.sink(table, batch)
+                    except Exception as e:
+                        # 先頭に戻して次回再送（窓の起点はリセット）
+                        self.stats['failures'] += 1
+                        buffer.extendleft(reversed(batch))
+                        overflow = self.pending - self.max_pending
+                        for _ in range(max(0, overflow)):
+                            buffer.pop()
+                            self.stats['dropped'] += 1
+                        self._first_at[table] = time.monotonic()
+                        print(f'トレース書き込みエラー（{table}, {len(batch)}件）: {e}')
+                        break
+                    self.stats['written'] += len(batch)
+                    self.stats['flushes'] += 1
+                if buffer is not None and not buffer:
+                    self._first_at.pop(table, None)
+
+    async def _run(self):
+        while True:
+            now = time.monotonic()
+            pending_since = [t for table, t in self._first_at.items() if self._buffers.get(table)]
+            timeout = max(0.0, min(pending_since) + self.window - now) if pending_since else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            due = self._due(time.monotonic())
+            if due:
+                await self.flush(due)
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """バックグラウンド処理を止め、残りを書き込む"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
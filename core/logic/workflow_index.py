@@ -0,0 +1,536 @@
+#!/usr/bin/env python3
+"""
+N3 Empire OS - ワークフローカタログ（SQLiteインデックス）
+=========================================
+Version: 1.0.0
+Purpose: n8n-workflows配下を1回だけ解析してSQLiteに格納し、横断的な質問をインデックス付きクエリで即答する
+
+格納内容:
+- files      : パス・mtime・サイズ・sha256（差分更新の判定用）
+- workflows  : ワークフロー名・ID・ノード数
+- nodes      : ノード名・タイプ・役割（webhook / trigger / auth_gate / dispatcher / hmac_verify / 装甲パッチの注入ロール）
+- edges      : 接続（接続元 → 接続先、出力番号）
+- sql_queries: ノードのSQL
+- table_refs : テーブル参照（SQLのFROM/JOIN/INTO/UPDATE、REST /rest/v1/、テーブル名パラメータ）
+- env_refs   : 環境変数・変数参照（$env / $vars / process.env）
+- node_types : ノードタイプ別の集計（ビュー）
+
+差分更新:
+- mtimeとサイズが同じファイルは読まない
+- 変わっていても内容のsha256が同じならmtimeのみ更新
+- 消えたファイルの行は削除（外部キーのCASCADEで関連行も削除）
+
+使用方法:
+  python workflow_index.py refresh /path/to/n8n-workflows
+  python workflow_index.py table orders
+  python workflow_index.py unguarded-webhooks
+  python workflow_index.py types --top 20
+  python workflow_index.py env SUPABASE_URL
+  python workflow_index.py sql "SELECT type, COUNT(*) FROM nodes GROUP BY type"
+  # --refresh ROOT を付けると問い合わせ前に差分更新
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import sqlite3
+import hashlib
+import argparse
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - 標準jsonにフォールバック
+    orjson = None
+
+from sql_table_rewriter import iter_table_references
+
+
+DEFAULT_DB = os.getenv('N3_WORKFLOW_INDEX', 'workflow_index.sqlite')
+
+SCHEMA_VERSION = 2  # 2: 要塞化のHMAC署名検証ノードを hmac_verify として分類
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    sha256 TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    error TEXT,
+    indexed_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS workflows (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE REFERENCES files(path) ON DELETE CASCADE,
+    name TEXT,
+    workflow_id TEXT,
+    active INTEGER,
+    node_count INTEGER NOT NULL,
+    edge_count INTEGER NOT NULL,
+    tags TEXT
+);
+CREATE TABLE IF NOT EXISTS nodes (
+    workflow_id INTEGER NOT NULL REFERENCES workflows(id) ON DELETE CASCADE,
+    node_id TEXT,
+    name TEXT NOT NULL,
+    type TEXT,
+    type_version REAL,
+    role TEXT,
+    auth TEXT,
+    disabled INTEGER NOT NULL DEFAULT 0,
+    x REAL,
+    y REAL
+);
+CREATE INDEX IF NOT EXISTS nodes_by_workflow ON nodes(workflow_id, name);
+CREATE INDEX IF NOT EXISTS nodes_by_type ON nodes(type);
+CREATE INDEX IF NOT EXISTS nodes_by_role ON nodes(role);
+CREATE TABLE IF NOT EXISTS edges (
+    workflow_id INTEGER NOT NULL REFERENCES workflows(id) ON DELETE CASCADE,
+    source TEXT NOT NULL,
+    target TEXT NOT NULL,
+    conn_type TEXT NOT NULL,
+    output_index INTEGER NOT NULL,
+    target_index INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS edges_by_source ON edges(workflow_id, source);
+CREATE INDEX IF NOT EXISTS edges_by_target ON edges(workflow_id, target);
+CREATE TABLE IF NOT EXISTS sql_queries (
+    workflow_id INTEGER NOT NULL REFERENCES workflows(id) ON DELETE CASCADE,
+    node TEXT NOT NULL,
+    field TEXT NOT NULL,
+    query TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sql_queries_by_workflow ON sql_queries(workflow_id);
+CREATE TABLE IF NOT EXISTS table_refs (
+    workflow_id INTEGER NOT NULL REFERENCES workflows(id) ON DELETE CASCADE,
+    node TEXT NOT NULL,
+    table_name TEXT NOT NULL,
+    schema_name TEXT,
+    context TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS table_refs_by_table ON table_refs(table_name);
+CREATE INDEX IF NOT EXISTS table_refs_by_workflow ON table_refs(workflow_id);
+CREATE TABLE IF NOT EXISTS env_refs (
+    workflow_id INTEGER NOT NULL REFERENCES workflows(id) ON DELETE CASCADE,
+    node TEXT NOT NULL,
+    var TEXT NOT NULL,
+    source TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS env_refs_by_var ON env_refs(var);
+CREATE INDEX IF NOT EXISTS env_refs_by_workflow ON env_refs(workflow_id);
+CREATE VIEW IF NOT EXISTS node_types AS
+    SELECT type, COUNT(*) AS nodes, COUNT(DISTINCT workflow_id) AS workflows
+    FROM nodes GROUP BY type;
+'''
+
+
+# ======================
+# 接続
+# ======================
+
+def connect(db_path: str = DEFAULT_DB) -> sqlite3.Connection:
+    """カタログを開く（なければスキーマを作成）"""
+    os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('PRAGMA foreign_keys=ON')
+
+    row = None
+    if _has_table(conn, 'meta'):
+        row = conn.execute("SELECT value FROM meta WHERE key = 'schema_version'").fetchone()
+    if row is not None and int(row['value']) != SCHEMA_VERSION:
+        # スキーマが変わったら作り直す（カタログは入力から再生成できる）
+        for (name, kind) in conn.execute(
+            "SELECT name, type FROM sqlite_master WHERE type IN ('table', 'view') AND name NOT LIKE 'sqlite_%'"
+        ).fetchall():
+            conn.execute(f'DROP {kind.upper()} IF EXISTS "{name}"')
+    conn.executescript(SCHEMA)
+    conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('schema_version', ?)", (str(SCHEMA_VERSION),))
+    conn.commit()
+    return conn
+
+
+def _has_table(conn: sqlite3.Connection, name: str) -> bool:
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)).fetchone() is not None
+
+
+# ======================
+# ワークフロー解析
+# ======================
+
+_ENV_PATTERNS = [
+    ('$env', re.compile(r'\$env(?:\.([A-Za-z_]\w*)|\[\s*[\'"]([A-Za-z_]\w*)[\'"]\s*\])')),
+    ('$vars', re.compile(r'\$vars(?:\.([A-Za-z_]\w*)|\[\s*[\'"]([A-Za-z_]\w*)[\'"]\s*\])')),
+    ('process.env', re.compile(r'process\.env(?:\.([A-Za-z_]\w*)|\[\s*[\'"]([A-Za-z_]\w*)[\'"]\s*\])')),
+]
+_REST_RE = re.compile(r'/rest/v1/(?:([A-Za-z_]\w*)\.)?([A-Za-z_]\w*)')
+
+# テーブル名を直接持つパラメータ（Supabase: tableId / Postgres: table / 汎用: tableName）
+TABLE_PARAM_KEYS = ('tableId', 'table', 'tableName')
+
+# SQLを持つパラメータ
+SQL_PARAM_KEYS = ('query',)
+
+
+def _iter_strings(value: Any) -> Iterator[str]:
+    if isinstance(value, str):
+        yield value
+    elif isinstance(value, dict):
+        for v in value.values():
+            yield from _iter_strings(v)
+    elif isinstance(value, list):
+        for v in value:
+            yield from _iter_strings(v)
+
+
+def _param_value(value: Any) -> Optional[str]:
+    """文字列、またはリソースロケーター形式 {"__rl": true, "value": ...} の値"""
+    if isinstance(value, dict):
+        value = value.get('value')
+    if isinstance(value, str) and value and not value.startswith('='):
+        return value
+    return None
+
+
+# 要塞化のHMAC署名検証ノードの notes（現行の fortress_engine と、Empire OS v6 で挿入された旧版）
+HMAC_VERIFY_NOTES = ('[FORTRESS_AUTO_INSERTED]', '[EMPIRE_OS_V6] セキュリティ強制挿入')
+
+
+def node_role(node: Dict, armor_roles: Dict[str, str]) -> Optional[str]:
+    """ノードの役割（検索用）"""
+    name = node.get('name', '')
+    if name in armor_roles:
+        return armor_roles[name]
+    node_type = (node.get('type') or '').lower()
+    if node_type.endswith('.webhook'):
+        return 'webhook'
+    if 'trigger' in node_type:
+        return 'trigger'
+    if 'auth-gate' in name.lower() or 'auth gate' in name.lower():
+        return 'auth_gate'
+    if 'core-dispatcher' in name.lower():
+        # V8.3 CORE-Dispatcher は認証・燃焼上限をまとめて担う
+        return 'dispatcher'
+    if (str(node.get('id') or '').startswith('hmac_verify_')
+            or (node.get('notes') or '').startswith(HMAC_VERIFY_NOTES)
+            or name == '🔐 HMAC署名検証' or name.startswith('🔐 署名検証 (')):
+        # 要塞化変換がWebhook直後に挿入するHMAC署名検証
+        return 'hmac_verify'
+    return None
+
+
+def extract_workflow(workflow: Dict) -> Dict[str, List[Tuple]]:
+    """ワークフローからカタログの行を抽出"""
+    nodes = [n for n in workflow.get('nodes') or [] if isinstance(n, dict)]
+    armor_index = (workflow.get('meta') or {}).get('n3ArmorPatch') or {}
+    armor_roles = {name: entry.get('role') for name, entry in (armor_index.get('nodes') or {}).items()}
+
+    rows: Dict[str, List[Tuple]] = {'nodes': [], 'edges': [], 'sql_queries': [], 'table_refs': [], 'env_refs': []}
+
+    for node in nodes:
+        name = node.get('name', '')
+        params = node.get('parameters') or {}
+        position = node.get('position') if isinstance(node.get('position'), list) else [None, None]
+        type_version = node.get('typeVersion')
+        rows['nodes'].append((
+            node.get('id'), name, node.get('type'),
+            type_version if isinstance(type_version, (int, float)) else None,
+            node_role(node, armor_roles),
+            params.get('authentication') if isinstance(params.get('authentication'), str) else None,
+            1 if node.get('disabled') else 0,
+            position[0] if len(position) > 0 else None,
+            position[1] if len(position) > 1 else None,
+        ))
+
+        for key in SQL_PARAM_KEYS:
+            query = params.get(key)
+            if isinstance(query, str) and query.strip():
+                rows['sql_queries'].append((name, key, query))
+                for ref in iter_table_references(query):
+                    rows['table_refs'].append((name, ref.name.lower(), (ref.schema or '').lower() or None, ref.keyword))
+
+        for key in TABLE_PARAM_KEYS:
+            table = _param_value(params.get(key))
+            if table:
+                rows['table_refs'].append((name, table.lower(), None, 'PARAM'))
+
+        env_seen = set()
+        for text in _iter_strings(params):
+            if '/rest/v1/' in text:
+                for m in _REST_RE.finditer(text):
+                    rows['table_refs'].append((name, m.group(2).lower(), (m.group(1) or '').lower() or None, 'REST'))
+            if '$env' in text or '$vars' in text or 'process.env' in text:
+                for source, pattern in _ENV_PATTERNS:
+                    for m in pattern.finditer(text):
+                        var = m.group(1) or m.group(2)
+                        if (var, source) not in env_seen:
+                            env_seen.add((var, source))
+                            rows['env_refs'].append((name, var, source))
+
+    connections = workflow.get('connections') or {}
+    if isinstance(connections, dict):
+        for source, outputs in connections.items():
+            if not isinstance(outputs, dict):
+                continue
+            for conn_type, branches in outputs.items():
+                for output_index, branch in enumerate(branches or []):
+                    for target in branch or []:
+                        if isinstance(target, dict) and target.get('node'):
+                            rows['edges'].append((
+                                source, target['node'], conn_type, output_index, int(target.get('index') or 0),
+                            ))
+    return rows
+
+
+# ======================
+# 差分更新
+# ======================
+
+def _parse(data: bytes) -> Any:
+    return orjson.loads(data) if orjson else json.loads(data.decode('utf-8'))
+
+
+def _iter_json_files(root: Path) -> Iterator[Path]:
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(d for d in dirnames if not d.startswith('.'))
+        for filename in sorted(filenames):
+            if filename.endswith('.json') and not filename.startswith('.'):
+                yield Path(dirpath) / filename
+
+
+def _store(conn: sqlite3.Connection, rel: str, stat: os.stat_result, sha: str, data: bytes):
+    """1ファイル分の行を入れ替える"""
+    conn.execute('DELETE FROM files WHERE path = ?', (rel,))
+    now = datetime.now(timezone.utc).isoformat()
+
+    try:
+        workflow = _parse(data)
+    except (ValueError, UnicodeDecodeError) as e:
+        conn.execute(
+            'INSERT INTO files (path, mtime_ns, size, sha256, kind, error, indexed_at) VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (rel, stat.st_mtime_ns, stat.st_size, sha, 'invalid', str(e), now),
+        )
+        return
+
+    is_workflow = isinstance(workflow, dict) and isinstance(workflow.get('nodes'), list)
+    conn.execute(
+        'INSERT INTO files (path, mtime_ns, size, sha256, kind, error, indexed_at) VALUES (?, ?, ?, ?, ?, NULL, ?)',
+        (rel, stat.st_mtime_ns, stat.st_size, sha, 'workflow' if is_workflow else 'json', now),
+    )
+    if not is_workflow:
+        return
+
+    rows = extract_workflow(workflow)
+    tags = [t.get('name') if isinstance(t, dict) else t for t in workflow.get('tags') or []]
+    cur = conn.execute(
+        'INSERT INTO workflows (path, name, workflow_id, active, node_count, edge_count, tags) VALUES (?, ?, ?, ?, ?, ?, ?)',
+        (rel, workflow.get('name'), str(workflow['id']) if workflow.get('id') is not None else None,
+         1 if workflow.get('active') else 0, len(rows['nodes']), len(rows['edges']),
+         json.dumps(tags, ensure_ascii=False)),
+    )
+    wf_id = cur.lastrowid
+    conn.executemany(
+        'INSERT INTO nodes (workflow_id, node_id, name, type, type_version, role, auth, disabled, x, y) '
+        'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+        [(wf_id, *row) for row in rows['nodes']],
+    )
+    conn.executemany(
+        'INSERT INTO edges (workflow_id, source, target, conn_type, output_index, target_index) VALUES (?, ?, ?, ?, ?, ?)',
+        [(wf_id, *row) for row in rows['edges']],
+    )
+    conn.executemany(
+        'INSERT INTO sql_queries (workflow_id, node, field, query) VALUES (?, ?, ?, ?)',
+        [(wf_id, *row) for row in rows['sql_queries']],
+    )
+    conn.executemany(
+        'INSERT INTO table_refs (workflow_id, node, table_name, schema_name, context) VALUES (?, ?, ?, ?, ?)',
+        [(wf_id, *row) for row in rows['table_refs']],
+    )
+    conn.executemany(
+        'INSERT INTO env_refs (workflow_id, node, var, source) VALUES (?, ?, ?, ?)',
+        [(wf_id, *row) for row in rows['env_refs']],
+    )
+
+
+def refresh(conn: sqlite3.Connection, root: str) -> Dict:
+    """ディレクトリ配下をカタログへ差分反映"""
+    started = time.perf_counter()
+    root_path = Path(root)
+    stats = {'scanned': 0, 'unchanged': 0, 'touched': 0, 'indexed': 0, 'removed': 0, 'invalid': 0}
+
+    known = {row['path']: (row['mtime_ns'], row['size'], row['sha256'])
+             for row in conn.execute('SELECT path, mtime_ns, size, sha256 FROM files')}
+    seen = set()
+
+    with conn:
+        for path in _iter_json_files(root_path):
+            rel = path.relative_to(root_path).as_posix()
+            seen.add(rel)
+            stats['scanned'] += 1
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+
+            previous = known.get(rel)
+            if previous and previous[0] == stat.st_mtime_ns and previous[1] == stat.st_size:
+                stats['unchanged'] += 1
+                continue
+
+            try:
+                data = path.read_bytes()
+            except OSError:
+                continue
+            sha = hashlib.sha256(data).hexdigest()
+
+            if previous and previous[2] == sha:
+                # 内容は同じ（touch・チェックアウトなど）: 再解析しない
+                conn.execute('UPDATE files SET mtime_ns = ?, size = ? WHERE path = ?',
+                             (stat.st_mtime_ns, stat.st_size, rel))
+                stats['touched'] += 1
+                continue
+
+            _store(conn, rel, stat, sha, data)
+            stats['indexed'] += 1
+
+        removed = [(rel,) for rel in known if rel not in seen]
+        conn.executemany('DELETE FROM files WHERE path = ?', removed)
+        stats['removed'] = len(removed)
+
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('root', ?)", (str(root_path.resolve()),))
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('refreshed_at', ?)",
+                     (datetime.now(timezone.utc).isoformat(),))
+
+    stats['invalid'] = conn.execute("SELECT COUNT(*) FROM files WHERE kind = 'invalid'").fetchone()[0]
+    stats['elapsed_ms'] = round((time.perf_counter() - started) * 1000, 1)
+    return stats
+
+
+# ======================
+# 問い合わせ
+# ======================
+
+def workflows_using_table(conn: sqlite3.Connection, table: str) -> List[Dict]:
+    """指定テーブルを参照するワークフロー・ノード"""
+    rows = conn.execute('''
+        SELECT w.path, w.name AS workflow, r.node, r.schema_name, GROUP_CONCAT(DISTINCT r.context) AS contexts
+        FROM table_refs r JOIN workflows w ON w.id = r.workflow_id
+        WHERE r.table_name = ?
+        GROUP BY w.id, r.node
+        ORDER BY w.path, r.node
+    ''', (table.lower(),))
+    return [dict(row) for row in rows]
+
+
+def webhooks_without_auth_gate(conn: sqlite3.Connection) -> List[Dict]:
+    """認証設定もAuth-Gate（CORE-Dispatcher・要塞化のHMAC署名検証を含む）も直後にないWebhook"""
+    rows = conn.execute('''
+        SELECT w.path, w.name AS workflow, n.name AS webhook
+        FROM nodes n JOIN workflows w ON w.id = n.workflow_id
+        WHERE n.role = 'webhook'
+          AND n.disabled = 0
+          AND COALESCE(n.auth, 'none') = 'none'
+          AND NOT EXISTS (
+              SELECT 1 FROM edges e
+              JOIN nodes t ON t.workflow_id = e.workflow_id AND t.name = e.target
+              WHERE e.workflow_id = n.workflow_id AND e.source = n.name
+                AND t.role IN ('auth_gate', 'dispatcher', 'hmac_verify')
+          )
+        ORDER BY w.path, n.name
+    ''')
+    return [dict(row) for row in rows]
+
+
+def node_type_counts(conn: sqlite3.Connection, top: int = 30) -> List[Dict]:
+    rows = conn.execute('SELECT * FROM node_types ORDER BY nodes DESC, type LIMIT ?', (top,))
+    return [dict(row) for row in rows]
+
+
+def env_var_usage(conn: sqlite3.Connection, var: Optional[str] = None) -> List[Dict]:
+    """環境変数ごとの参照数（var指定時は参照しているノード）"""
+    if var:
+        rows = conn.execute('''
+            SELECT w.path, w.name AS workflow, e.node, e.source
+            FROM env_refs e JOIN workflows w ON w.id = e.workflow_id
+            WHERE e.var = ?
+            ORDER BY w.path, e.node
+        ''', (var,))
+    else:
+        rows = conn.execute('''
+            SELECT var, source, COUNT(*) AS refs, COUNT(DISTINCT workflow_id) AS workflows
+            FROM env_refs GROUP BY var, source ORDER BY refs DESC, var
+        ''')
+    return [dict(row) for row in rows]
+
+
+# ======================
+# CLI
+# ======================
+
+def _print_rows(rows: List[Dict], elapsed_ms: float):
+    for row in rows:
+        print('  ' + ' | '.join('' if v is None else str(v) for v in row.values()))
+    print(f'\n{len(rows)} 件（{elapsed_ms:.2f} ms）')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='N3 ワークフローカタログ（SQLite）')
+    parser.add_argument('--db', default=DEFAULT_DB, help=f'カタログのパス（デフォルト: {DEFAULT_DB}、環境変数 N3_WORKFLOW_INDEX）')
+    parser.add_argument('--refresh', metavar='ROOT', help='問い合わせ前にROOT配下を差分更新')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    refresh_cmd = sub.add_parser('refresh', help='ディレクトリ配下を差分更新')
+    refresh_cmd.add_argument('root', help='n8n-workflowsディレクトリ')
+
+    table_cmd = sub.add_parser('table', help='テーブルを参照するワークフロー')
+    table_cmd.add_argument('name', help='テーブル名')
+
+    sub.add_parser('unguarded-webhooks', help='Auth-Gateのない（認証なしの）Webhook')
+
+    types_cmd = sub.add_parser('types', help='ノードタイプ別の集計')
+    types_cmd.add_argument('--top', type=int, default=30)
+
+    env_cmd = sub.add_parser('env', help='環境変数の参照')
+    env_cmd.add_argument('var', nargs='?', help='変数名（省略時は一覧）')
+
+    sql_cmd = sub.add_parser('sql', help='任意のSQLを実行')
+    sql_cmd.add_argument('query')
+
+    args = parser.parse_args()
+    conn = connect(args.db)
+
+    if args.command == 'refresh' or args.refresh:
+        stats = refresh(conn, args.root if args.command == 'refresh' else args.refresh)
+        print(f"📚 カタログ更新: 走査 {stats['scanned']} / 再解析 {stats['indexed']} / 内容同一 {stats['touched']} "
+              f"/ 変更なし {stats['unchanged']} / 削除 {stats['removed']} / 解析エラー {stats['invalid']} "
+              f"（{stats['elapsed_ms']} ms）", file=sys.stderr)
+        if args.command == 'refresh':
+            return
+
+    started = time.perf_counter()
+    if args.command == 'table':
+        rows = workflows_using_table(conn, args.name)
+    elif args.command == 'unguarded-webhooks':
+        rows = webhooks_without_auth_gate(conn)
+    elif args.command == 'types':
+        rows = node_type_counts(conn, args.top)
+    elif args.command == 'env':
+        rows = env_var_usage(conn, args.var)
+    else:
+        rows = [dict(row) for row in conn.execute(args.query)]
+    _print_rows(rows, (time.perf_counter() - started) * 1000)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,624 @@
+#!/usr/bin/env python3
+"""
+N3 Empire OS - ワークフロー自動レイアウト（階層型DAGレイアウト）
+=========================================
+Version: 1.0.0
+Purpose: n8nワークフローのノード位置を、接続に沿った階層レイアウトで自動計算
+
+仕組み（Sugiyama方式）:
+1. connections からインデックス付き隣接リストを構築（名前→番号の辞書は1回だけ）
+2. DFSで閉路を検出し、逆向きの辺を反転してDAG化
+3. 最長経路法でレイヤー（列）を割り当て（トポロジカル順に1回走査）
+4. 2列以上をまたぐ辺にダミーノードを挿入
+5. 重心法で列内の並び順を上下スイープし、辺の交差数が最小の並びを採用
+6. 座標割り当て: 列ごとにx固定、yは隣接ノードの平均へ寄せつつ最小間隔を保証（重なりなし）
+
+計算量: スイープ回数は定数、1スイープあたり O((V+E) log V)
+
+差分レイアウト（relayout_inserted）:
+- パッチで挿入したノードだけを接続元の隣に配置し、必要な分だけ下流の部分グラフを右へずらす
+- 手動で配置された他のノードの位置は保持
+
+使用例:
+  positions = compute_layout(workflow)
+  apply_layout(workflow, positions, only_missing=True)
+  relayout_inserted(workflow, ['🔐 署名検証 (Webhook)'])
+"""
+
+import sys
+import json
+import argparse
+from collections import deque
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+DEFAULT_ORIGIN = (250, 300)
+DEFAULT_X_STEP = 300
+DEFAULT_Y_STEP = 150
+DEFAULT_SWEEPS = 4
+
+# 重なり判定に使うノードの占有サイズ（ラベル分を含めた概算）
+NODE_WIDTH = 200
+NODE_HEIGHT = 100
+
+
+# ======================
+# グラフ構築
+# ======================
+
+class LayoutGraph:
+    """ノード名をインデックス化した隣接リスト"""
+
+    def __init__(self, names: List[str]):
+        self.names = names
+        self.index = {name: i for i, name in enumerate(names)}
+        self.succ: List[List[int]] = [[] for _ in names]
+        self.pred: List[List[int]] = [[] for _ in names]
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def add_edge(self, u: int, v: int):
+        self.succ[u].append(v)
+        self.pred[v].append(u)
+
+
+def build_graph(workflow: Dict) -> LayoutGraph:
+    """ワークフローの接続からグラフを構築（存在しないノードへの接続・自己ループは無視）"""
+    # 重複を除きつつ出現順を保つ（dict はO(1)で判定、挿入順を保持）
+    names = dict.fromkeys(
+        node.get('name') for node in workflow.get('nodes', []) or []
+        if isinstance(node.get('name'), str)
+    )
+    graph = LayoutGraph(list(names))
+
+    seen = set()
+    for source, outputs in (workflow.get('connections') or {}).items():
+        u = graph.index.get(source)
+        if u is None or not isinstance(outputs, dict):
+            continue
+        # 出力番号順（IFのtrue/false等）に辺を並べ、初期の並び順に反映する
+        for branches in outputs.values():
+            for branch in branches or []:
+                for conn in branch or []:
+                    v = graph.index.get(conn.get('node')) if isinstance(conn, dict) else None
+                    if v is None or v == u or (u, v) in seen:
+                        continue
+                    seen.add((u, v))
+                    graph.add_edge(u, v)
+    return graph
+
+
+# ======================
+# 閉路除去・レイヤー割り当て
+# ======================
+
+def acyclic_edges(graph: LayoutGraph) -> List[Tuple[int, int]]:
+    """DFSで後退辺を反転した辺リストを返す（反復DFSなので深いグラフでも再帰しない）"""
+    WHITE, GRAY, BLACK = 0, 1, 2
+    state = [WHITE] * len(graph)
+    edges: List[Tuple[int, int]] = []
+
+    # 入次数0のノードを優先して開始点にする（トリガーが左端に来る）
+    roots = [v for v in range(len(graph)) if not graph.pred[v]]
+    roots += [v for v in range(len(graph)) if graph.pred[v]]
+
+    for root in roots:
+        if state[root] != WHITE:
+            continue
+        state[root] = GRAY
+        stack = [(root, iter(graph.succ[root]))]
+        while stack:
+            u, it = stack[-1]
+            for v in it:
+                if state[v] == GRAY:
+                    edges.append((v, u))  # 後退辺は反転
+                else:
+                    edges.append((u, v))
+                    if state[v] == WHITE:
+                        state[v] = GRAY
+                        stack.append((v, iter(graph.succ[v])))
+                        break
+            else:
+                state[u] = BLACK
+                stack.pop()
+    return edges
+
+
+def longest_path_layers(count: int, edges: Iterable[Tuple[int, int]]) -> List[int]:
+    """最長経路法でレイヤー番号を割り当て（Kahn法のトポロジカル順）"""
+    succ: List[List[int]] = [[] for _ in range(count)]
+    indegree = [0] * count
+    for u, v in edges:
+        succ[u].append(v)
+        indegree[v] += 1
+
+    layer = [0] * count
+    queue = deque(v for v in range(count) if indegree[v] == 0)
+    while queue:
+        u = queue.popleft()
+        for v in succ[u]:
+            if layer[u] + 1 > layer[v]:
+                layer[v] = layer[u] + 1
+            indegree[v] -= 1
+            if indegree[v] == 0:
+                queue.append(v)
+    return layer
+
+
+# ======================
+# 交差削減
+# ======================
+
+def _count_crossings(upper_pos: Dict[int, int], lower_pos: Dict[int, int],
+                     edges: List[Tuple[int, int]]) -> int:
+    """隣接2列間の辺の交差数（Fenwick木で転倒数を数える、O(E log V)）"""
+    if len(edges) < 2:
+        return 0
+    ordered = sorted((upper_pos[u], lower_pos[v]) for u, v in edges)
+    size = len(lower_pos) + 1
+    tree = [0] * (size + 1)
+    crossings = 0
+    for seen, (_, p) in enumerate(ordered):
+        # これまでに見た辺のうち、下側の位置がpより大きいもの = 交差
+        i, not_greater = p + 1, 0
+        while i > 0:
+            not_greater += tree[i]
+            i -= i & -i
+        crossings += seen - not_greater
+        i = p + 1
+        while i <= size:
+            tree[i] += 1
+            i += i & -i
+    return crossings
+
+
+class _LayeredGraph:
+    """ダミーノードを含む、隣接レイヤー間の辺だけからなるグラフ"""
+
+    def __init__(self, count: int, edges: List[Tuple[int, int]], layer: List[int]):
+        self.real_count = count
+        self.layer = list(layer)
+        self.up: List[List[int]] = [[] for _ in range(count)]
+        self.down: List[List[int]] = [[] for _ in range(count)]
+
+        for u, v in edges:
+            prev = u
+            for step in range(self.layer[u] + 1, self.layer[v]):
+                dummy = len(self.layer)
+                self.layer.append(step)
+                self.up.append([])
+                self.down.append([])
+                self._link(prev, dummy)
+                prev = dummy
+            self._link(prev, v)
+
+        depth = max(self.layer, default=-1) + 1
+        self.layers: List[List[int]] = [[] for _ in range(depth)]
+
+    def _link(self, u: int, v: int):
+        self.down[u].append(v)
+        self.up[v].append(u)
+
+    def is_dummy(self, v: int) -> bool:
+        return v >= self.real_count
+
+
+def _initial_order(lg: _LayeredGraph, graph: LayoutGraph):
+    """接続を幅優先でたどった発見順を初期の並びにする（出力番号の順序を保つ）"""
+    visited = [False] * len(lg.layer)
+    queue = deque()
+    for v in range(lg.real_count):
+        if not graph.pred[v]:
+            queue.append(v)
+            visited[v] = True
+    # 入口のない閉路だけの成分などの取りこぼしは最後に回す
+    pending = deque(range(lg.real_count))
+    while queue or pending:
+        if not queue:
+            v = pending.popleft()
+            if visited[v]:
+                continue
+            visited[v] = True
+            queue.append(v)
+        u = queue.popleft()
+        lg.layers[lg.layer[u]].append(u)
+        for v in lg.down[u]:
+            if not visited[v]:
+                visited[v] = True
+                queue.append(v)
+
+
+def _sweep(lg: _LayeredGraph, order: List[List[int]], downward: bool) -> List[List[int]]:
+    position = {}
+    for nodes in order:
+        for i, v in enumerate(nodes):
+            position[v] = i
+
+    layers = range(1, len(order)) if downward else range(len(order) - 2, -1, -1)
+    result = [list(nodes) for nodes in order]
+    for index in layers:
+        neighbours = lg.up if downward else lg.down
+        keyed = []
+        for i, v in enumerate(result[index]):
+            adj = neighbours[v]
+            # 隣接ノードのない場合は現在位置を維持
+            key = sum(position[a] for a in adj) / len(adj) if adj else float(i)
+            keyed.append((key, i, v))
+        keyed.sort()
+        result[index] = [v for _, _, v in keyed]
+        for i, v in enumerate(result[index]):
+            position[v] = i
+    return result
+
+
+def _total_crossings(lg: _LayeredGraph, order: List[List[int]]) -> int:
+    total = 0
+    for index in range(len(order) - 1):
+        upper = {v: i for i, v in enumerate(order[index])}
+        lower = {v: i for i, v in enumerate(order[index + 1])}
+        edges = [(u, v) for u in order[index] for v in lg.down[u]]
+        total += _count_crossings(upper, lower, edges)
+    return total
+
+
+def minimize_crossings(lg: _LayeredGraph, sweeps: int = DEFAULT_SWEEPS) -> List[List[int]]:
+    """重心法で上下スイープし、交差数が最小の並びを返す"""
+    best = [list(nodes) for nodes in lg.layers]
+    best_crossings = _total_crossings(lg, best)
+    order = best
+    for _ in range(sweeps):
+        if best_crossings == 0:
+            break
+        for downward in (True, False):
+            order = _sweep(lg, order, downward)
+            crossings = _total_crossings(lg, order)
+            if crossings < best_crossings:
+                best, best_crossings = order, crossings
+    return best
+
+
+# ======================
+# 座標割り当て
+# ======================
+
+def _pack(items: List[int], desired: Dict[int, float], gap) -> Dict[int, float]:
+    """並び順を保ち最小間隔を守りながら、各ノードを希望位置へ寄せる"""
+    ys: Dict[int, float] = {}
+    prev = None
+    for v in items:
+        y = desired[v]
+        if prev is not None:
+            y = max(y, ys[prev] + gap(prev, v))
+        ys[v] = y
+        prev = v
+    # 押し下げた分を全体で均等に戻す（間隔は保たれる）
+    if items:
+        shift = sum(desired[v] - ys[v] for v in items) / len(items)
+        for v in items:
+            ys[v] += shift
+    return ys
+
+
+def assign_coordinates(lg: _LayeredGraph, order: List[List[int]],
+                       y_step: float) -> Dict[int, float]:
+    """列内のy座標を決定（実ノード間はy_step、ダミーを挟む場合は半分の間隔）"""
+    def gap(a: int, b: int) -> float:
+        return y_step if not (lg.is_dummy(a) or lg.is_dummy(b)) else y_step / 2
+
+    ys: Dict[int, float] = {}
+    for nodes in order:
+        y = 0.0
+        for i, v in enumerate(nodes):
+            if i:
+                y += gap(nodes[i - 1], v)
+            ys[v] = y
+        # 各列を中央揃え
+        if nodes:
+            middle = (ys[nodes[0]] + ys[nodes[-1]]) / 2
+            for v in nodes:
+                ys[v] -= middle
+
+    # 上流 → 下流、下流 → 上流の順に、隣接ノードの平均位置へ寄せる
+    for downward in (True, False):
+        indices = range(1, len(order)) if downward else range(len(order) - 2, -1, -1)
+        for index in indices:
+            nodes = order[index]
+            neighbours = lg.up if downward else lg.down
+            desired = {}
+            for v in nodes:
+                adj = neighbours[v]
+                desired[v] = sum(ys[a] for a in adj) / len(adj) if adj else ys[v]
+            ys.update(_pack(nodes, desired, gap))
+    return ys
+
+
+def compute_layout(workflow: Dict, origin: Tuple[int, int] = DEFAULT_ORIGIN,
+                   x_step: int = DEFAULT_X_STEP, y_step: int = DEFAULT_Y_STEP,
+                   sweeps: int = DEFAULT_SWEEPS) -> Dict[str, List[int]]:
+    """全ノードの位置を計算（ノード名 → [x, y]）"""
+    graph = build_graph(workflow)
+    if not len(graph):
+        return {}
+
+    edges = acyclic_edges(graph)
+    layer = longest_path_layers(len(graph), edges)
+    lg = _LayeredGraph(len(graph), edges, layer)
+    _initial_order(lg, graph)
+    order = minimize_crossings(lg, sweeps)
+    ys = assign_coordinates(lg, order, y_step)
+
+    top = min(ys[v] for v in range(len(graph)))
+    return {
+        graph.names[v]: [int(origin[0] + lg.layer[v] * x_step), int(round(origin[1] + ys[v] - top))]
+        for v in range(len(graph))
+    }
+
+
+# ======================
+# 適用・重なり検出
+# ======================
+
+def _cell(position, cell_w: int, cell_h: int) -> Tuple[int, int]:
+    return int(position[0] // cell_w), int(position[1] // cell_h)
+
+
+class OccupancyGrid:
+    """ノード配置の空間ハッシュ（重なり判定を近傍セルだけで行う）"""
+
+    def __init__(self, width: int = NODE_WIDTH, height: int = NODE_HEIGHT):
+        self.width = width
+        self.height = height
+        self.cells: Dict[Tuple[int, int], List[Tuple[str, float, float]]] = {}
+
+    def add(self, name: str, position):
+        cx, cy = _cell(position, self.width, self.height)
+        self.cells.setdefault((cx, cy), []).append((name, position[0], position[1]))
+
+    def remove(self, name: str, position):
+        key = _cell(position, self.width, self.height)
+        self.cells[key] = [entry for entry in self.cells.get(key, []) if entry[0] != name]
+
+    def collisions(self, position, ignore: Optional[str] = None) -> List[str]:
+        cx, cy = _cell(position, self.width, self.height)
+        hits = []
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                for name, x, y in self.cells.get((cx + dx, cy + dy), ()):
+                    if name != ignore and abs(x - position[0]) < self.width and abs(y - position[1]) < self.height:
+                        hits.append(name)
+        return hits
+
+
+def _valid_position(position) -> bool:
+    return (isinstance(position, (list, tuple)) and len(position) >= 2
+            and all(isinstance(c, (int, float)) for c in position[:2]))
+
+
+def apply_layout(workflow: Dict, positions: Optional[Dict[str, List[int]]] = None,
+                 only_missing: bool = True, y_step: int = DEFAULT_Y_STEP) -> List[str]:
+    """計算済み位置をノードに適用し、位置を設定したノード名を返す
+
+    only_missing=True の場合は既存の位置を保持し、位置のないノードだけを配置する
+    （既存ノードと重なる場合は空くまで下にずらす）
+    """
+    if positions is None:
+        positions = compute_layout(workflow, y_step=y_step)
+
+    nodes = workflow.get('nodes', []) or []
+    grid = OccupancyGrid()
+    if only_missing:
+        for node in nodes:
+            if _valid_position(node.get('position')):
+                grid.add(node.get('name'), node['position'])
+
+    changed = []
+    for node in nodes:
+        name = node.get('name')
+        if only_missing and _valid_position(node.get('position')):
+            continue
+        position = positions.get(name)
+        if position is None:
+            continue
+        position = list(position)
+        while grid.collisions(position, ignore=name):
+            position[1] += y_step
+        grid.add(name, position)
+        if node.get('position') != position:
+            node['position'] = position
+            changed.append(name)
+    return changed
+
+
+def find_overlaps(workflow: Dict) -> List[Tuple[str, str]]:
+    """重なっているノードの組を返す"""
+    grid = OccupancyGrid()
+    overlaps = []
+    for node in workflow.get('nodes', []) or []:
+        position = node.get('position')
+        if not _valid_position(position):
+            continue
+        for other in grid.collisions(position):
+            overlaps.append((other, node.get('name')))
+        grid.add(node.get('name'), position)
+    return overlaps
+
+
+# ======================
+# 差分レイアウト（挿入ノードのみ配置）
+# ======================
+
+def _iter_successors(connections: Dict, name: str) -> Iterable[Tuple[str, int]]:
+    """(接続先ノード名, 出力番号) を返す"""
+    outputs = connections.get(name)
+    if not isinstance(outputs, dict):
+        return
+    for branches in outputs.values():
+        for k, branch in enumerate(branches or []):
+            for conn in branch or []:
+                if isinstance(conn, dict) and conn.get('node'):
+                    yield conn['node'], k
+
+
+def relayout_inserted(workflow: Dict, inserted: Iterable[str],
+                      anchors: Optional[Dict[str, str]] = None,
+                      x_step: int = DEFAULT_X_STEP, y_step: int = DEFAULT_Y_STEP) -> List[str]:
+    """既存の配置を保ったまま、挿入ノードだけを配置し直す
+
+    - 挿入ノードは接続元の右隣（出力番号ごとに1段下）に置く
+      接続元がない場合は anchors で指定したノードの上、それもなければ接続先の左隣
+    - 接続先との間隔が足りない場合は、接続先から下流に到達できるノード
+      （と、それにより重なる右側のノード）だけを右へずらす
+    - それ以外のノード（手動で配置した位置）は動かさない
+    - 位置を持たない既存ノードしかない場合はその挿入ノードを配置しない
+
+    ノード名の索引と空間ハッシュの構築（O(V)）を除き、処理量はずらした部分グラフに比例する。
+    Returns: 位置を変更したノード名（挿入ノード + ずらしたノード）
+    """
+    anchors = anchors or {}
+    nodes = workflow.get('nodes', []) or []
+    connections = workflow.get('connections') or {}
+    # 同名ノードがある場合は後から追加されたもの（直前に挿入したノード）を優先
+    by_name = {node.get('name'): node for node in nodes if isinstance(node, dict)}
+
+    pending = [name for name in dict.fromkeys(inserted) if name in by_name]
+    if not pending:
+        return []
+    unplaced = set(pending)
+
+    # 挿入ノードへの接続元（接続全体を1回だけ走査）
+    incoming: Dict[str, Tuple[str, int]] = {}
+    for source in connections:
+        for target, k in _iter_successors(connections, source):
+            if target in unplaced and target not in incoming and target != source:
+                incoming[target] = (source, k)
+
+    grid = OccupancyGrid()
+    for name, node in by_name.items():
+        if name not in unplaced and _valid_position(node.get('position')):
+            grid.add(name, node['position'])
+
+    moved: Dict[str, None] = {}
+
+    def position_of(name: str):
+        node = by_name.get(name)
+        if node is None or name in unplaced or not _valid_position(node.get('position')):
+            return None
+        return node['position']
+
+    def shift_downstream(start: List[str], delta: int, min_x: float, exclude: set):
+        """startから下流に到達できるノードを右へdeltaずらす（押し出されて重なるノードも連鎖）"""
+        queue = deque(start)
+        shifted = set()
+        while queue:
+            name = queue.popleft()
+            if name in shifted or name in exclude:
+                continue
+            position = position_of(name)
+            if position is None:
+                continue
+            shifted.add(name)
+            grid.remove(name, position)
+            new_position = [position[0] + delta, position[1]] + list(position[2:])
+            by_name[name]['position'] = new_position
+            grid.add(name, new_position)
+            moved[name] = None
+            queue.extend(target for target, _ in _iter_successors(connections, name))
+            for other in grid.collisions(new_position, ignore=name):
+                other_position = position_of(other)
+                if other not in shifted and other_position is not None and other_position[0] >= min_x:
+                    queue.append(other)
+
+    def place(name: str, visiting: set):
+        if name not in unplaced or name in visiting:
+            return
+        visiting.add(name)
+
+        source = incoming.get(name)
+        # 接続元も挿入ノードなら先に配置する
+        if source and source[0] in unplaced:
+            place(source[0], visiting)
+
+        node = by_name[name]
+        successors = [target for target, _ in _iter_successors(connections, name) if target != name]
+        position = None
+        direction = 1
+
+        if source and position_of(source[0]) is not None:
+            anchor = position_of(source[0])
+            position = [anchor[0] + x_step, anchor[1] + source[1] * y_step]
+            # 接続先が近すぎる場合は下流をずらして列を空ける
+            need = max(
+                (position[0] + x_step - position_of(t)[0] for t in successors if position_of(t) is not None),
+                default=0,
+            )
+            if need > 0:
+                shift_downstream(successors, need, position[0], {name, source[0]})
+        elif name in anchors and position_of(anchors[name]) is not None:
+            anchor = position_of(anchors[name])
+            position = [anchor[0], anchor[1] - y_step]
+            direction = -1
+        else:
+            for target in successors:
+                anchor = position_of(target)
+                if anchor is not None:
+                    position = [anchor[0] - x_step, anchor[1]]
+                    break
+
+        unplaced.discard(name)
+        if position is None:
+            # 基準ノードが見つからない場合も、仮の位置があれば重なりだけは解消する
+            if not _valid_position(node.get('position')):
+                return
+            position = list(node['position'])
+
+        while grid.collisions(position, ignore=name):
+            position[1] += direction * y_step
+        node['position'] = position
+        grid.add(name, position)
+        moved[name] = None
+
+    for name in pending:
+        place(name, set())
+
+    return list(moved)
+
+
+# ======================
+# CLI
+# ======================
+
+def main():
+    parser = argparse.ArgumentParser(description='N3 ワークフロー自動レイアウト')
+    subparsers = parser.add_subparsers(dest='command', help='コマンド')
+
+    check_parser = subparsers.add_parser('check', help='ノードの重なり・位置欠落を検出')
+    check_parser.add_argument('directory', help='ワークフローJSONのディレクトリ')
+
+    args = parser.parse_args()
+
+    if args.command == 'check':
+        problems = 0
+        for path in sorted(Path(args.directory).rglob('*.json')):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    workflow = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if not isinstance(workflow, dict) or 'nodes' not in workflow:
+                continue
+            missing = [n.get('name') for n in workflow['nodes'] if not _valid_position(n.get('position'))]
+            overlaps = find_overlaps(workflow)
+            if missing or overlaps:
+                problems += 1
+                print(f'⚠️  {path}: 位置なし {len(missing)} / 重なり {len(overlaps)}')
+        print(f'\n📊 問題のあるワークフロー: {problems}')
+        sys.exit(0 if problems == 0 else 1)
+
+    parser.print_help()
+    sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
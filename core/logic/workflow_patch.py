@@ -0,0 +1,385 @@
+#!/usr/bin/env python3
+"""
+N3 Empire OS - ワークフロー差分パッチエンジン（RFC 6902 JSON Patch）
+=========================================
+Version: 1.0.0
+Purpose: 変換スクリプトのドライラン結果を構造的なJSON Patchとして出力・適用
+
+仕組み:
+- 変換前後のワークフロー（メモリ上のdict）を比較し、RFC 6902のパッチを生成
+  （変換結果の全文は書き出さない）
+- 全ワークフローのパッチを1つのレポートファイルに集約（1件ずつ逐次書き込み）
+- レポートは後から apply で適用でき、変換スクリプトの再実行は不要
+  （入力ファイルのsha256を記録し、入力が変わっていれば適用を拒否）
+
+使用方法:
+  # 各変換スクリプトの --dry-run --patch-report report.json で生成
+  python workflow_patch.py show report.json
+  python workflow_patch.py apply report.json --root /path/to/PRODUCTION
+  python workflow_patch.py apply report.json --root /path/to/PRODUCTION --output-dir /path/to/OUT
+"""
+
+import os
+import sys
+import json
+import copy
+import hashlib
+import argparse
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from atomic_writer import AtomicJsonWriter, encode_json
+
+
+REPORT_FORMAT = 'n3-workflow-patch/1'
+
+
+class PatchError(Exception):
+    """パッチ適用エラー"""
+
+
+# ======================
+# JSON Pointer
+# ======================
+
+def escape_pointer_token(token: Any) -> str:
+    return str(token).replace('~', '~0').replace('/', '~1')
+
+
+def unescape_pointer_token(token: str) -> str:
+    return token.replace('~1', '/').replace('~0', '~')
+
+
+def split_pointer(pointer: str) -> List[str]:
+    if pointer == '':
+        return []
+    if not pointer.startswith('/'):
+        raise PatchError(f'不正なJSON Pointer: {pointer}')
+    return [unescape_pointer_token(t) for t in pointer[1:].split('/')]
+
+
+# ======================
+# 差分生成
+# ======================
+
+def json_equal(a: Any, b: Any) -> bool:
+    """型も含めて等しいか（== は True == 1 や 1 == 1.0 を同値とみなすため）"""
+    if type(a) is not type(b):
+        return False
+    if isinstance(a, dict):
+        return a.keys() == b.keys() and all(json_equal(v, b[k]) for k, v in a.items())
+    if isinstance(a, list):
+        return len(a) == len(b) and all(map(json_equal, a, b))
+    return a == b
+
+
+def diff(before: Any, after: Any, path: str = '') -> List[Dict]:
+    """2つのJSON値の差分をRFC 6902の操作リストとして返す
+
+    子要素は == で省略せず必ず再帰する（[True] == [1] のような型だけの変更も拾う）
+    """
+    if before is after:
+        return []
+
+    if isinstance(before, dict) and isinstance(after, dict):
+        ops: List[Dict] = []
+        for key, value in before.items():
+            child = f'{path}/{escape_pointer_token(key)}'
+            if key not in after:
+                ops.append({'op': 'remove', 'path': child})
+            else:
+                ops.extend(diff(value, after[key], child))
+        for key, value in after.items():
+            if key not in before:
+                ops.append({'op': 'add', 'path': f'{path}/{escape_pointer_token(key)}', 'value': value})
+        return ops
+
+    if isinstance(before, list) and isinstance(after, list):
+        ops = []
+        common = min(len(before), len(after))
+        for i in range(common):
+            ops.extend(diff(before[i], after[i], f'{path}/{i}'))
+        # 末尾への追加（ノード挿入は通常ここ）
+        for value in after[common:]:
+            ops.append({'op': 'add', 'path': f'{path}/-', 'value': value})
+        # 末尾の削除はインデックスがずれないよう後ろから
+        for i in range(len(before) - 1, common - 1, -1):
+            ops.append({'op': 'remove', 'path': f'{path}/{i}'})
+        return ops
+
+    # boolと数値の1/Trueは同値扱いになるため型も比較する
+    if before == after and type(before) is type(after):
+        return []
+    return [{'op': 'replace', 'path': path, 'value': after}]
+
+
+# ======================
+# パッチ適用
+# ======================
+
+def _resolve_parent(doc: Any, tokens: List[str]):
+    target = doc
+    for token in tokens[:-1]:
+        if isinstance(target, list):
+            try:
+                target = target[int(token)]
+            except (ValueError, IndexError):
+                raise PatchError(f'配列インデックスが不正: {token}')
+        elif isinstance(target, dict):
+            if token not in target:
+                raise PatchError(f'キーが存在しません: {token}')
+            target = target[token]
+        else:
+            raise PatchError(f'パスを辿れません: {token}')
+    return target
+
+
+def _list_index(container: List, token: str, allow_end: bool) -> int:
+    if token == '-' and allow_end:
+        return len(container)
+    try:
+        index = int(token)
+    except ValueError:
+        raise PatchError(f'配列インデックスが不正: {token}')
+    limit = len(container) if allow_end else len(container) - 1
+    if index < 0 or index > limit:
+        raise PatchError(f'配列インデックスが範囲外: {token}')
+    return index
+
+
+def _get(doc: Any, pointer: str) -> Any:
+    tokens = split_pointer(pointer)
+    if not tokens:
+        return doc
+    parent = _resolve_parent(doc, tokens)
+    last = tokens[-1]
+    if isinstance(parent, list):
+        return parent[_list_index(parent, last, allow_end=False)]
+    if isinstance(parent, dict) and last in parent:
+        return parent[last]
+    raise PatchError(f'値が存在しません: {pointer}')
+
+
+def apply_operation(doc: Any, op: Dict) -> Any:
+    """1操作を適用（ルートの置換時は新しい値を返す）"""
+    kind = op.get('op')
+    pointer = op.get('path', '')
+    tokens = split_pointer(pointer)
+
+    if kind == 'test':
+        if not json_equal(_get(doc, pointer), op.get('value')):
+            raise PatchError(f'testに失敗: {pointer}')
+        return doc
+
+    if kind in ('move', 'copy'):
+        value = copy.deepcopy(_get(doc, op['from']))
+        if kind == 'move':
+            doc = apply_operation(doc, {'op': 'remove', 'path': op['from']})
+        return apply_operation(doc, {'op': 'add', 'path': pointer, 'value': value})
+
+    if not tokens:
+        if kind in ('add', 'replace'):
+            return copy.deepcopy(op['value'])
+        raise PatchError('ルートは削除できません')
+
+    parent = _resolve_parent(doc, tokens)
+    last = tokens[-1]
+
+    if kind == 'add':
+        value = copy.deepcopy(op['value'])
+        if isinstance(parent, list):
+            parent.insert(_list_index(parent, last, allow_end=True), value)
+        elif isinstance(parent, dict):
+            parent[last] = value
+        else:
+            raise PatchError(f'追加先が不正: {pointer}')
+    elif kind == 'remove':
+        if isinstance(parent, list):
+            del parent[_list_index(parent, last, allow_end=False)]
+        elif isinstance(parent, dict) and last in parent:
+            del parent[last]
+        else:
+            raise PatchError(f'削除対象が存在しません: {pointer}')
+    elif kind == 'replace':
+        value = copy.deepcopy(op['value'])
+        if isinstance(parent, list):
+            parent[_list_index(parent, last, allow_end=False)] = value
+        elif isinstance(parent, dict) and last in parent:
+            parent[last] = value
+        else:
+            raise PatchError(f'置換対象が存在しません: {pointer}')
+    else:
+        raise PatchError(f'未対応の操作: {kind}')
+
+    return doc
+
+
+def apply_patch(doc: Any, ops: List[Dict]) -> Any:
+    """パッチを適用した新しいドキュメントを返す（元のdocは変更しない）"""
+    result = copy.deepcopy(doc)
+    for op in ops:
+        try:
+            result = apply_operation(result, op)
+        except (KeyError, IndexError, TypeError, AttributeError) as e:
+            # 必須キー（value / from）の欠けた操作や、操作がdictでない古い・壊れたレポート
+            raise PatchError(f'不正な操作: {op!r} ({type(e).__name__}: {e})') from e
+    return result
+
+
+# ======================
+# レポート
+# ======================
+
+def file_sha256(path: str) -> str:
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+class PatchReport:
+    """ワークフローごとのパッチを1ファイルへ逐次集約するレポート"""
+
+    def __init__(self, report_path: str, tool: str, root: Optional[str] = None):
+        self.report_path = report_path
+        self.root = root
+        self.summary = {'workflows': 0, 'changed': 0, 'operations': 0}
+
+        os.makedirs(os.path.dirname(report_path) or '.', exist_ok=True)
+        self._f = open(report_path, 'w', encoding='utf-8')
+        header = {
+            'format': REPORT_FORMAT,
+            'tool': tool,
+            'root': os.path.abspath(root) if root else None,
+            'generated_at': datetime.now(timezone.utc).isoformat(),
+        }
+        # 先頭にヘッダー、続けてworkflows配列を1件ずつ書き込む
+        self._f.write(json.dumps(header, ensure_ascii=False, indent=2)[:-2] + ',\n  "workflows": [')
+        self._first = True
+
+    def __enter__(self) -> 'PatchReport':
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def add(self, input_path: str, before: Dict, after: Dict, output_path: Optional[str] = None) -> List[Dict]:
+        """変換前後の差分をパッチとして記録"""
+        return self.add_patch(input_path, diff(before, after), output_path)
+
+    def add_patch(self, input_path: str, ops: List[Dict], output_path: Optional[str] = None) -> List[Dict]:
+        """算出済みのパッチを記録（差分計算をワーカープロセス側で行う場合）"""
+        self.summary['workflows'] += 1
+        if not ops:
+            return ops
+
+        self.summary['changed'] += 1
+        self.summary['operations'] += len(ops)
+
+        file_name = os.path.relpath(input_path, self.root) if self.root else input_path
+        entry = {
+            'file': Path(file_name).as_posix(),
+            'base_sha256': file_sha256(input_path),
+            'operations': len(ops),
+            'patch': ops,
+        }
+        if output_path:
+            entry['output'] = Path(output_path).as_posix()
+
+        self._f.write(('\n' if self._first else ',\n') + encode_json(entry).decode('utf-8'))
+        self._first = False
+        return ops
+
+    def close(self):
+        if self._f.closed:
+            return
+        self._f.write('\n  ],\n  "summary": ' + json.dumps(self.summary) + '\n}\n')
+        self._f.close()
+
+
+def load_report(report_path: str) -> Dict:
+    with open(report_path, 'r', encoding='utf-8') as f:
+        report = json.load(f)
+    if report.get('format') != REPORT_FORMAT:
+        raise PatchError(f'未対応のレポート形式: {report.get("format")}')
+    return report
+
+
+def apply_report(report_path: str, root: Optional[str] = None, output_dir: Optional[str] = None,
+                 force: bool = False) -> Dict:
+    """レポート内の全パッチを適用（出力先はoutput_dir、未指定なら入力を上書き）"""
+    report = load_report(report_path)
+    root = root or report.get('root') or '.'
+    results = {'applied': 0, 'failed': 0, 'errors': []}
+
+    with AtomicJsonWriter() as writer:
+        for entry in report['workflows']:
+            try:
+                missing = [k for k in ('file', 'base_sha256', 'patch') if k not in entry]
+                if missing:
+                    raise PatchError(f'レポートの項目が不足しています: {", ".join(missing)}')
+                source = os.path.join(root, entry['file'])
+                if not force and file_sha256(source) != entry['base_sha256']:
+                    raise PatchError('入力ファイルがパッチ生成時から変更されています（--forceで強行）')
+
+                with open(source, 'r', encoding='utf-8') as f:
+                    workflow = json.load(f)
+
+                patched = apply_patch(workflow, entry['patch'])
+
+                if output_dir:
+                    # 相対パスは入力に合わせ、ファイル名は記録された出力名（_V8-ARMORED等）を使う
+                    name = os.path.basename(entry.get('output') or entry['file'])
+                    target = os.path.join(output_dir, os.path.dirname(entry['file']), name)
+                else:
+                    target = entry.get('output') or source
+                writer.write_json(target, patched)
+                results['applied'] += 1
+            except (OSError, ValueError, PatchError) as e:
+                results['failed'] += 1
+                results['errors'].append({'file': entry.get('file', '?'), 'error': str(e)})
+
+    return results
+
+
+# ======================
+# CLI
+# ======================
+
+def main():
+    parser = argparse.ArgumentParser(description='N3 ワークフローJSON Patchツール')
+    subparsers = parser.add_subparsers(dest='command', help='コマンド')
+
+    show_parser = subparsers.add_parser('show', help='レポートの概要を表示')
+    show_parser.add_argument('report', help='パッチレポート')
+
+    apply_parser = subparsers.add_parser('apply', help='パッチを適用')
+    apply_parser.add_argument('report', help='パッチレポート')
+    apply_parser.add_argument('--root', help='入力ルート（省略時はレポート記録値）')
+    apply_parser.add_argument('--output-dir', help='出力ディレクトリ（省略時は記録された出力先 or 上書き）')
+    apply_parser.add_argument('--force', action='store_true', help='入力のハッシュ不一致を無視')
+
+    args = parser.parse_args()
+
+    if args.command == 'show':
+        report = load_report(args.report)
+        print(f'ツール: {report["tool"]}')
+        print(f'生成日時: {report["generated_at"]}')
+        print(f'対象: {report["summary"]["workflows"]} / 変更: {report["summary"]["changed"]} / 操作: {report["summary"]["operations"]}')
+        for entry in report['workflows']:
+            print(f'  {entry["file"]}: {entry["operations"]} ops')
+
+    elif args.command == 'apply':
+        results = apply_report(args.report, args.root, args.output_dir, args.force)
+        print(f'✅ 適用: {results["applied"]} ファイル')
+        print(f'❌ 失敗: {results["failed"]} ファイル')
+        for err in results['errors']:
+            print(f'  - {err["file"]}: {err["error"]}')
+        sys.exit(0 if results['failed'] == 0 else 1)
+
+    else:
+        parser.print_help()
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
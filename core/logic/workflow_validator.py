@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""
+N3 Empire OS - n8nワークフロー検証エンジン
+=========================================
+Version: 1.0.0
+Purpose: n8n-workflows配下のJSONを高速に一括検証
+
+検証内容:
+1. JSON構文（orjson + mmap、未インストール時は標準json）
+2. n8n構造チェック
+   - ノード名の重複
+   - 存在しないノードへの接続（ダングリング接続）
+   - position / id フィールドの欠落
+
+使用方法:
+  python workflow_validator.py /path/to/n8n-workflows
+  python workflow_validator.py /path/to/n8n-workflows --report report.json
+"""
+
+import os
+import sys
+import json
+import mmap
+import time
+import argparse
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - 標準jsonにフォールバック
+    orjson = None
+
+
+# ======================
+# 検証設定
+# ======================
+
+# 問題の重要度（errorは終了コードに影響、warningは--strict時のみ）
+SEVERITY_ERROR = 'error'
+SEVERITY_WARNING = 'warning'
+
+ISSUE_SEVERITY = {
+    'DUPLICATE_NODE_NAME': SEVERITY_ERROR,
+    'DANGLING_CONNECTION': SEVERITY_ERROR,
+    'UNKNOWN_CONNECTION_SOURCE': SEVERITY_ERROR,
+    'MISSING_NODE_ID': SEVERITY_WARNING,
+    'MISSING_POSITION': SEVERITY_WARNING,
+}
+
+DEFAULT_WORKERS = min(32, (os.cpu_count() or 1) * 4)
+
+
+# ======================
+# 読み込み
+# ======================
+
+def load_json_bytes(path: Path) -> Any:
+    """ファイルをmmapして高速パーサーで読み込む"""
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            # 空ファイルはmmapできないため、パーサーに空入力を渡してエラーにする
+            data = b''
+            return orjson.loads(data) if orjson else json.loads(data)
+
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if orjson:
+                return orjson.loads(memoryview(mm))
+            return json.loads(mm[:].decode('utf-8'))
+
+
+# ======================
+# 構造チェック
+# ======================
+
+def _issue(code: str, message: str, node: Optional[str] = None) -> Dict:
+    issue = {'code': code, 'severity': ISSUE_SEVERITY[code], 'message': message}
+    if node is not None:
+        issue['node'] = node
+    return issue
+
+
+def check_workflow_structure(workflow: Dict) -> List[Dict]:
+    """n8nワークフローの構造を検証して問題リストを返す"""
+    issues = []
+    nodes = workflow.get('nodes') or []
+    connections = workflow.get('connections') or {}
+
+    names = set()
+    for node in nodes:
+        if not isinstance(node, dict):
+            continue
+        name = node.get('name')
+
+        if name in names:
+            issues.append(_issue('DUPLICATE_NODE_NAME', f'ノード名が重複: {name}', name))
+        names.add(name)
+
+        if not node.get('id'):
+            issues.append(_issue('MISSING_NODE_ID', 'idフィールドがありません', name))
+
+        position = node.get('position')
+        if not (isinstance(position, list) and len(position) == 2):
+            issues.append(_issue('MISSING_POSITION', 'positionフィールドがありません', name))
+
+    if not isinstance(connections, dict):
+        return issues
+
+    for source, outputs in connections.items():
+        if source not in names:
+            issues.append(_issue('UNKNOWN_CONNECTION_SOURCE', f'接続元ノードが存在しません: {source}', source))
+
+        if not isinstance(outputs, dict):
+            continue
+
+        for branches in outputs.values():
+            for branch in branches or []:
+                for conn in branch or []:
+                    target = conn.get('node') if isinstance(conn, dict) else None
+                    if target not in names:
+                        issues.append(_issue(
+                            'DANGLING_CONNECTION',
+                            f'接続先ノードが存在しません: {source} → {target}',
+                            source,
+                        ))
+
+    return issues
+
+
+def validate_file(path: Path) -> Dict:
+    """単一ファイルの構文・構造検証"""
+    result = {
+        'file': str(path),
+        'valid': True,
+        'kind': 'json',
+        'issues': [],
+    }
+
+    try:
+        data = load_json_bytes(path)
+    except (ValueError, UnicodeDecodeError) as e:
+        # orjson.JSONDecodeError / json.JSONDecodeError はどちらもValueErrorのサブクラス
+        result['valid'] = False
+        result['error'] = str(e)
+        return result
+    except OSError as e:
+        result['valid'] = False
+        result['error'] = f'読み込みエラー: {e}'
+        return result
+
+    if isinstance(data, dict) and isinstance(data.get('nodes'), list):
+        result['kind'] = 'workflow'
+        result['node_count'] = len(data['nodes'])
+        result['issues'] = check_workflow_structure(data)
+
+    return result
+
+
+# ======================
+# 一括検証
+# ======================
+
+def validate_tree(directory: str, workers: int = DEFAULT_WORKERS) -> Dict:
+    """ディレクトリ配下の全JSONをスレッドプールで並列検証"""
+    started = time.perf_counter()
+    json_files = sorted(Path(directory).rglob('*.json'))
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        files = list(executor.map(validate_file, json_files))
+
+    report = {
+        'total': len(files),
+        'valid': 0,
+        'invalid': 0,
+        'workflows': 0,
+        'structure_errors': 0,
+        'structure_warnings': 0,
+        'errors': [],
+        'files': [],
+    }
+
+    for result in files:
+        if result['valid']:
+            report['valid'] += 1
+        else:
+            report['invalid'] += 1
+            report['errors'].append({'file': result['file'], 'error': result['error']})
+
+        if result['kind'] == 'workflow':
+            report['workflows'] += 1
+
+        for issue in result['issues']:
+            if issue['severity'] == SEVERITY_ERROR:
+                report['structure_errors'] += 1
+            else:
+                report['structure_warnings'] += 1
+
+        # レポートには問題のあるファイルのみ残す
+        if not result['valid'] or result['issues']:
+            report['files'].append(result)
+
+    report['elapsed_ms'] = round((time.perf_counter() - started) * 1000, 1)
+    return report
+
+
+def write_report(report: Dict, report_path: str):
+    """機械可読レポートをJSONで保存"""
+    os.makedirs(os.path.dirname(report_path) or '.', exist_ok=True)
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+def print_summary(report: Dict):
+    """検証結果サマリーを表示"""
+    print('\n' + '=' * 50)
+    print('📊 検証結果')
+    print('=' * 50)
+    print(f'  合計: {report["total"]} ファイル（ワークフロー: {report["workflows"]}）')
+    print(f'  有効: {report["valid"]} ファイル')
+    print(f'  無効: {report["invalid"]} ファイル')
+    print(f'  構造エラー: {report["structure_errors"]} 件')
+    print(f'  構造警告: {report["structure_warnings"]} 件')
+    print(f'  処理時間: {report["elapsed_ms"]} ms')
+
+    if report['errors']:
+        print('\n❌ 無効なファイル:')
+        for err in report['errors']:
+            print(f'  - {err["file"]}')
+            print(f'    エラー: {err["error"]}')
+
+    structural = [
+        f for f in report['files']
+        if any(i['severity'] == SEVERITY_ERROR for i in f['issues'])
+    ]
+    if structural:
+        print('\n⚠️  構造エラーのあるワークフロー:')
+        for f in structural:
+            print(f'  - {f["file"]}')
+            for issue in f['issues']:
+                if issue['severity'] == SEVERITY_ERROR:
+                    print(f'    [{issue["code"]}] {issue["message"]}')
+
+
+def exit_code(report: Dict, strict: bool = False) -> int:
+    """検証結果から終了コードを決定"""
+    if report['invalid'] or report['structure_errors']:
+        return 1
+    if strict and report['structure_warnings']:
+        return 1
+    return 0
+
+
+# ======================
+# CLI
+# ======================
+
+def main():
+    parser = argparse.ArgumentParser(description='N3 n8nワークフロー検証エンジン')
+    parser.add_argument('directory', help='検証対象ディレクトリ')
+    parser.add_argument('--report', help='JSONレポート出力先')
+    parser.add_argument('--json', action='store_true', help='レポートをJSONで標準出力')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='並列スレッド数')
+    parser.add_argument('--strict', action='store_true', help='警告も失敗扱いにする')
+    args = parser.parse_args()
+
+    report = validate_tree(args.directory, workers=args.workers)
+
+    if args.report:
+        write_report(report, args.report)
+
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print_summary(report)
+        if args.report:
+            print(f'\n📝 レポート: {args.report}')
+
+    sys.exit(exit_code(report, args.strict))
+
+
+if __name__ == '__main__':
+    main()
@@ -6,10 +6,18 @@ N3 Empire OS V8.3 - 140ワークフロー一括変換スクリプト（完全版
 python3 n3_v83_transform.py --input-dir ./PRODUCTION --output-dir ./PRODUCTION_V83
 """
 
-import json, os, re, copy, csv, uuid, argparse
+import json, sys, copy, csv, uuid, argparse
 from datetime import datetime
 from pathlib import Path
 
+# 共通Pythonモジュール（core/logic）を参照
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / 'core' / 'logic'))
+
+from atomic_writer import AtomicJsonWriter
+from workflow_patch import PatchReport
+from sql_table_rewriter import TableRewriter
+from workflow_layout import relayout_inserted
+
 # テーブル名マッピング
 TABLE_MAP = {
     "products_master": "n3_products_master",
@@ -25,17 +33,13 @@ TABLE_MAP = {
     "job_queue": "n3_job_queue", "api_health": "n3_api_health",
     "budget_tracker": "n3_budget_tracker",
 }
+TABLE_REWRITER = TableRewriter(TABLE_MAP)
 
 def gen_id(): return f"n3_core_{uuid.uuid4().hex[:8]}"
 
 def transform_sql(sql):
-    t, c = sql, 0
-    for old, new in TABLE_MAP.items():
-        if old.startswith('n3_'): continue
-        for p in [rf'\bFROM\s+{old}\b', rf'\bINTO\s+{old}\b', rf'\bUPDATE\s+{old}\b', rf'\bJOIN\s+{old}\b']:
-            nt = re.sub(p, p.replace(old, new).replace(r'\b',''), t, flags=re.IGNORECASE)
-            if nt != t: c += 1; t = nt
-    return t, c
+    # 1パス字句解析でテーブル参照のみ置換（文字列リテラル・コメントは対象外）
+    return TABLE_REWRITER.rewrite(sql)
 
 def transform_workflow(wf, path, out_dir):
     result = {"path": path, "name": wf.get("name",""), "changed": False, "changes": []}
@@ -58,14 +62,17 @@ def transform_workflow(wf, path, out_dir):
             orig = conns.get(wh_name, {}).get("main", [[]])
             conns[wh_name] = {"main": [[{"node": disp["name"], "type": "main", "index": 0}]]}
             if orig and orig[0]: conns[disp["name"]] = {"main": [orig[0]]}
+            relayout_inserted(tw, [disp["name"]])  # 重なる下流ノードだけ右へずらす
             result["changes"].append(f"Inserted CORE-Dispatcher after {wh_name}")
     
     # テーブル名変換
     for n in nodes:
         p = n.get("parameters", {})
         if "query" in p:
-            nq, c = transform_sql(p["query"])
-            if c > 0: p["query"] = nq; result["changes"].append(f"SQL: {c} tables")
+            nq, rws = transform_sql(p["query"])
+            if rws:
+                p["query"] = nq
+                result["changes"].extend(f"SQL: {rw.old} → {rw.new} @{rw.line}:{rw.column}" for rw in rws)
         for k in ["tableId", "table"]:
             if k in p and p[k] in TABLE_MAP:
                 result["changes"].append(f"{p[k]} → {TABLE_MAP[p[k]]}")
@@ -83,6 +90,7 @@ def main():
     p.add_argument('--input-dir', required=True)
     p.add_argument('--output-dir')
     p.add_argument('--dry-run', action='store_true')
+    p.add_argument('--patch-report', help='JSON Patch report (RFC 6902)')
     args = p.parse_args()
     
     in_dir, out_dir = Path(args.input_dir), Path(args.output_dir or args.input_dir + "_V83")
@@ -91,22 +99,27 @@ def main():
     print(f"\n{'='*50}\nN3 V8.3 Transformer\n{'='*50}")
     print(f"Input: {in_dir}\nOutput: {out_dir}\nMode: {'DRY RUN' if args.dry_run else 'EXECUTE'}\n")
     
-    for f in in_dir.rglob("*.json"):
-        try:
-            wf = json.loads(f.read_text(encoding='utf-8'))
-            if "nodes" not in wf: continue
-            tw, r = transform_workflow(wf, str(f), out_dir)
-            results.append(r)
-            print(f"{'✓' if r['changed'] else '-'} {r['name']}")
-            for c in r['changes'][:2]: print(f"    └─ {c}")
-            if not args.dry_run and r['changed']:
-                op = out_dir / f.relative_to(in_dir)
-                op.parent.mkdir(parents=True, exist_ok=True)
-                op.write_text(json.dumps(tw, indent=2, ensure_ascii=False), encoding='utf-8')
-        except Exception as e: print(f"✗ {f.name}: {e}")
+    patch_report = PatchReport(args.patch_report, 'n3_v83_transform', root=str(in_dir)) if args.patch_report else None
+    
+    with AtomicJsonWriter() as writer:
+        for f in in_dir.rglob("*.json"):
+            try:
+                wf = json.loads(f.read_text(encoding='utf-8'))
+                if "nodes" not in wf: continue
+                tw, r = transform_workflow(wf, str(f), out_dir)
+                results.append(r)
+                print(f"{'✓' if r['changed'] else '-'} {r['name']}")
+                for c in r['changes'][:2]: print(f"    └─ {c}")
+                if patch_report and r['changed']: patch_report.add(str(f), wf, tw, str(out_dir / f.relative_to(in_dir)))
+                if not args.dry_run and r['changed']:
+                    writer.write_json(out_dir / f.relative_to(in_dir), tw)
+            except Exception as e: print(f"✗ {f.name}: {e}")
     
     changed = sum(1 for r in results if r['changed'])
     print(f"\n{'='*50}\nTotal: {len(results)} | Changed: {changed}\n{'='*50}")
+    if patch_report:
+        patch_report.close()
+        print(f"Patch report: {args.patch_report} ({patch_report.summary['operations']} ops)")
     
     # CSV出力
     csv_path = f"n3_v83_mapping_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
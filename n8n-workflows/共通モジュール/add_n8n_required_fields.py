@@ -6,6 +6,7 @@ n8n必須フィールド追加スクリプト
 - createdAt/updatedAt: タイムスタンプ
 """
 
+import copy
 import json
 import os
 import sys
@@ -13,7 +14,14 @@ import uuid
 from datetime import datetime
 from pathlib import Path
 
-def add_required_fields(input_dir: str, output_dir: str = None, dry_run: bool = False):
+# 共通Pythonモジュール（core/logic）を参照
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / 'core' / 'logic'))
+
+from atomic_writer import AtomicJsonWriter
+from workflow_patch import PatchReport
+
+def add_required_fields(input_dir: str, output_dir: str = None, dry_run: bool = False,
+                        patch_report_path: str = None):
     """必須フィールドを追加"""
     
     input_path = Path(input_dir)
@@ -35,78 +43,87 @@ def add_required_fields(input_dir: str, output_dir: str = None, dry_run: bool =
     processed = 0
     errors = 0
     
-    for json_file in json_files:
-        rel_path = json_file.relative_to(input_path)
-        output_file = output_path / rel_path
-        
-        try:
-            with open(json_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-            
-            # ワークフローJSONかどうか確認
-            if 'nodes' not in data:
-                print(f"⏭️  スキップ（ワークフローではない）: {rel_path}")
-                continue
-            
-            changes = []
-            
-            # versionId追加
-            if 'versionId' not in data or not data['versionId']:
-                data['versionId'] = str(uuid.uuid4())
-                changes.append('versionId追加')
-            
-            # active追加
-            if 'active' not in data:
-                data['active'] = False
-                changes.append('active追加')
-            
-            # createdAt追加
-            if 'createdAt' not in data:
-                data['createdAt'] = datetime.utcnow().isoformat() + 'Z'
-                changes.append('createdAt追加')
-            
-            # updatedAt追加
-            if 'updatedAt' not in data:
-                data['updatedAt'] = datetime.utcnow().isoformat() + 'Z'
-                changes.append('updatedAt追加')
-            
-            # id追加（文字列形式）
-            if 'id' not in data:
-                # 短いIDを生成
-                data['id'] = str(uuid.uuid4())[:8]
-                changes.append('id追加')
+    # 変更内容をJSON Patchとして記録（ドライランでも生成）
+    patch_report = PatchReport(patch_report_path, Path(__file__).stem, root=str(input_path)) if patch_report_path else None
+    
+    with AtomicJsonWriter() as writer:
+        for json_file in json_files:
+            rel_path = json_file.relative_to(input_path)
+            output_file = output_path / rel_path
             
-            if changes:
-                print(f"✅ {rel_path}")
-                print(f"   変更: {', '.join(changes)}")
+            try:
+                with open(json_file, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
                 
-                if not dry_run:
-                    # 出力ディレクトリ構造を作成
-                    output_file.parent.mkdir(parents=True, exist_ok=True)
-                    
-                    with open(output_file, 'w', encoding='utf-8') as f:
-                        json.dump(data, f, ensure_ascii=False, indent=2)
+                # ワークフローJSONかどうか確認
+                if 'nodes' not in data:
+                    print(f"⏭️  スキップ（ワークフローではない）: {rel_path}")
+                    continue
+                
+                # 差分生成用に変更前の状態を保持
+                original = copy.deepcopy(data) if patch_report else None
                 
-                processed += 1
-            else:
-                print(f"⏭️  変更なし: {rel_path}")
+                changes = []
                 
-                # 変更なくてもコピー
-                if not dry_run and output_dir:
-                    output_file.parent.mkdir(parents=True, exist_ok=True)
-                    with open(output_file, 'w', encoding='utf-8') as f:
-                        json.dump(data, f, ensure_ascii=False, indent=2)
-        
-        except json.JSONDecodeError as e:
-            print(f"❌ JSONパースエラー: {rel_path} - {e}")
-            errors += 1
-        except Exception as e:
-            print(f"❌ エラー: {rel_path} - {e}")
-            errors += 1
+                # versionId追加
+                if 'versionId' not in data or not data['versionId']:
+                    data['versionId'] = str(uuid.uuid4())
+                    changes.append('versionId追加')
+                
+                # active追加
+                if 'active' not in data:
+                    data['active'] = False
+                    changes.append('active追加')
+                
+                # createdAt追加
+                if 'createdAt' not in data:
+                    data['createdAt'] = datetime.utcnow().isoformat() + 'Z'
+                    changes.append('createdAt追加')
+                
+                # updatedAt追加
+                if 'updatedAt' not in data:
+                    data['updatedAt'] = datetime.utcnow().isoformat() + 'Z'
+                    changes.append('updatedAt追加')
+                
+                # id追加（文字列形式）
+                if 'id' not in data:
+                    # 短いIDを生成
+                    data['id'] = str(uuid.uuid4())[:8]
+                    changes.append('id追加')
+                
+                if changes:
+                    if patch_report:
+                        patch_report.add(str(json_file), original, data, str(output_file))
+                    
+                    print(f"✅ {rel_path}")
+                    print(f"   変更: {', '.join(changes)}")
+                    
+                    if not dry_run:
+                        # 一時ファイル経由でアトミックに書き込み（出力ディレクトリも作成）
+                        writer.write_json(output_file, data)
+                    
+                    processed += 1
+                else:
+                    print(f"⏭️  変更なし: {rel_path}")
+                    
+                    # 変更なくてもコピー
+                    if not dry_run and output_dir:
+                        writer.write_json(output_file, data)
+            
+            except json.JSONDecodeError as e:
+                print(f"❌ JSONパースエラー: {rel_path} - {e}")
+                errors += 1
+            except Exception as e:
+                print(f"❌ エラー: {rel_path} - {e}")
+                errors += 1
     
     print("=" * 60)
     print(f"📊 処理完了: {processed} 件変更, {errors} 件エラー")
     
+    if patch_report:
+        patch_report.close()
+        print(f"📝 パッチレポート: {patch_report_path}（{patch_report.summary['operations']} 操作）")
+    
     if dry_run:
         print("⚠️  ドライラン: 実際のファイルは変更されていません")
 
@@ -117,7 +134,8 @@ if __name__ == "__main__":
     parser.add_argument('--input-dir', '-i', required=True, help='入力ディレクトリ')
     parser.add_argument('--output-dir', '-o', help='出力ディレクトリ（省略時は上書き）')
     parser.add_argument('--dry-run', '-d', action='store_true', help='ドライラン')
+    parser.add_argument('--patch-report', help='JSON Patchレポート出力先（RFC 6902）')
     
     args = parser.parse_args()
     
-    add_required_fields(args.input_dir, args.output_dir, args.dry_run)
+    add_required_fields(args.input_dir, args.output_dir, args.dry_run, args.patch_report)
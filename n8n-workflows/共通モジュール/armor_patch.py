@@ -6,16 +6,148 @@ Auth-Gate / Burn-Limit / AI-Decision-Trace を既存ワークフローに注入
 
 import json
 import os
+import sys
 import copy
+import time
+import heapq
 import hashlib
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
 from datetime import datetime
-from typing import Dict, List, Any, Optional
+from pathlib import Path
+from typing import Dict, List, Any, Iterator, Optional, Tuple
+
+# 共通Pythonモジュール（core/logic）を参照
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / 'core' / 'logic'))
+
+from atomic_writer import AtomicJsonWriter, write_json_atomic
+from keyword_matcher import KeywordMatcher
+from workflow_patch import PatchReport, diff
+from workflow_layout import relayout_inserted
+
+# =====================================
+# 監査ログ・トレースの書き込みノード
+# =====================================
+#
+# 1実行のアイテムをまとめて1回で書き込む（executeOnce）。値はSQLに埋め込まず、
+# 行配列をJSONの1パラメータ（$1）として渡し jsonb_to_recordset で展開する
+#   postgres: 複数行INSERTを直接実行
+#   api:      価格計算APIの /traces へ送信（件数・時間窓で実行をまたいでまとめて書き込む）
+#
+# 価格計算APIへの送信は他の生成ノードと同じHMAC署名（x-n3-signature / x-n3-timestamp）を付ける。
+# REQUIRE_SIGNATURE=true の本番では未署名のリクエストが 401 になるため
+
+TRACE_SINKS = ('postgres', 'api')
+
+# Codeノードに埋め込む署名付きPOST（HMAC-SHA256(N3_HMAC_SECRET, "<timestamp>.<body>")、pricing_engine と同じ方式）
+SIGNED_POST_JS = '''const signedPost = async (path, payload, timeout) => {
+  const body = JSON.stringify(payload);
+  const headers = { 'Content-Type': 'application/json' };
+  const secret = $env.N3_HMAC_SECRET;
+  if (secret) {
+    const timestamp = String(Math.floor(Date.now() / 1000));
+    headers['x-n3-timestamp'] = timestamp;
+    headers['x-n3-signature'] = require('crypto').createHmac('sha256', secret).update(`${timestamp}.${body}`).digest('hex');
+  }
+  const baseUrl = $env.PRICING_ENGINE_URL || 'http://localhost:8000';
+  const response = await this.helpers.httpRequest({ method: 'POST', url: `${baseUrl}${path}`, headers, body, timeout });
+  return typeof response === 'string' ? JSON.parse(response) : response;
+};
+// 401/403 は署名・秘密鍵の設定不備（一時的な障害ではないため握りつぶさない）
+const isAuthError = (error) => [401, 403].includes(Number(error.httpCode || error.statusCode || error.response?.status));'''
+
+# (列名, 型) — 行配列のキーと jsonb_to_recordset の列定義
+AUDIT_LOG_COLUMNS = [
+    ('tenant_id', 'text'), ('workflow_name', 'text'), ('request_id', 'text'), ('action', 'text'),
+    ('payload_masked', 'jsonb'), ('risk_level', 'text'), ('status', 'text'),
+    ('error_message', 'text'), ('metadata', 'jsonb'),
+]
+AUDIT_LOG_ROWS_JS = (
+    "$input.all().map(item => item.json).map(j => ({ "
+    "tenant_id: j.tenantId, workflow_name: j.workflowName, request_id: j.requestId, "
+    "action: 'auth_gate_blocked', payload_masked: { source_ip: j.sourceIp, reason: j.reason }, "
+    "risk_level: 'HIGH', status: 'error', error_message: 'Authentication failed: ' + j.reason, "
+    "metadata: { validated_at: j.validatedAt } }))"
+)
+
+AI_TRACE_COLUMNS = [
+    ('tenant_id', 'text'), ('workflow_name', 'text'), ('request_id', 'text'), ('node_name', 'text'),
+    ('ai_provider', 'text'), ('model_name', 'text'), ('input_summary', 'text'), ('output_summary', 'text'),
+    ('reasoning', 'text'), ('tokens_used', 'integer'), ('created_at', 'timestamptz'),
+]
+AI_TRACE_ROWS_JS = (
+    "$input.all().map(item => item.json._aiTrace).filter(Boolean).map(t => ({ "
+    "tenant_id: t.tenantId, workflow_name: t.workflowName, request_id: t.requestId, node_name: t.nodeName, "
+    "ai_provider: t.aiProvider, model_name: t.modelName, input_summary: t.inputSummary, "
+    "output_summary: t.outputSummary, reasoning: t.reasoning, tokens_used: t.tokensUsed, created_at: t.tracedAt }))"
+)
+
+
+def recordset_insert_sql(table: str, columns: List[tuple]) -> str:
+    """行配列（$1 = JSON）を1回の複数行INSERTで書き込むSQL"""
+    names = ', '.join(name for name, _ in columns)
+    values = ', '.join('COALESCE(created_at, NOW())' if name == 'created_at' else name for name, _ in columns)
+    definition = ', '.join(f"{name} {sql_type}" for name, sql_type in columns)
+    return (
+        f"INSERT INTO {table} ({names})\n"
+        f"SELECT {values}\n"
+        f"FROM jsonb_to_recordset($1::jsonb) AS t({definition});"
+    )
+
+
+def create_batch_writer_node(name: str, node_id: str, position: List[int], table: str,
+                             columns: List[tuple], rows_js: str, trace_sink: str = 'postgres') -> Dict:
+    """実行内の全アイテムを1回で書き込むノード"""
+    if trace_sink == 'api':
+        return {
+            "parameters": {
+                "jsCode": f'''// {table} → 価格計算API /traces（署名付き）
+{SIGNED_POST_JS}
+
+const rows = {rows_js};
+if (rows.length) {{
+  try {{
+    await signedPost('/traces', {{ table: '{table}', rows }}, 5000);
+  }} catch (error) {{
+    if (isAuthError(error)) {{
+      throw new Error(`/traces の認証に失敗（N3_HMAC_SECRET を確認）: ${{error.message}}`);
+    }}
+    // 一時的な送信失敗で本処理を止めない
+    console.error(`/traces への送信に失敗（{table} ${{rows.length}}件）: ${{error.message}}`);
+  }}
+}}
+return [{{ json: {{ table: '{table}', rows: rows.length }} }}];'''
+            },
+            "id": node_id,
+            "name": name,
+            "type": "n8n-nodes-base.code",
+            "typeVersion": 2,
+            "position": position,
+            "executeOnce": True
+        }
+    return {
+        "parameters": {
+            "operation": "executeQuery",
+            "query": recordset_insert_sql(table, columns),
+            "options": {"queryReplacement": f"={{{{ [JSON.stringify({rows_js})] }}}}"}
+        },
+        "id": node_id,
+        "name": name,
+        "type": "n8n-nodes-base.postgres",
+        "typeVersion": 2.5,
+        "position": position,
+        "executeOnce": True,
+        "credentials": {
+            "postgres": {"id": "supabase-postgres", "name": "Supabase PostgreSQL"}
+        }
+    }
+
 
 # =====================================
 # 装甲パッチノード定義
 # =====================================
 
-def create_auth_gate_nodes(workflow_name: str, start_position: List[int] = [100, 300]) -> List[Dict]:
+def create_auth_gate_nodes(workflow_name: str, start_position: List[int] = [100, 300],
+                           trace_sink: str = 'postgres') -> List[Dict]:
     """Auth-Gate検証ノードを生成"""
     return [
         {
@@ -108,34 +240,12 @@ return {{ json: authResult }};'''
             "typeVersion": 2,
             "position": [start_position[0] + 200, start_position[1]]
         },
-        {
-            "parameters": {
-                "operation": "executeQuery",
-                "query": """INSERT INTO audit_logs (
-  tenant_id, workflow_name, request_id, action,
-  payload_masked, risk_level, status, error_message, metadata
-) VALUES (
-  '{{ $json.tenantId }}',
-  '{{ $json.workflowName }}',
-  '{{ $json.requestId }}',
-  'auth_gate_blocked',
-  '{"source_ip": "{{ $json.sourceIp }}", "reason": "{{ $json.reason }}"}'::jsonb,
-  'HIGH',
-  'error',
-  'Authentication failed: {{ $json.reason }}',
-  '{"validated_at": "{{ $json.validatedAt }}"}'::jsonb
-);""",
-                "options": {}
-            },
-            "id": f"auth-log-{hashlib.md5(workflow_name.encode()).hexdigest()[:8]}",
-            "name": "📝 Log Unauthorized",
-            "type": "n8n-nodes-base.postgres",
-            "typeVersion": 2.5,
-            "position": [start_position[0] + 200, start_position[1] + 150],
-            "credentials": {
-                "postgres": {"id": "supabase-postgres", "name": "Supabase PostgreSQL"}
-            }
-        },
+        create_batch_writer_node(
+            "📝 Log Unauthorized",
+            f"auth-log-{hashlib.md5(workflow_name.encode()).hexdigest()[:8]}",
+            [start_position[0] + 200, start_position[1] + 150],
+            'audit_logs', AUDIT_LOG_COLUMNS, AUDIT_LOG_ROWS_JS, trace_sink
+        ),
         {
             "parameters": {
                 "respondWith": "json",
@@ -151,50 +261,59 @@ return {{ json: authResult }};'''
     ]
 
 
-def create_burn_limit_node(workflow_name: str, api_provider: str, position: List[int]) -> Dict:
-    """燃焼上限チェックノードを生成"""
+def create_burn_limit_node(workflow_name: str, api_provider: str, position: List[int], node_name: str = '') -> Dict:
+    """燃焼上限チェックノードを生成（単価・予算は価格計算APIの /burn-limit/check で判定）"""
     return {
         "parameters": {
             "jsCode": f'''// ========================================
 // V8.2.1 Burn-Limit - 燃焼上限チェック
 // API: {api_provider}
+// 単価・予算は価格計算APIの共通コスト表で判定（ワークフローに単価を埋め込まない）
 // ========================================
 
-const input = $input.first().json;
-const tenantId = input.tenantId || 'default';
-const requestId = input.requestId || 'unknown';
+const items = $input.all();
+const first = items[0]?.json || {{}};
+const tenantId = first.tenantId || 'default';
+const requestId = first.requestId || 'unknown';
 const workflowName = '{workflow_name}';
 const apiProvider = '{api_provider}';
 
-// APIコスト概算（プロバイダー別）
-const costEstimates = {{
-  'openai': 0.03,      // GPT-4 1Kトークン概算
-  'gemini': 0.01,
-  'claude': 0.025,
-  'elevenlabs': 0.05,  // 1000文字概算
-  'midjourney': 0.10,  // 1画像概算
-  'suno': 0.10,
-  'deepseek': 0.005,
-  'zenrows': 0.01
-}};
+{SIGNED_POST_JS}
 
-const estimatedCost = costEstimates[apiProvider] || 0.01;
+// 実行内の全アイテム分を1回で問い合わせ（署名付き）
+let check;
+try {{
+  check = await signedPost('/burn-limit/check',
+    {{ tenant_id: tenantId, provider: apiProvider, units: items.length, workflow_name: workflowName }}, 2000);
+}} catch (error) {{
+  if (isAuthError(error)) {{
+    // 署名の不備で予算判定を素通りさせない
+    throw new Error(`燃焼上限チェックの認証に失敗（N3_HMAC_SECRET を確認）: ${{error.message}}`);
+  }}
+  // 計測サービス停止時は処理を止めない（未計測として後段に伝える）
+  check = {{ allowed: true, degraded: true, error: error.message }};
+}}
 
-return {{
+return items.map(item => ({{
   json: {{
-    ...input,
+    ...item.json,
     _burnLimitCheck: {{
       tenantId,
       requestId,
       workflowName,
       apiProvider,
-      estimatedCostUsd: estimatedCost,
+      allowed: check.allowed,
+      estimatedCostUsd: check.estimatedCostUsd ?? null,
+      remainingUsd: check.remainingUsd ?? null,
+      retryAfterSec: check.retryAfterSec ?? null,
+      costTableVersion: check.costTableVersion ?? null,
+      degraded: check.degraded || false,
       checkRequired: true
     }}
   }}
-}};'''
+}}));'''
         },
-        "id": f"burn-{api_provider[:4]}-{hashlib.md5(workflow_name.encode()).hexdigest()[:6]}",
+        "id": f"burn-{api_provider[:4]}-{hashlib.md5((workflow_name + node_name).encode()).hexdigest()[:6]}",
         "name": f"🔥 Burn-Limit ({api_provider})",
         "type": "n8n-nodes-base.code",
         "typeVersion": 2,
@@ -257,39 +376,14 @@ return {{
     }
 
 
-def create_ai_trace_db_node(position: List[int]) -> Dict:
-    """AI判断をDBに記録するノード"""
-    return {
-        "parameters": {
-            "operation": "executeQuery",
-            "query": """INSERT INTO ai_decision_traces (
-  tenant_id, workflow_name, request_id, node_name,
-  ai_provider, model_name, input_summary, output_summary,
-  reasoning, tokens_used, created_at
-) VALUES (
-  '{{ $json._aiTrace.tenantId }}',
-  '{{ $json._aiTrace.workflowName }}',
-  '{{ $json._aiTrace.requestId }}',
-  '{{ $json._aiTrace.nodeName }}',
-  '{{ $json._aiTrace.aiProvider }}',
-  '{{ $json._aiTrace.modelName }}',
-  '{{ $json._aiTrace.inputSummary.replace(/'/g, "''") }}',
-  '{{ $json._aiTrace.outputSummary.replace(/'/g, "''") }}',
-  '{{ $json._aiTrace.reasoning.replace(/'/g, "''") }}',
-  {{ $json._aiTrace.tokensUsed || 'NULL' }},
-  NOW()
-);""",
-            "options": {}
-        },
-        "id": f"trace-db-{hashlib.md5(str(position).encode()).hexdigest()[:8]}",
-        "name": "💾 Save AI Trace",
-        "type": "n8n-nodes-base.postgres",
-        "typeVersion": 2.5,
-        "position": position,
-        "credentials": {
-            "postgres": {"id": "supabase-postgres", "name": "Supabase PostgreSQL"}
-        }
-    }
+def create_ai_trace_db_node(position: List[int], node_name: str = '', trace_sink: str = 'postgres') -> Dict:
+    """AI判断をDBに記録するノード（IDは対象AIノード名から決定、未指定時は位置から）"""
+    return create_batch_writer_node(
+        "💾 Save AI Trace",
+        f"trace-db-{hashlib.md5((node_name or str(position)).encode()).hexdigest()[:8]}",
+        position,
+        'ai_decision_traces', AI_TRACE_COLUMNS, AI_TRACE_ROWS_JS, trace_sink
+    )
 
 
 # =====================================
@@ -307,53 +401,286 @@ AI_PROVIDERS = {
     'zenrows': ['zenrows', 'scrape', 'scraping']
 }
 
+# 全キーワードを1つのマッチャーに構築（AI_PROVIDERSの登録順が優先順位）
+AI_PROVIDER_MATCHER = KeywordMatcher(AI_PROVIDERS, ignore_case=True)
+
 def detect_ai_provider(node: Dict) -> Optional[str]:
     """ノードからAIプロバイダーを検出"""
-    node_type = node.get('type', '').lower()
-    node_name = node.get('name', '').lower()
-    params = json.dumps(node.get('parameters', {})).lower()
+    return AI_PROVIDER_MATCHER.first_category(
+        node.get('type', ''),
+        node.get('name', ''),
+        json.dumps(node.get('parameters', {})),
+    )
+
+
+# =====================================
+# パッチ状態インデックス（冪等化）
+# =====================================
+#
+# meta.n3ArmorPatch に注入ノードを記録する:
+#   {"version": "v8.2.1",
+#    "nodes": {"<注入ノード名>": {"id": ..., "role": "auth_gate" | ... | "trace_db",
+#                                 "target": "<保護対象のWebhook/AIノード名>",
+#                                 "hash": "<注入時テンプレートのハッシュ>"}}}
+# 再実行時は記録済みの対象をスキップし、テンプレートが変わった注入ノードだけを
+# その場で差し替える（ID・名前・位置・接続は維持）
+
+ARMOR_PATCH_VERSION = 'v8.2.1'
+PATCH_INDEX_KEY = 'n3ArmorPatch'
+ARMOR_TAGS = ['V8.2.1', 'Armored', 'Auth-Gate', 'Burn-Limit']
+
+AUTH_ROLES = ['auth_gate', 'auth_switch', 'auth_log', 'auth_reject']
+AI_ROLES = ['burn', 'trace', 'trace_db']
+
+# ハッシュ対象（ID・名前・位置は注入先ごとに変わるため除外）
+HASHED_FIELDS = ('type', 'typeVersion', 'parameters', 'credentials', 'notes', 'executeOnce', 'onError')
+
+# インデックス導入前にパッチ済みのワークフローを認識するための既定名
+LEGACY_AUTH_NAMES = {
+    'auth_gate': '🔐 V8 Auth-Gate',
+    'auth_switch': 'Auth Valid?',
+    'auth_log': '📝 Log Unauthorized',
+    'auth_reject': '🚫 Auth Rejected',
+}
+LEGACY_AI_PREFIXES = {
+    'burn': '🔥 Burn-Limit',
+    'trace': '📊 AI-Trace',
+    'trace_db': '💾 Save AI Trace',
+}
+
+
+def template_hash(node: Dict) -> str:
+    """注入ノードの内容ハッシュ（sha256）"""
+    content = {k: node[k] for k in HASHED_FIELDS if k in node}
+    return hashlib.sha256(json.dumps(content, sort_keys=True, ensure_ascii=False).encode()).hexdigest()[:16]
+
+
+def is_injected_node(node: Dict, index_nodes: Dict[str, Dict]) -> bool:
+    """装甲パッチが注入したノードか（meta.n3ArmorPatch のインデックス、またはインデックス導入前の既定名で判定）
+
+    注記（notes）は手書きのノードにも '[V8.2.1]' で始まるものがあるため判定に使わない
+    """
+    name = node.get('name', '')
+    if name in index_nodes:
+        return True
+    return name in LEGACY_AUTH_NAMES.values() or name.startswith(tuple(LEGACY_AI_PREFIXES.values()))
+
+
+def unique_name(base: str, taken) -> str:
+    """既存ノード名と衝突しない名前（n8nの接続は名前参照のため重複不可）"""
+    if base not in taken:
+        return base
+    n = 2
+    while f"{base} #{n}" in taken:
+        n += 1
+    return f"{base} #{n}"
+
+
+def merge_tags(tags: List, extra: List[str]) -> List:
+    """タグを順序を保って重複排除（文字列タグと {id, name} 形式の両方に対応）"""
+    merged = []
+    seen = set()
+    for tag in list(tags or []) + extra:
+        key = tag.get('name') if isinstance(tag, dict) else tag
+        if key in seen:
+            continue
+        seen.add(key)
+        merged.append(tag)
+    return merged
+
+
+def refresh_node(node: Dict, template: Dict) -> None:
+    """注入ノードの内容をテンプレートで置き換え（ID・名前・位置は維持）"""
+    for k in HASHED_FIELDS:
+        if k in template:
+            node[k] = copy.deepcopy(template[k])
+        else:
+            node.pop(k, None)
+
+
+def detach_writer(connections: Dict, writer: str, upstream: str, output_index: int = 0) -> bool:
+    """書き込みノードを分岐の末端にする（後続の接続を上流ノードの同じ出力へ付け替える）
     
-    for provider, keywords in AI_PROVIDERS.items():
-        for keyword in keywords:
-            if keyword in node_type or keyword in node_name or keyword in params:
-                return provider
-    return None
+    バッチ書き込みノードは1件の結果しか返さないため、後続には上流のアイテムをそのまま渡す
+    """
+    if 'main' not in connections.get(writer, {}):
+        return False
+    outputs = connections[writer]['main'] or []
+    targets = [c for out in outputs for c in (out or [])]
+    upstream_outputs = connections.setdefault(upstream, {}).setdefault('main', [])
+    while len(upstream_outputs) <= output_index:
+        upstream_outputs.append([])
+    branch = upstream_outputs[output_index] = upstream_outputs[output_index] or []
+    for target in targets:
+        if target not in branch:
+            branch.append(target)
+    del connections[writer]['main']
+    if not connections[writer]:
+        del connections[writer]
+    return True
+
+
+def bypass_node(connections: Dict, name: str) -> None:
+    """ノードを接続から外す（接続元を、外すノードの出力0の接続先へ付け替える。自己ループは作らない）"""
+    outputs = connections.pop(name, {}).get('main') or []
+    targets = [c for c in (outputs[0] if outputs else []) or [] if c.get('node') != name]
+    for source, source_outputs in connections.items():
+        for i, out in enumerate(source_outputs.get('main') or []):
+            if not out or all(c.get('node') != name for c in out):
+                continue
+            rewired = []
+            for c in out:
+                for t in (targets if c.get('node') == name else [c]):
+                    if t.get('node') != source and t not in rewired:
+                        rewired.append(t)
+            source_outputs['main'][i] = rewired
+
+
+def drop_edges(connections: Dict, source: str, target: str) -> None:
+    """source から target への接続をすべて外す"""
+    for i, out in enumerate(connections.get(source, {}).get('main') or []):
+        if out:
+            connections[source]['main'][i] = [c for c in out if c.get('node') != target]
+
+
+def collapse_legacy_duplicates(nodes: List[Dict], index_nodes: Dict[str, Dict]) -> List[str]:
+    """旧版を複数回適用したワークフローの同名の注入ノードを1つにまとめる（先頭を残す）
+
+    旧版はノード名を対象ではなくプロバイダー単位で付けていたため、同名のノードが並ぶ。
+    n8nの接続は名前参照で、2つ目以降はどこからも区別して参照できない。
+    Returns: 削除したノード名（重複分）
+    """
+    seen = set()
+    kept, removed = [], []
+    for node in nodes:
+        name = node.get('name', '')
+        if name in seen and is_injected_node(node, index_nodes):
+            removed.append(name)
+            continue
+        seen.add(name)
+        kept.append(node)
+    nodes[:] = kept
+    return removed
+
+
+def wire_before(connections: Dict, node: str, target: str) -> bool:
+    """node を target の直前に挟む（target の入力0への接続を node に付け替え、node -> target を追加）
+
+    node に出力接続があれば接続済みとみなして何もしない（再実行・手動で繋ぎ直した場合）
+    """
+    if connections.get(node, {}).get('main'):
+        return False
+    for source, outputs in connections.items():
+        if source == node:
+            continue
+        for out in outputs.get('main') or []:
+            for c in out or []:
+                if c.get('node') == target and c.get('index', 0) == 0:
+                    c['node'] = node
+    connections[node] = {
+        "main": [[{"node": target, "type": "main", "index": 0}]]
+    }
+    return True
+
+
+def _first_targets(connections: Dict, name: str) -> List[str]:
+    outputs = connections.get(name, {}).get('main', [])
+    return [c.get('node', '') for c in (outputs[0] if outputs else []) or []]
 
 
 # =====================================
 # ワークフロー変換
 # =====================================
 
-def apply_armor_patch(workflow: Dict) -> Dict:
-    """ワークフローに装甲パッチを適用"""
-    patched = copy.deepcopy(workflow)
+def apply_armor_patch(workflow: Dict, in_place: bool = False, trace_sink: str = 'postgres') -> Dict:
+    """ワークフローに装甲パッチを適用（適用済みの部分は再注入しない）
+    
+    in_place=True の場合は入力を直接書き換える（読み込んだ直後で元が不要なときにコピーを省く）
+    trace_sink: 監査ログ・AIトレースの書き込み先（'postgres' = 複数行INSERT, 'api' = バッチAPI）
+    """
+    patched = workflow if in_place else copy.deepcopy(workflow)
     workflow_name = patched.get('name', 'Unknown')
     nodes = patched.get('nodes', [])
     connections = patched.get('connections', {})
     
+    # 既存インデックス（削除済みノードの記録は捨てる）
+    old_index = patched.get('meta', {}).get(PATCH_INDEX_KEY) or {}
+    names = {n.get('name', '') for n in nodes}
+    index_nodes = {name: dict(entry) for name, entry in old_index.get('nodes', {}).items() if name in names}
+    
+    # 旧版の重複適用で増えた同名の注入ノードを削除（対象ごとの引き継ぎは下で行う）
+    removed = collapse_legacy_duplicates(nodes, index_nodes)
+    by_name = {n.get('name', ''): n for n in nodes}
+    
+    # 保護対象の検出は元のノードのみ（注入ノードをAIノードと誤検出して再ラップしない）
+    original_nodes = [n for n in nodes if not is_injected_node(n, index_nodes)]
+    
     # 位置計算用
     min_x = min((n.get('position', [0, 0])[0] for n in nodes), default=0)
     min_y = min((n.get('position', [0, 0])[1] for n in nodes), default=0)
     
+    # 挿入したノード（最後にまとめて配置を決める）
+    inserted = []
+    # テンプレート更新で差し替えたノード
+    upgraded = []
+    # 接続を付け替えた注入済みノード（旧版で未接続のまま挿入された燃焼上限ノード）
+    rewired = []
+    
+    def record(node: Dict, role: str, target: str, template: Dict):
+        index_nodes[node['name']] = {
+            'id': node.get('id', ''), 'role': role, 'target': target, 'hash': template_hash(template),
+        }
+    
+    def sync(node: Dict, role: str, target: str, template: Dict):
+        """注入時からテンプレートが変わったノードのみ差し替え
+        
+        インデックス導入前のノードは手動調整の可能性があるため、内容はそのまま引き継ぐ
+        """
+        entry = index_nodes.get(node['name'])
+        refreshed = bool(entry) and entry['hash'] != template_hash(template)
+        if refreshed:
+            refresh_node(node, template)
+            upgraded.append(node['name'])
+        record(node, role, target, template)
+        return refreshed
+    
+    def insert(node: Dict, role: str, target: str) -> Dict:
+        template = copy.deepcopy(node)
+        node['name'] = unique_name(node['name'], by_name)
+        nodes.append(node)
+        by_name[node['name']] = node
+        inserted.append(node['name'])
+        record(node, role, target, template)
+        return node
+    
     # 1. Auth-Gate追加（Webhookトリガーの直後）
     webhook_node = None
-    for node in nodes:
-        if 'webhook' in node.get('type', '').lower():
+    for node in original_nodes:
+        node_type = node.get('type', '').lower()
+        if 'webhook' in node_type and 'respond' not in node_type:
             webhook_node = node
             break
     
-    if webhook_node:
-        auth_nodes = create_auth_gate_nodes(
-            workflow_name, 
-            [min_x - 100, min_y]
-        )
-        
-        # Auth-Gateノードを追加
-        for auth_node in auth_nodes:
-            nodes.append(auth_node)
-        
-        # 接続を更新
+    auth_existing = {e['role']: name for name, e in index_nodes.items() if e['role'] in AUTH_ROLES}
+    if not auth_existing:
+        # インデックス導入前の適用結果を引き継ぐ
+        auth_existing = {role: name for role, name in LEGACY_AUTH_NAMES.items() if name in by_name}
+    
+    auth_templates = create_auth_gate_nodes(workflow_name, [min_x - 100, min_y], trace_sink)
+    if 'auth_gate' in auth_existing:
+        gate_target = index_nodes.get(auth_existing['auth_gate'], {}).get('target') or (webhook_node or {}).get('name', '')
+        for role, template in zip(AUTH_ROLES, auth_templates):
+            if role in auth_existing:
+                refreshed = sync(by_name[auth_existing[role]], role, gate_target, template)
+                # 旧版の重複適用では Auth Valid? の true 側が Auth-Gate に戻るループになる
+                if role == 'auth_switch' and auth_existing.get('auth_gate'):
+                    drop_edges(connections, auth_existing[role], auth_existing['auth_gate'])
+                # 旧テンプレート（Log -> Reject の直列）をバッチ書き込み用の分岐に移行
+                if refreshed and role == 'auth_log' and 'auth_switch' in auth_existing:
+                    detach_writer(connections, auth_existing[role], auth_existing['auth_switch'], 1)
+    elif webhook_node:
         webhook_name = webhook_node.get('name', '')
+        auth_nodes = [insert(n, role, webhook_name) for role, n in zip(AUTH_ROLES, auth_templates)]
         
         # 元のWebhook接続先を取得
         original_targets = connections.get(webhook_name, {}).get('main', [[]])
@@ -368,55 +695,72 @@ def apply_armor_patch(workflow: Dict) -> Dict:
             "main": [[{"node": auth_nodes[1]['name'], "type": "main", "index": 0}]]
         }
         
-        # Auth Valid? -> 元の接続先 (true) / Log (false)
+        # Auth Valid? -> 元の接続先 (true) / Log + Reject (false)
+        # Logは末端（バッチ書き込みの結果ではなく認証結果をRejectへ渡す）
         connections[auth_nodes[1]['name']] = {
             "main": [
                 original_targets[0] if original_targets else [],  # true -> 元の処理
-                [{"node": auth_nodes[2]['name'], "type": "main", "index": 0}]  # false -> Log
+                [
+                    {"node": auth_nodes[2]['name'], "type": "main", "index": 0},  # false -> Log
+                    {"node": auth_nodes[3]['name'], "type": "main", "index": 0},  # false -> Reject
+                ]
             ]
         }
-        
-        # Log -> Reject
-        connections[auth_nodes[2]['name']] = {
-            "main": [[{"node": auth_nodes[3]['name'], "type": "main", "index": 0}]]
-        }
     
-    # 2. AIノード検出と燃焼上限・トレース追加
+    # 2. AIノード検出と燃焼上限・トレース追加（トリガーは対象外）
     ai_nodes_found = []
-    for i, node in enumerate(nodes):
+    for node in original_nodes:
+        node_type = node.get('type', '').lower()
+        if 'trigger' in node_type or 'webhook' in node_type:
+            continue
         provider = detect_ai_provider(node)
         if provider:
-            ai_nodes_found.append((i, node, provider))
+            ai_nodes_found.append((node, provider))
     
-    offset = 0
-    for idx, (orig_idx, node, provider) in enumerate(ai_nodes_found):
+    for node, provider in ai_nodes_found:
+        node_name = node.get('name', '')
         node_pos = node.get('position', [500, 300])
+        templates = {
+            # 燃焼上限ノード（AIノードの前）
+            'burn': create_burn_limit_node(workflow_name, provider, [node_pos[0] - 200, node_pos[1] - 50], node_name),
+            # AIトレースノード（AIノードの後）
+            'trace': create_ai_trace_node(workflow_name, provider, node_name or 'AI Node', [node_pos[0] + 200, node_pos[1] - 50]),
+            # トレースDB保存ノード
+            'trace_db': create_ai_trace_db_node([node_pos[0] + 400, node_pos[1] - 50], node_name, trace_sink),
+        }
         
-        # 燃焼上限ノード（AIノードの前）
-        burn_node = create_burn_limit_node(
-            workflow_name, 
-            provider,
-            [node_pos[0] - 200, node_pos[1] - 50]
-        )
-        nodes.append(burn_node)
+        wrappers = {e['role']: name for name, e in index_nodes.items()
+                    if e['target'] == node_name and e['role'] in AI_ROLES}
+        if 'trace' not in wrappers:
+            # インデックス導入前の適用結果（AIノード → トレース → DB保存）を引き継ぐ
+            for succ in _first_targets(connections, node_name):
+                if succ.startswith(LEGACY_AI_PREFIXES['trace']) and succ not in index_nodes:
+                    wrappers['trace'] = succ
+                    for db in _first_targets(connections, succ):
+                        if db.startswith(LEGACY_AI_PREFIXES['trace_db']) and db not in index_nodes:
+                            wrappers['trace_db'] = db
+                            break
+                    burn_base = f"{LEGACY_AI_PREFIXES['burn']} ({provider})"
+                    for name in by_name:
+                        if name.startswith(burn_base) and name not in index_nodes:
+                            wrappers['burn'] = name
+                            break
+                    break
         
-        # AIトレースノード（AIノードの後）
-        trace_node = create_ai_trace_node(
-            workflow_name,
-            provider,
-            node.get('name', 'AI Node'),
-            [node_pos[0] + 200, node_pos[1] - 50]
-        )
-        nodes.append(trace_node)
+        if 'trace' in wrappers:
+            for role, name in wrappers.items():
+                refreshed = sync(by_name[name], role, node_name, templates[role])
+                # 旧テンプレート（トレース -> DB保存 -> 元の接続先 の直列）を分岐に移行
+                if refreshed and role == 'trace_db':
+                    detach_writer(connections, name, wrappers['trace'])
+                # 旧版は燃焼上限ノードを未接続のまま挿入していたため、AIノードの前に繋ぐ
+                if role == 'burn' and wire_before(connections, name, node_name):
+                    rewired.append(name)
+            continue
         
-        # トレースDB保存ノード
-        trace_db_node = create_ai_trace_db_node(
-            [node_pos[0] + 400, node_pos[1] - 50]
-        )
-        nodes.append(trace_db_node)
-        
-        # 接続を更新
-        node_name = node.get('name', '')
+        burn_node = insert(templates['burn'], 'burn', node_name)
+        trace_node = insert(templates['trace'], 'trace', node_name)
+        trace_db_node = insert(templates['trace_db'], 'trace_db', node_name)
         
         # AIノードの出力先を取得
         original_outputs = connections.get(node_name, {}).get('main', [[]])
@@ -426,85 +770,324 @@ def apply_armor_patch(workflow: Dict) -> Dict:
             "main": [[{"node": trace_node['name'], "type": "main", "index": 0}]]
         }
         
-        # トレースノード -> DB保存
+        # トレースノード -> DB保存（末端） + 元の接続先（出力番号はそのまま引き継ぐ）
+        trace_outputs = [list(out or []) for out in original_outputs] or [[]]
+        trace_outputs[0].insert(0, {"node": trace_db_node['name'], "type": "main", "index": 0})
         connections[trace_node['name']] = {
-            "main": [[{"node": trace_db_node['name'], "type": "main", "index": 0}]]
+            "main": trace_outputs
         }
         
-        # DB保存 -> 元の接続先
-        connections[trace_db_node['name']] = {
-            "main": original_outputs
-        }
+        # 元の接続元 -> 燃焼上限ノード -> AIノード
+        wire_before(connections, burn_node['name'], node_name)
+    
+    # 旧版の注入ノードのうち、どの対象にも引き継がれなかったもの（重複適用の残骸）を外す
+    stale = {n.get('name', '') for n in nodes if n.get('name', '') not in index_nodes and is_injected_node(n, {})}
+    for name in stale:
+        bypass_node(connections, name)
+    if stale:
+        nodes[:] = [n for n in nodes if n.get('name', '') not in stale]
+        removed.extend(sorted(stale))
+    
+    # 3. メタデータ更新（実際に変化があった場合のみ。再実行では入力をそのまま返す）
+    index = {'version': ARMOR_PATCH_VERSION, 'nodes': index_nodes}
+    tags = merge_tags(patched.get('tags', []), ARMOR_TAGS)
+    if (not inserted and not upgraded and not rewired and not removed and index == old_index
+            and tags == patched.get('tags') and patched.get('versionId') == 'v8.2.1-armored'):
+        return patched
     
-    # 3. メタデータ更新
     patched['nodes'] = nodes
     patched['connections'] = connections
-    patched['tags'] = list(set(patched.get('tags', []) + ['V8.2.1', 'Armored', 'Auth-Gate', 'Burn-Limit']))
+    
+    # 挿入ノードを接続元の隣に配置し、必要な分だけ下流をずらす（既存ノードの手動配置は保持）
+    relayout_inserted(patched, inserted)
+    patched['tags'] = tags
     patched['versionId'] = 'v8.2.1-armored'
     patched['updatedAt'] = datetime.utcnow().isoformat() + 'Z'
+    patched.setdefault('meta', {})[PATCH_INDEX_KEY] = index
     
     # 統計情報
+    wrapped = {e['target']: e for e in index_nodes.values() if e['role'] == 'trace'}
     patched['_armorPatch'] = {
         'appliedAt': datetime.utcnow().isoformat() + 'Z',
-        'authGateAdded': webhook_node is not None,
-        'aiNodesPatched': len(ai_nodes_found),
-        'aiProviders': list(set(p for _, _, p in ai_nodes_found)),
+        'authGateAdded': any(e['role'] == 'auth_gate' for e in index_nodes.values()),
+        'aiNodesPatched': len(wrapped),
+        'aiProviders': sorted({p for n, p in ai_nodes_found if n.get('name', '') in wrapped}),
+        'inserted': len(inserted),
+        'upgraded': len(upgraded),
+        'rewired': len(rewired),
+        'removed': len(removed),
         'totalNodes': len(nodes)
     }
     
     return patched
 
 
-def process_workflow_file(input_path: str, output_dir: str) -> Dict:
-    """ワークフローファイルを処理"""
+def _without_timestamps(workflow: Dict) -> Dict:
+    """比較用: 適用時刻のみを除いたワークフロー"""
+    stripped = dict(workflow)
+    stripped.pop('updatedAt', None)
+    stripped['_armorPatch'] = {k: v for k, v in stripped.get('_armorPatch', {}).items() if k != 'appliedAt'}
+    return stripped
+
+
+def output_path_for(input_path: str, output_dir: str, input_root: Optional[str] = None) -> str:
+    """出力ファイルパス（input_root からの相対ディレクトリを output_dir 配下に再現する）
+    
+    適用済みファイルを入力にしても接尾辞を重ねない
+    """
+    relative_dir = os.path.dirname(os.path.relpath(input_path, input_root)) if input_root else ''
+    stem = os.path.basename(input_path).rsplit('.', 1)[0]
+    if not stem.endswith('_V8-ARMORED'):
+        stem = f"{stem}_V8-ARMORED"
+    return os.path.normpath(os.path.join(output_dir, relative_dir, f"{stem}.json"))
+
+
+def patch_workflow_file(input_path: str, output_dir: str, writer: Optional[AtomicJsonWriter] = None,
+                        dry_run: bool = False, record_patch: bool = False, trace_sink: str = 'postgres',
+                        input_root: Optional[str] = None) -> Dict:
+    """ワークフローファイル1件を処理し、統計（処理時間・ノード増加数）を返す
+    
+    record_patch=True の場合のみ変換前を保持してJSON Patchを算出する（それ以外はコピーしない）
+    """
+    started = time.perf_counter()
     with open(input_path, 'r', encoding='utf-8') as f:
         workflow = json.load(f)
+    nodes_before = len(workflow.get('nodes', []))
     
-    patched = apply_armor_patch(workflow)
+    patched = apply_armor_patch(workflow, in_place=not record_patch, trace_sink=trace_sink)
     
-    # 出力ファイル名
-    filename = os.path.basename(input_path)
-    name_parts = filename.rsplit('.', 1)
-    output_filename = f"{name_parts[0]}_V8-ARMORED.json"
-    output_path = os.path.join(output_dir, output_filename)
+    output_path = output_path_for(input_path, output_dir, input_root)
     
-    with open(output_path, 'w', encoding='utf-8') as f:
-        json.dump(patched, f, ensure_ascii=False, indent=2)
+    # 前回の出力と時刻以外が同一なら書き換えない（夜間の再実行で更新日時が動かない）
+    unchanged = False
+    if os.path.exists(output_path):
+        try:
+            with open(output_path, 'r', encoding='utf-8') as f:
+                previous = json.load(f)
+            unchanged = _without_timestamps(previous) == _without_timestamps(patched)
+        except (OSError, ValueError):
+            pass
+        if unchanged:
+            patched = previous
     
-    return {
+    result = {
         'input': input_path,
         'output': output_path,
-        'stats': patched.get('_armorPatch', {})
+        'unchanged': unchanged,
+        'stats': patched.get('_armorPatch', {}),
+        'nodes_before': nodes_before,
+        'nodes_after': len(patched.get('nodes', [])),
     }
+    if record_patch:
+        result['patch'] = diff(workflow, patched)
+    
+    if not dry_run and not unchanged:
+        write_json_atomic(output_path, patched, writer)
+    
+    result['elapsed_ms'] = round((time.perf_counter() - started) * 1000, 2)
+    return result
+
+
+def process_workflow_file(input_path: str, output_dir: str, writer: Optional[AtomicJsonWriter] = None,
+                          patch_report: Optional[PatchReport] = None, dry_run: bool = False,
+                          trace_sink: str = 'postgres', input_root: Optional[str] = None) -> Dict:
+    """ワークフローファイルを処理"""
+    result = patch_workflow_file(input_path, output_dir, writer, dry_run,
+                                 record_patch=patch_report is not None, trace_sink=trace_sink,
+                                 input_root=input_root)
+    
+    # 差分をJSON Patchとして記録
+    if patch_report is not None:
+        patch_report.add_patch(input_path, result.pop('patch'), result['output'])
+    
+    return result
+
+
+# =====================================
+# 並列実行
+# =====================================
+
+DEFAULT_WORKERS = os.cpu_count() or 1
+# 1ワーカーあたりの投入済みタスク上限（ファイル一覧・結果をまとめて抱えない）
+IN_FLIGHT_PER_WORKER = 2
+
+
+def iter_workflow_files(input_path: str) -> Iterator[str]:
+    """入力配下のJSONファイルを順に列挙（ファイル指定時はそのファイルのみ）"""
+    if os.path.isfile(input_path):
+        yield input_path
+        return
+    for root, dirs, files in os.walk(input_path):
+        dirs.sort()
+        for file in sorted(files):
+            if file.endswith('.json') and not file.startswith('.'):
+                yield os.path.join(root, file)
+
+
+def _patch_task(input_path: str, output_dir: str, dry_run: bool, record_patch: bool, trace_sink: str,
+                input_root: Optional[str]) -> Dict:
+    """ワーカープロセスで1ファイルを処理（例外は結果として返す）"""
+    try:
+        return patch_workflow_file(input_path, output_dir, None, dry_run, record_patch, trace_sink, input_root)
+    except Exception as e:
+        return {'input': input_path, 'error': str(e)}
+
+
+def iter_patch_tasks(input_path: str, output_dir: str) -> Iterator[Tuple[str, Optional[str]]]:
+    """(入力ファイル, 出力先が衝突した場合のエラー) を返す
+    
+    foo.json と foo_V8-ARMORED.json のように同じ出力先になる入力は、先に列挙された方のみ処理する
+    （並列実行で同じファイルを書き合わない）
+    """
+    input_root = input_path if os.path.isdir(input_path) else None
+    claimed: Dict[str, str] = {}
+    for path in iter_workflow_files(input_path):
+        output_path = output_path_for(path, output_dir, input_root)
+        if output_path in claimed:
+            yield path, f"出力先 {output_path} が {claimed[output_path]} と衝突"
+            continue
+        claimed[output_path] = path
+        yield path, None
+
+
+def run_armor_patch(input_path: str, output_dir: str, workers: int = DEFAULT_WORKERS,
+                    dry_run: bool = False, record_patch: bool = False,
+                    trace_sink: str = 'postgres') -> Iterator[Dict]:
+    """プロセスプールで並列に処理し、完了順に結果を返す
+    
+    投入済みタスクを workers × IN_FLIGHT_PER_WORKER 件に制限し、メモリ使用量を一定に保つ
+    出力は入力ディレクトリの構成を output_dir 配下に再現する
+    """
+    input_root = input_path if os.path.isdir(input_path) else None
+    if workers <= 1:
+        for path, collision in iter_patch_tasks(input_path, output_dir):
+            if collision:
+                yield {'input': path, 'error': collision}
+                continue
+            yield _patch_task(path, output_dir, dry_run, record_patch, trace_sink, input_root)
+        return
+    
+    limit = workers * IN_FLIGHT_PER_WORKER
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = set()
+        for path, collision in iter_patch_tasks(input_path, output_dir):
+            if collision:
+                yield {'input': path, 'error': collision}
+                continue
+            if len(pending) >= limit:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+            pending.add(executor.submit(_patch_task, path, output_dir, dry_run, record_patch, trace_sink,
+                                        input_root))
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+
+class RunStats:
+    """結果を保持せずに集計する（遅いファイルは上位N件のみヒープで保持）"""
+    
+    def __init__(self, top: int = 10):
+        self.top = top
+        self.files = 0
+        self.changed = 0
+        self.unchanged = 0
+        self.errors = 0
+        self.nodes_added = 0
+        self.total_ms = 0.0
+        self._slowest: List[tuple] = []
+    
+    def add(self, result: Dict):
+        self.files += 1
+        if 'error' in result:
+            self.errors += 1
+            return
+        if result['unchanged']:
+            self.unchanged += 1
+        else:
+            self.changed += 1
+        self.nodes_added += result['nodes_after'] - result['nodes_before']
+        self.total_ms += result['elapsed_ms']
+        entry = (result['elapsed_ms'], result['input'], result['nodes_before'], result['nodes_after'])
+        if len(self._slowest) < self.top:
+            heapq.heappush(self._slowest, entry)
+        elif entry > self._slowest[0]:
+            heapq.heapreplace(self._slowest, entry)
+    
+    def slowest(self) -> List[tuple]:
+        """(処理時間ms, ファイル, 処理前ノード数, 処理後ノード数) を遅い順に返す"""
+        return sorted(self._slowest, reverse=True)
 
 
 if __name__ == '__main__':
-    import sys
+    import argparse
     
-    if len(sys.argv) < 3:
-        print("Usage: python armor_patch.py <input_dir_or_file> <output_dir>")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description='N3 V8.2.1 装甲パッチ適用')
+    parser.add_argument('input_path', help='入力ディレクトリまたはファイル')
+    parser.add_argument('output_dir', help='出力ディレクトリ')
+    parser.add_argument('--dry-run', action='store_true', help='出力せずに差分のみ確認')
+    parser.add_argument('--patch-report', help='JSON Patchレポート出力先（RFC 6902）')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help=f'並列プロセス数（1で逐次実行、デフォルト: {DEFAULT_WORKERS}）')
+    parser.add_argument('--timings', help='ファイルごとの処理時間・ノード増加数の出力先（JSONL、逐次書き込み）')
+    parser.add_argument('--top', type=int, default=10, help='表示する低速ワークフローの件数')
+    parser.add_argument('--trace-sink', choices=TRACE_SINKS, default='postgres',
+                        help='監査ログ・AIトレースの書き込み先（postgres: 複数行INSERT / api: 価格計算APIの /traces でバッチ書き込み）')
+    args = parser.parse_args()
     
-    input_path = sys.argv[1]
-    output_dir = sys.argv[2]
+    input_path = args.input_path
+    output_dir = args.output_dir
     
-    os.makedirs(output_dir, exist_ok=True)
+    if not args.dry_run:
+        os.makedirs(output_dir, exist_ok=True)
     
-    results = []
+    patch_root = input_path if os.path.isdir(input_path) else os.path.dirname(input_path)
+    patch_report = PatchReport(args.patch_report, 'armor_patch', root=patch_root) if args.patch_report else None
+    timings = open(args.timings, 'w', encoding='utf-8') if args.timings else None
     
-    if os.path.isfile(input_path):
-        result = process_workflow_file(input_path, output_dir)
-        results.append(result)
-    else:
-        for root, dirs, files in os.walk(input_path):
-            for file in files:
-                if file.endswith('.json') and not file.startswith('.'):
-                    filepath = os.path.join(root, file)
-                    try:
-                        result = process_workflow_file(filepath, output_dir)
-                        results.append(result)
-                        print(f"✅ {file}: {result['stats']}")
-                    except Exception as e:
-                        print(f"❌ {file}: {str(e)}")
-    
-    print(f"\n=== 処理完了: {len(results)} ファイル ===")
+    # 結果は保持せず、完了順に表示・集計する
+    stats = RunStats(top=args.top)
+    started = time.perf_counter()
+    
+    try:
+        for result in run_armor_patch(input_path, output_dir, args.workers, args.dry_run,
+                                      record_patch=patch_report is not None, trace_sink=args.trace_sink):
+            stats.add(result)
+            file = os.path.relpath(result['input'], patch_root)
+            if 'error' in result:
+                print(f"❌ {file}: {result['error']}")
+                continue
+            
+            # 差分をJSON Patchとして記録
+            if patch_report is not None:
+                patch_report.add_patch(result['input'], result.pop('patch'), result['output'])
+            
+            growth = result['nodes_after'] - result['nodes_before']
+            print(f"{'➖' if result['unchanged'] else '✅'} {file}: "
+                  f"{result['elapsed_ms']:.1f}ms ノード {result['nodes_before']}→{result['nodes_after']} (+{growth})")
+            if timings is not None:
+                timings.write(json.dumps({
+                    'file': result['input'],
+                    'elapsed_ms': result['elapsed_ms'],
+                    'nodes_before': result['nodes_before'],
+                    'nodes_after': result['nodes_after'],
+                    'unchanged': result['unchanged'],
+                }, ensure_ascii=False) + '\n')
+    finally:
+        # 途中で例外が出ても、記録済みのパッチは有効なレポートとして残す
+        if patch_report is not None:
+            patch_report.close()
+            print(f"📝 パッチレポート: {args.patch_report}（変更 {patch_report.summary['changed']} ファイル）")
+        if timings is not None:
+            timings.close()
+    
+    elapsed = time.perf_counter() - started
+    print(f"\n=== 処理完了: {stats.files} ファイル（変更 {stats.changed} / 変更なし {stats.unchanged} / エラー {stats.errors}）===")
+    print(f"追加ノード: {stats.nodes_added} / 経過時間: {elapsed:.2f}s（ファイル処理合計 {stats.total_ms / 1000:.2f}s, {args.workers} プロセス）")
+    
+    slowest = stats.slowest()
+    if slowest:
+        print(f"\n🐢 処理時間の長いワークフロー（上位 {len(slowest)} 件）:")
+        for elapsed_ms, path, before, after in slowest:
+            print(f"  {elapsed_ms:8.1f}ms  ノード {before}→{after}  {os.path.relpath(path, patch_root)}")
@@ -4,12 +4,24 @@
 N3 Empire OS V8.3 - 140ワークフロー一括変換スクリプト（修正版）
 ================================================================
 python3 n3_v83_transform_fixed.py --input-dir ./PRODUCTION --output-dir ./PRODUCTION_V83
+
+# ノード単位の変更を逐次記録（クラッシュ後は --resume で完了済みファイルをスキップ）
+python3 n3_v83_transform_fixed.py --input-dir ./PRODUCTION --report migration.jsonl --resume
 """
 
-import json, os, re, copy, csv, uuid, argparse
+import json, sys, copy, uuid, argparse
 from datetime import datetime
 from pathlib import Path
 
+# 共通Pythonモジュール（core/logic）を参照
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / 'core' / 'logic'))
+
+from atomic_writer import AtomicJsonWriter
+from workflow_patch import PatchReport
+from sql_table_rewriter import TableRewriter
+from workflow_layout import relayout_inserted
+from change_report import ChangeReportSink
+
 # テーブル名マッピング
 TABLE_MAP = {
     "products_master": "n3_products_master",
@@ -31,34 +43,21 @@ TABLE_MAP = {
     "budget_tracker": "n3_budget_tracker",
 }
 
+# FROM/INTO/UPDATE/JOIN/TABLE直後のテーブル参照を辞書引きで置換（構築は1回のみ）
+TABLE_REWRITER = TableRewriter(TABLE_MAP)
+
+# SQLパス・テーブル名フィールドで処理済みのキー（二重置換を防ぐ）
+TEXT_SKIP_KEYS = {"query", "tableId", "table", "tableName"}
+
 def gen_id(): 
     return f"n3_core_{uuid.uuid4().hex[:8]}"
 
 def transform_sql(sql):
-    """SQLクエリ内のテーブル名を変換"""
-    result = sql
-    count = 0
-    
-    for old, new in TABLE_MAP.items():
-        if old.startswith('n3_'):
-            continue
-        
-        # 各SQLキーワードに対してパターンマッチング
-        patterns = [
-            (r'\bFROM\s+' + re.escape(old) + r'\b', f'FROM {new}'),
-            (r'\bINTO\s+' + re.escape(old) + r'\b', f'INTO {new}'),
-            (r'\bUPDATE\s+' + re.escape(old) + r'\b', f'UPDATE {new}'),
-            (r'\bJOIN\s+' + re.escape(old) + r'\b', f'JOIN {new}'),
-            (r'\bTABLE\s+' + re.escape(old) + r'\b', f'TABLE {new}'),
-        ]
-        
-        for pattern, replacement in patterns:
-            new_result = re.sub(pattern, replacement, result, flags=re.IGNORECASE)
-            if new_result != result:
-                count += 1
-                result = new_result
+    """SQLクエリ内のテーブル名を変換（1パス字句解析、文字列リテラル・コメントは対象外）
     
-    return result, count
+    Returns: (変換後SQL, 置換箇所リスト)
+    """
+    return TABLE_REWRITER.rewrite(sql)
 
 def transform_workflow(wf, path, out_dir):
     """ワークフローを変換"""
@@ -66,9 +65,16 @@ def transform_workflow(wf, path, out_dir):
         "path": path, 
         "name": wf.get("name", ""), 
         "changed": False, 
-        "changes": []
+        "changes": [],
+        "records": []  # ノード単位の変更記録（レポート用）
     }
     
+    def record(node, field, change, old, new, location=""):
+        result["records"].append({
+            "node_id": node.get("id", ""), "node": node.get("name", ""),
+            "field": field, "change": change, "old": old, "new": new, "location": location,
+        })
+    
     tw = copy.deepcopy(wf)
     nodes = tw.get("nodes", [])
     conns = tw.get("connections", {})
@@ -101,7 +107,11 @@ def transform_workflow(wf, path, out_dir):
             if orig and orig[0]: 
                 conns[disp["name"]] = {"main": [orig[0]]}
             
+            # Webhookの右隣に配置し、重なる下流ノードだけを右へずらす
+            relayout_inserted(tw, [disp["name"]])
+            
             result["changes"].append(f"Inserted CORE-Dispatcher after {wh_name}")
+            record(disp, "node", "insert_dispatcher", "", disp["name"], f"after {wh_name}")
     
     # テーブル名変換
     for n in nodes:
@@ -109,10 +119,12 @@ def transform_workflow(wf, path, out_dir):
         
         # SQLクエリの変換
         if "query" in p and isinstance(p["query"], str):
-            nq, c = transform_sql(p["query"])
-            if c > 0: 
+            nq, rewrites = transform_sql(p["query"])
+            if rewrites: 
                 p["query"] = nq
-                result["changes"].append(f"SQL: {c} tables transformed")
+                for rw in rewrites:
+                    result["changes"].append(f"SQL: {rw.old} → {rw.new} ({rw.keyword} @ {rw.line}:{rw.column})")
+                    record(n, "query", f"sql_{rw.keyword.lower()}", rw.old, rw.new, f"{rw.line}:{rw.column}")
         
         # テーブル名フィールドの変換
         for k in ["tableId", "table", "tableName"]:
@@ -120,16 +132,19 @@ def transform_workflow(wf, path, out_dir):
                 old_table = p[k]
                 p[k] = TABLE_MAP[p[k]]
                 result["changes"].append(f"Table: {old_table} → {p[k]}")
+                record(n, k, "table_field", old_table, p[k])
         
         # 文字列内のテーブル参照を検索・変換
-        for key, value in list(p.items()):
-            if isinstance(value, str):
-                for old, new in TABLE_MAP.items():
-                    if old in value and not old.startswith('n3_'):
-                        p[key] = value.replace(old, new)
-                        if p[key] != value:
-                            result["changes"].append(f"String replace: {old} → {new}")
-                        value = p[key]
+        # （REST パス・文字列リテラル・埋め込みSQL等の文脈のみ。列名やJS識別子は置換しない）
+        for key, value in p.items():
+            if key in TEXT_SKIP_KEYS or not isinstance(value, str):
+                continue
+            nv, rewrites = TABLE_REWRITER.rewrite_text(value)
+            if rewrites:
+                p[key] = nv
+                for rw in rewrites:
+                    result["changes"].append(f"String ({key}): {rw.old} → {rw.new} ({rw.keyword} @ {rw.line}:{rw.column})")
+                    record(n, key, f"text_{rw.keyword.lower()}", rw.old, rw.new, f"{rw.line}:{rw.column}")
     
     # メタデータ追加
     tw.setdefault("meta", {})["n3_version"] = "V8.3"
@@ -144,11 +159,18 @@ def main():
     p.add_argument('--output-dir', help='Output directory (default: input_V83)')
     p.add_argument('--dry-run', action='store_true', help='Preview without changes')
     p.add_argument('--verbose', '-v', action='store_true', help='Show all changes')
+    p.add_argument('--patch-report', help='Write RFC 6902 JSON Patch report (works with --dry-run)')
+    p.add_argument('--report', help='Per-node change report, streamed while running (.csv or .jsonl; default: n3_v83_mapping_<timestamp>.csv)')
+    p.add_argument('--resume', action='store_true', help='Skip files already completed in --report and append to it')
+    p.add_argument('--flush-every', type=int, default=500, help='Flush the report every N records')
     args = p.parse_args()
     
     in_dir = Path(args.input_dir)
     out_dir = Path(args.output_dir or str(args.input_dir) + "_V83")
-    results = []
+    report_path = args.report or f"n3_v83_mapping_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+    # 結果はメモリに溜めず、件数のみ集計（詳細はレポートへ逐次書き出し）
+    processed = 0
+    changed = 0
     errors = []
     
     print(f"\n{'='*60}")
@@ -157,55 +179,76 @@ def main():
     print(f"Input:  {in_dir.absolute()}")
     print(f"Output: {out_dir.absolute()}")
     print(f"Mode:   {'DRY RUN' if args.dry_run else 'EXECUTE'}")
+    print(f"Report: {report_path}{' (resume)' if args.resume else ''}")
     print(f"{'='*60}\n")
     
-    json_files = list(in_dir.rglob("*.json"))
+    json_files = sorted(in_dir.rglob("*.json"))
     print(f"Found {len(json_files)} JSON files\n")
     
-    for f in json_files:
-        try:
-            content = f.read_text(encoding='utf-8')
-            wf = json.loads(content)
-            
-            # ノードがないファイルはスキップ
-            if "nodes" not in wf:
+    patch_report = PatchReport(args.patch_report, 'n3_v83_transform_fixed', root=str(in_dir)) if args.patch_report else None
+    
+    # 出力ファイルを確定させてから完了マーカーをflush（マーカーだけ残る状態を防ぐ）
+    with AtomicJsonWriter() as writer, ChangeReportSink(
+        report_path, resume=args.resume, flush_every=args.flush_every, before_flush=writer.flush,
+    ) as sink:
+        if sink.stats['resumed']:
+            print(f"Resuming: {sink.stats['resumed']} files already completed\n")
+        
+        for f in json_files:
+            rel = f.relative_to(in_dir).as_posix()
+            if rel in sink.completed:
                 continue
             
-            tw, r = transform_workflow(wf, str(f), out_dir)
-            results.append(r)
-            
-            # 出力
-            status = '✓' if r['changed'] else '-'
-            print(f"{status} {r['name'][:50]}")
-            
-            if args.verbose or r['changed']:
-                for c in r['changes'][:5]:
-                    print(f"    └─ {c}")
-                if len(r['changes']) > 5:
-                    print(f"    └─ ... and {len(r['changes']) - 5} more changes")
-            
-            # ファイル出力
-            if not args.dry_run and r['changed']:
-                op = out_dir / f.relative_to(in_dir)
-                op.parent.mkdir(parents=True, exist_ok=True)
-                op.write_text(
-                    json.dumps(tw, indent=2, ensure_ascii=False), 
-                    encoding='utf-8'
-                )
+            try:
+                content = f.read_text(encoding='utf-8')
+                wf = json.loads(content)
+                
+                # ノードがないファイルはスキップ
+                if "nodes" not in wf:
+                    sink.complete_file(rel, skipped=True)
+                    continue
                 
-        except json.JSONDecodeError as e:
-            errors.append(f"{f.name}: JSON parse error - {e}")
-            print(f"✗ {f.name}: JSON parse error")
-        except Exception as e:
-            errors.append(f"{f.name}: {e}")
-            print(f"✗ {f.name}: {e}")
+                tw, r = transform_workflow(wf, str(f), out_dir)
+                processed += 1
+                changed += r['changed']
+                
+                # 出力
+                status = '✓' if r['changed'] else '-'
+                print(f"{status} {r['name'][:50]}")
+                
+                if args.verbose or r['changed']:
+                    for c in r['changes'][:5]:
+                        print(f"    └─ {c}")
+                    if len(r['changes']) > 5:
+                        print(f"    └─ ... and {len(r['changes']) - 5} more changes")
+                
+                # 差分をJSON Patchとして記録
+                if patch_report and r['changed']:
+                    patch_report.add(str(f), wf, tw, str(out_dir / f.relative_to(in_dir)))
+                
+                # ファイル出力（一時ファイル経由でアトミックに書き込み）
+                if not args.dry_run and r['changed']:
+                    writer.write_json(out_dir / f.relative_to(in_dir), tw)
+                
+                # ノード単位の変更を記録し、ファイル完了をマーク
+                for rec in r['records']:
+                    sink.write(file=rel, **rec)
+                sink.complete_file(rel, name=r['name'], changed=r['changed'], changes=len(r['records']))
+                    
+            except json.JSONDecodeError as e:
+                errors.append(f"{f.name}: JSON parse error - {e}")
+                print(f"✗ {f.name}: JSON parse error")
+            except Exception as e:
+                errors.append(f"{f.name}: {e}")
+                print(f"✗ {f.name}: {e}")
     
     # サマリー
-    changed = sum(1 for r in results if r['changed'])
     print(f"\n{'='*60}")
     print(f"Summary")
     print(f"{'='*60}")
-    print(f"Total processed: {len(results)}")
+    if sink.stats['resumed']:
+        print(f"Resumed (skipped): {sink.stats['resumed']}")
+    print(f"Total processed: {processed}")
     print(f"Changed:         {changed}")
     print(f"Errors:          {len(errors)}")
     print(f"{'='*60}")
@@ -217,17 +260,11 @@ def main():
         if len(errors) > 10:
             print(f"  ... and {len(errors) - 10} more errors")
     
-    # CSV出力
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    csv_path = f"n3_v83_mapping_{timestamp}.csv"
-    
-    with open(csv_path, 'w', newline='', encoding='utf-8') as cf:
-        w = csv.writer(cf)
-        w.writerow(['Path', 'Name', 'Changed', 'Changes'])
-        for r in results:
-            w.writerow([r['path'], r['name'], r['changed'], '; '.join(r['changes'])])
+    print(f"\nReport: {report_path} ({sink.stats['records']} change records)")
     
-    print(f"\nCSV Report: {csv_path}")
+    if patch_report:
+        patch_report.close()
+        print(f"Patch Report: {args.patch_report} ({patch_report.summary['changed']} files, {patch_report.summary['operations']} ops)")
     
     if not args.dry_run and changed > 0:
         print(f"\n✅ {changed} files written to {out_dir}")